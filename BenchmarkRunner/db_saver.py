@@ -1,47 +1,275 @@
 import duckdb
 from duckdb import DuckDBPyConnection
+import io
 import os
 from typing import Any, Dict, List, Optional, Tuple
 from dataclasses import dataclass, field
+from pathlib import Path
 import glob
 import polars as pl
 
 from test_case import *
+from result_sink import RESULT_SUFFIX, RUN_METADATA_SUFFIX, read_new_lines
 from definitions import *
 
+UPLOAD_MANIFEST = "upload_manifest.json"
+
+SAMPLE_SCHEMA = {
+    "run_id": pl.Utf8,
+    "query_id": pl.Utf8,
+    "variation_id": pl.Int64,
+    "round": pl.Int32,
+    "sample": pl.Int32,
+    "duration": pl.Float64,
+    "status": pl.Utf8,
+    "cache_mode": pl.Utf8,
+    "cpu_user_time": pl.Float64,
+    "cpu_system_time": pl.Float64,
+    "peak_rss_bytes": pl.Int64,
+    "read_bytes": pl.Int64,
+    "write_bytes": pl.Int64,
+    "spill_bytes": pl.Int64,
+    "planning_time": pl.Float64,
+    "optimizer_time": pl.Float64,
+    "query_hash": pl.Utf8,
+}
+
+# per result resource measurements, repeated on each of its samples
+RESOURCE_COLUMNS = {
+    "cpu_user_time": "DOUBLE",
+    "cpu_system_time": "DOUBLE",
+    "peak_rss_bytes": "BIGINT",
+    "read_bytes": "BIGINT",
+    "write_bytes": "BIGINT",
+    "spill_bytes": "BIGINT",
+}
+
+# per result planner measurements and the hash of the query text, repeated on each of its samples
+PLANNING_COLUMNS = {
+    "planning_time": "DOUBLE",
+    "optimizer_time": "DOUBLE",
+    "query_hash": "VARCHAR",
+}
+
+
+# the fields of a result record the samples are read from, fields missing from older records are null
+RESULT_SCHEMA = {
+    "query_id": pl.Utf8,
+    "variation_id": pl.Utf8,
+    "round": pl.Int32,
+    "duration": pl.Float64,
+    "samples": pl.List(pl.Float64),
+    "status": pl.Utf8,
+    "cache_mode": pl.Utf8,
+    **{column: SAMPLE_SCHEMA[column] for column in [*RESOURCE_COLUMNS, *PLANNING_COLUMNS]},
+}
+
+
+def _read_result_records(data: bytes) -> pl.DataFrame:
+    try:
+        return pl.read_ndjson(io.BytesIO(data), schema=RESULT_SCHEMA)
+    except pl.exceptions.ComputeError:
+        # a line truncated by a crash before the run was resumed, rare enough to drop it line by line
+        lines = []
+        for line in data.splitlines():
+            try:
+                json.loads(line)
+                lines.append(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping truncated result line {line[:80]!r}")
+        return pl.read_ndjson(io.BytesIO(b"\n".join(lines)), schema=RESULT_SCHEMA)
+
+
+def read_samples(data: bytes, run_id: str) -> pl.DataFrame:
+    """ the samples of the ndjson result records in data, one row per repetition of every measured result """
+    return (
+        _read_result_records(data).lazy()
+        .filter(pl.col("status") != QueryRunStatus.SKIPPED.name)
+        .with_row_index("result")
+        # older result files only hold a single duration per variation
+        .with_columns(
+            pl.when(pl.col("samples").list.len() > 0)
+            .then(pl.col("samples"))
+            .otherwise(pl.concat_list(pl.col("duration")))
+            .alias("samples")
+        )
+        .explode("samples")
+        .with_columns(pl.int_range(pl.len()).over("result").alias("sample"))
+        .with_columns(
+            pl.lit(run_id).alias("run_id"),
+            pl.col("samples").alias("duration"),
+            # see sample_rows
+            pl.when(pl.col("sample") == pl.len().over("result") - 1)
+            .then(pl.col("status"))
+            .otherwise(pl.lit(QueryRunStatus.SUCCESS.name))
+            .alias("status"),
+            pl.col("round").fill_null(0),
+            pl.col("cache_mode").fill_null(CacheMode.SHARED.name),
+        )
+        .select([pl.col(column).cast(column_type) for column, column_type in SAMPLE_SCHEMA.items()])
+        .collect()
+    )
+
+
+def sample_rows(run_id: str, query_id: str, timed_variation: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """ the samples of a result of the json files written before the ndjson sink """
+    if timed_variation["status"] == QueryRunStatus.SKIPPED.name:
+        return []
+
+    # older result files only hold a single duration per variation
+    samples = timed_variation.get("samples") or [timed_variation["duration"]]
+    # repetitions stop at the first error, so only the last sample of a timed out or failed variation is the
+    # error, the repetitions before it succeeded
+    last = len(samples) - 1
+    return [
+        {
+            "run_id": run_id,
+            "query_id": query_id,
+            "variation_id": int(timed_variation["variation_id"]),
+            "round": timed_variation.get("round", 0),
+            "sample": sample_index,
+            "duration": float(sample),
+            "status": timed_variation["status"] if sample_index == last else QueryRunStatus.SUCCESS.name,
+            # results from before cache modes ran on a single shared connection
+            "cache_mode": timed_variation.get("cache_mode") or CacheMode.SHARED.name,
+            **{column: timed_variation.get(column) for column in RESOURCE_COLUMNS},
+            **{column: timed_variation.get(column) for column in PLANNING_COLUMNS},
+        }
+        for sample_index, sample in enumerate(samples)
+    ]
+
+
+def _manifest_path(optimizer: Optimizer, test_case: TestCase) -> str:
+    return os.path.join(RESULT_ROOT, test_case.benchmark, optimizer.to_string(), UPLOAD_MANIFEST)
 
-def save_timed_results_in_md(optimizer: Optimizer, test_case: TestCase):
-    results_folder = os.path.join(RESULT_ROOT, test_case.benchmark, optimizer.to_string(), "timed_results")
-    result_files = glob.glob(str(results_folder) + "/*.json")
 
-    # combined_results: Dict[str, Dict[int, List[float]]] = {}
-    combined_results = []
+def _load_manifest(path: str) -> Dict[str, int]:
+    """ bytes of every result file that have already been uploaded """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
 
-    for result_file in result_files:
+
+def _save_manifest(path: str, manifest: Dict[str, int]):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def _collect_new_samples(results_folder: str, manifest: Dict[str, int]) -> Tuple[pl.DataFrame, Dict[str, int]]:
+    """ samples written since the last upload, and the manifest to record once they are uploaded """
+    manifest = dict(manifest)
+    frames = []
+
+    for result_file in glob.glob(str(results_folder) + "/*" + RESULT_SUFFIX):
+        name = os.path.basename(result_file)
+        if manifest.get(name, 0) == os.path.getsize(result_file):
+            continue
+        data, manifest[name] = read_new_lines(result_file, manifest.get(name, 0))
+        frames.append(read_samples(data, Path(result_file).stem))
+
+    # results written before the streaming sink, one json document per run
+    rows = []
+    for result_file in glob.glob(str(results_folder) + "/*.json"):
+        name = os.path.basename(result_file)
+        if name.endswith(RUN_METADATA_SUFFIX):
+            continue
+        if manifest.get(name) == os.path.getsize(result_file):
+            continue
         with open(result_file) as f:
             results = json.load(f)
             for query_id, timed_variations in results.items():
                 for timed_variation in timed_variations:
-                    combined_results.append({
-                        "query_id": query_id,
-                        "variation_id": int(timed_variation["variation_id"]),
-                        "duration": float(timed_variation["duration"])
-                    })
-
-    df = pl.DataFrame(combined_results)
-    df = df.group_by(["query_id", "variation_id"]).agg(
-        [
-            pl.col("duration").mean().alias("mean"),
-            pl.col("duration").std().alias("std")
-        ]
+                    rows.extend(sample_rows(Path(result_file).stem, query_id, timed_variation))
+        manifest[name] = os.path.getsize(result_file)
+
+    return pl.concat([*frames, pl.DataFrame(rows, schema=SAMPLE_SCHEMA)]), manifest
+
+
+def _aggregate_sql(samples_table: str) -> str:
+    # timed out samples are censored at the timeout, they are counted but kept out of the statistics
+    return f"""
+    WITH succeeded AS (
+        SELECT * FROM {samples_table} WHERE status = '{QueryRunStatus.SUCCESS.name}'
+    ), bounds AS (
+        SELECT query_id, variation_id, cache_mode,
+               quantile_cont(duration, 0.05) AS lower_bound,
+               quantile_cont(duration, 0.95) AS upper_bound
+        FROM succeeded
+        GROUP BY query_id, variation_id, cache_mode
     )
+    SELECT s.query_id,
+           s.variation_id,
+           s.cache_mode,
+           avg(s.duration) FILTER (WHERE s.status = '{QueryRunStatus.SUCCESS.name}') AS mean,
+           stddev_samp(s.duration) FILTER (WHERE s.status = '{QueryRunStatus.SUCCESS.name}') AS std,
+           median(s.duration) FILTER (WHERE s.status = '{QueryRunStatus.SUCCESS.name}') AS median,
+           quantile_cont(s.duration, 0.9) FILTER (WHERE s.status = '{QueryRunStatus.SUCCESS.name}') AS p90,
+           quantile_cont(s.duration, 0.99) FILTER (WHERE s.status = '{QueryRunStatus.SUCCESS.name}') AS p99,
+           min(s.duration) FILTER (WHERE s.status = '{QueryRunStatus.SUCCESS.name}') AS min,
+           avg(s.duration) FILTER (WHERE s.status = '{QueryRunStatus.SUCCESS.name}'
+                                   AND s.duration BETWEEN b.lower_bound AND b.upper_bound) AS trimmed_mean,
+           median(s.cpu_user_time) AS cpu_user_time,
+           median(s.cpu_system_time) AS cpu_system_time,
+           max(s.peak_rss_bytes) AS peak_rss_bytes,
+           median(s.read_bytes) AS read_bytes,
+           median(s.write_bytes) AS write_bytes,
+           max(s.spill_bytes) AS spill_bytes,
+           median(s.planning_time) AS planning_time,
+           median(s.optimizer_time) AS optimizer_time,
+           any_value(s.query_hash) AS query_hash,
+           count(*) FILTER (WHERE s.status = '{QueryRunStatus.SUCCESS.name}') AS runs,
+           count(*) FILTER (WHERE s.status = '{QueryRunStatus.TIMEOUT.name}') AS timeouts
+    FROM {samples_table} s
+    LEFT JOIN bounds b
+           ON s.query_id = b.query_id AND s.variation_id = b.variation_id AND s.cache_mode = b.cache_mode
+    GROUP BY s.query_id, s.variation_id, s.cache_mode
+    """
 
-    os.environ["OPTIMIZER"] = "HEURISTIC"
-    conn = motherduck.connect(MD_PREFIX + "benchmark",
-                              additional_config={"motherduck_token": os.getenv("TOKEN_PROD")},)
+
+def save_timed_results_in_md(optimizer: Optimizer, test_case: TestCase):
+    """
+    appends the samples written since the last upload to <benchmark>.<optimizer>_samples,
+    replacing earlier uploads of the same (run, query, variation, round), and recomputes the
+    <benchmark>.<optimizer> aggregates per cache mode from all samples inside the engine
+    """
+    manifest_path = _manifest_path(optimizer, test_case)
+    df, manifest = _collect_new_samples(test_case.results_folder(optimizer), _load_manifest(manifest_path))
+    keys = df.select(["run_id", "query_id", "variation_id", "round"]).unique()
+
+    table = f"{test_case.benchmark}.{optimizer.to_string().lower()}"
+    samples_table = f"{table}_samples"
+
+    conn = test_case.result_store.connect()
 
     conn.sql(f"CREATE SCHEMA IF NOT EXISTS {test_case.benchmark}")
-    conn.sql(f"CREATE or replace table {test_case.benchmark}.{optimizer.to_string().lower()} AS SELECT * FROM df")
+    conn.sql(f"""
+    CREATE TABLE IF NOT EXISTS {samples_table} (
+        run_id VARCHAR, query_id VARCHAR, variation_id BIGINT, round INTEGER, sample INTEGER,
+        duration DOUBLE, status VARCHAR, cache_mode VARCHAR
+    )""")
+    conn.sql(f"ALTER TABLE {samples_table} ADD COLUMN IF NOT EXISTS round INTEGER DEFAULT 0")
+    conn.sql(f"ALTER TABLE {samples_table} ADD COLUMN IF NOT EXISTS cache_mode VARCHAR "
+             f"DEFAULT '{CacheMode.SHARED.name}'")
+    for column, column_type in {**RESOURCE_COLUMNS, **PLANNING_COLUMNS}.items():
+        conn.sql(f"ALTER TABLE {samples_table} ADD COLUMN IF NOT EXISTS {column} {column_type}")
 
-    conn.close()
+    if len(df):
+        logger.info(f"Uploading {len(df)} new samples to {samples_table}")
+        conn.register("df", df)
+        conn.register("keys", keys)
+        conn.sql(f"""
+        DELETE FROM {samples_table} USING keys
+        WHERE {samples_table}.run_id = keys.run_id
+          AND {samples_table}.query_id = keys.query_id
+          AND {samples_table}.variation_id = keys.variation_id
+          AND {samples_table}.round = keys.round
+        """)
+        conn.sql(f"INSERT INTO {samples_table} BY NAME SELECT * FROM df")
+
+    conn.sql(f"CREATE or replace table {table} AS {_aggregate_sql(samples_table)}")
 
+    conn.close()
+    _save_manifest(manifest_path, manifest)
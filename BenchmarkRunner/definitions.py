@@ -4,7 +4,10 @@ MD_PREFIX = "md:"
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 QUERY_ROOT = f"../SampleData/permuted_queries"
+BASE_QUERY_ROOT = "../SampleData/base_queries"
 INDEX_ROOT = "../Indexes"
 RESULT_ROOT = "../Results"
 
+LOCAL_DATABASE = "~/local_v112.db"
+
 
@@ -0,0 +1,205 @@
+import os
+import re
+import json
+import glob
+import logging
+from pathlib import Path
+from typing import Dict, List
+import polars as pl
+
+from definitions import *
+from optimizer import *
+from db_saver import SAMPLE_SCHEMA, read_samples
+from result_sink import RESULT_SUFFIX, read_new_lines, read_run_metadata
+from logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+HISTORY_ROOT = os.path.join(RESULT_ROOT, "history")
+HISTORY_MANIFEST = "manifest.json"
+HISTORY_SCHEMA = {
+    "benchmark": pl.Utf8,
+    "optimizer": pl.Utf8,
+    "commit": pl.Utf8,
+    "started_at": pl.Utf8,
+    **SAMPLE_SCHEMA,
+}
+VARIATION_KEY = ["query_id", "variation_id"]
+UNKNOWN_COMMIT = "unknown"
+
+
+def _partition_value(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", value)
+
+
+def partition_folder(benchmark: str, optimizer: str, run_id: str, commit: str) -> str:
+    return os.path.join(
+        HISTORY_ROOT,
+        f"benchmark={_partition_value(benchmark)}",
+        f"optimizer={_partition_value(optimizer)}",
+        f"run={_partition_value(run_id)}",
+        f"commit={_partition_value(commit)}",
+    )
+
+
+def _load_manifest() -> Dict[str, int]:
+    """ size of every result file at the time it was last ingested """
+    path = os.path.join(HISTORY_ROOT, HISTORY_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest: Dict[str, int]):
+    os.makedirs(HISTORY_ROOT, exist_ok=True)
+    with open(os.path.join(HISTORY_ROOT, HISTORY_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=4)
+
+
+def ingest_runs(benchmark: str, optimizer: Optimizer) -> int:
+    """
+    copies the samples of every run of the optimizer into the history store, one parquet file per run.
+    runs that grew since they were ingested, e.g. after a resume, are rewritten as a whole.
+    returns the number of ingested runs
+    """
+    results_folder = os.path.join(RESULT_ROOT, benchmark, optimizer.to_string(), "timed_results")
+    manifest = _load_manifest()
+    ingested = 0
+
+    for result_file in sorted(glob.glob(os.path.join(results_folder, "*" + RESULT_SUFFIX))):
+        if manifest.get(result_file) == os.path.getsize(result_file):
+            continue
+        size = os.path.getsize(result_file)
+        run_id = Path(result_file).stem
+        metadata = read_run_metadata(results_folder, run_id)
+        commit = metadata.get("extension_version") or UNKNOWN_COMMIT
+
+        data, _ = read_new_lines(result_file, 0)
+        samples = read_samples(data, run_id).with_columns(
+            pl.lit(benchmark).alias("benchmark"),
+            pl.lit(optimizer.to_string()).alias("optimizer"),
+            pl.lit(commit).alias("commit"),
+            pl.lit(metadata.get("started_at") or run_id).alias("started_at"),
+        ).select(list(HISTORY_SCHEMA))
+
+        folder = partition_folder(benchmark, optimizer.to_string(), run_id, commit)
+        os.makedirs(folder, exist_ok=True)
+        samples.write_parquet(os.path.join(folder, "samples.parquet"))
+        manifest[result_file] = size
+        ingested += 1
+
+    _save_manifest(manifest)
+    logger.info(f"Ingested {ingested} runs of {benchmark}/{optimizer.to_string()} into the history")
+    return ingested
+
+
+def scan_history(benchmark: str) -> pl.LazyFrame:
+    files = glob.glob(os.path.join(HISTORY_ROOT, f"benchmark={_partition_value(benchmark)}", "**", "*.parquet"),
+                      recursive=True)
+    if not files:
+        return pl.LazyFrame(schema=HISTORY_SCHEMA)
+    return pl.scan_parquet(files)
+
+
+def _normal_two_sided_p(z: pl.Expr) -> pl.Expr:
+    """ 2 * (1 - Phi(|z|)) = erfc(|z| / sqrt(2)), using the Numerical Recipes erfc approximation (error < 1.2e-7) """
+    x = z.abs() / 2 ** 0.5
+    t = 1.0 / (1.0 + 0.5 * x)
+    coefficients = [-1.26551223, 1.00002368, 0.37409196, 0.09678418, -0.18628806,
+                     0.27886807, -1.13520398, 1.48851587, -0.82215223, 0.17087277]
+    polynomial = pl.lit(coefficients[-1])
+    for coefficient in reversed(coefficients[:-1]):
+        polynomial = coefficient + t * polynomial
+    return t * (-x * x + polynomial).exp()
+
+
+def compare_samples(samples: pl.LazyFrame, key: List[str]) -> pl.LazyFrame:
+    """
+    two-sided mann-whitney u test of the candidate against the baseline durations of every group in key,
+    computed for all groups at once with the normal approximation including the tie correction.
+    samples holds key, a boolean column candidate and duration.
+    speedup is the baseline median divided by the candidate median, below one when the candidate got slower
+    """
+    ranked = samples.with_columns(pl.col("duration").rank("average").over(key).alias("rank"))
+    # sum of t^3 - t over the groups of t tied durations
+    ties = samples.group_by([*key, "duration"]).len().group_by(key).agg(
+        (pl.col("len").cast(pl.Float64) ** 3 - pl.col("len")).sum().alias("ties")
+    )
+    n1 = pl.col("n_candidate")
+    n2 = pl.col("n_baseline")
+    n = n1 + n2
+    return ranked.group_by(key).agg(
+        pl.col("candidate").sum().cast(pl.Float64).alias("n_candidate"),
+        (~pl.col("candidate")).sum().cast(pl.Float64).alias("n_baseline"),
+        pl.col("rank").filter(pl.col("candidate")).sum().alias("rank_sum"),
+        pl.col("duration").filter(pl.col("candidate")).median().alias("candidate_median"),
+        pl.col("duration").filter(~pl.col("candidate")).median().alias("baseline_median"),
+    ).filter(
+        (n1 > 0) & (n2 > 0)
+    ).join(
+        ties, on=key
+    ).with_columns(
+        (pl.col("rank_sum") - n1 * (n1 + 1) / 2).alias("u"),
+        (pl.col("baseline_median") / pl.col("candidate_median")).alias("speedup"),
+    ).with_columns(
+        ((pl.col("u") - n1 * n2 / 2) / (n1 * n2 / 12 * ((n + 1) - pl.col("ties") / (n * (n - 1)))).sqrt())
+        .fill_nan(0.0).alias("z"),
+    ).with_columns(
+        _normal_two_sided_p(pl.col("z")).alias("p_value"),
+    ).drop("rank_sum", "ties")
+
+
+def _latest_runs(history: pl.LazyFrame) -> pl.LazyFrame:
+    """ the latest and the previous run of every optimizer """
+    return history.select("optimizer", "run_id", "started_at").unique().with_columns(
+        pl.col("started_at").rank("ordinal", descending=True).over("optimizer").alias("recency")
+    ).filter(pl.col("recency") <= 2)
+
+
+def regression_report(
+        benchmark: str,
+        baseline: Optimizer = Optimizer.from_name("og"),
+        alpha: float = 0.05,
+        min_slowdown: float = 1.05
+) -> pl.DataFrame:
+    """
+    compares the latest run of every optimizer against the latest baseline run and against its own previous
+    run, and flags the variations that got significantly slower by at least min_slowdown.
+    the report is written to Results/<benchmark>/regression_report.csv
+    """
+    history = scan_history(benchmark).filter(pl.col("status") == "SUCCESS")
+    runs = _latest_runs(history)
+    latest = history.join(runs.filter(pl.col("recency") == 1), on=["optimizer", "run_id", "started_at"])
+    previous = history.join(runs.filter(pl.col("recency") == 2), on=["optimizer", "run_id", "started_at"])
+
+    baseline_name = baseline.to_string()
+    columns = ["optimizer", "commit", *VARIATION_KEY, "duration"]
+    candidates = latest.filter(pl.col("optimizer") != baseline_name).select(columns)
+    against_baseline = pl.concat([
+        candidates.with_columns(pl.lit(True).alias("candidate")),
+        candidates.select("optimizer").unique().join(
+            latest.filter(pl.col("optimizer") == baseline_name).select(pl.exclude("optimizer")), how="cross"
+        ).select(columns).with_columns(pl.lit(False).alias("candidate")),
+    ]).with_columns(pl.lit(baseline_name).alias("compared_to"))
+    against_previous = pl.concat([
+        latest.select(columns).with_columns(pl.lit(True).alias("candidate")),
+        previous.select(columns).with_columns(pl.lit(False).alias("candidate")),
+    ]).with_columns(pl.lit("previous run").alias("compared_to"))
+
+    key = ["compared_to", "optimizer", *VARIATION_KEY]
+    report = compare_samples(
+        pl.concat([against_baseline, against_previous]).drop("commit"), key
+    ).join(
+        latest.select("optimizer", "commit").unique(), on="optimizer", how="left"
+    ).with_columns(
+        ((pl.col("p_value") < alpha) & (pl.col("speedup") <= 1 / min_slowdown)).alias("regression")
+    ).sort(key).collect()
+
+    path = os.path.join(RESULT_ROOT, benchmark, "regression_report.csv")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    report.write_csv(path)
+    regressions = report.filter(pl.col("regression"))
+    logger.info(f"{len(regressions)} of {len(report)} compared variations of {benchmark} regressed, see {path}")
+    return report
@@ -1,15 +1,213 @@
-from run import *
-
+import os
+import json
 import argparse
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Make end to end sql script with given benchmark and optimizer')
-    parser.add_argument('-b', '--benchmark', type=str, help='Benchmark to be used')
-    parser.add_argument('-o', '--optimizer', type=str, help='Optimizer to be used')
-    parser.add_argument('-e', '--explain', type=bool, help='Make explain script')
+from definitions import *
+from optimizer import *
+
+# every subcommand imports what it needs when it runs, so that --help and cheap commands
+# such as listing indexes or diffing stored plans do not pay for duckdb, polars or the runner
+
+
+def _optimizers(names):
+    if not names:
+        return OPTIMIZERS
+    optimizers = [Optimizer.from_name(name) for name in names]
+    if None in optimizers:
+        raise SystemExit(f"Unknown optimizer in {names}, expected og, cd, ts, ds or ds_simplified")
+    return optimizers
+
+
+def _test_case(args):
+    import motherduck
+    from test_case import TestCase
+    from query_catalog import CatalogConfig
+
+    return TestCase(
+        benchmark=args.benchmark,
+        raise_on_error=True,
+        run_id=args.run_id,
+        backend=motherduck.backend_from_name(args.backend),
+        result_store=motherduck.result_store_from_name(args.result_store),
+        catalog=CatalogConfig(rebuild=args.rebuild_catalog) if getattr(args, "catalog", False) else None,
+        prepare_statements=getattr(args, "prepare", False),
+    )
+
+
+def list_indexes(args):
+    benchmarks = [args.benchmark] if args.benchmark else sorted(os.listdir(INDEX_ROOT)) if os.path.isdir(INDEX_ROOT) else []
+    for benchmark in benchmarks:
+        folder = os.path.join(INDEX_ROOT, benchmark)
+        if not os.path.isdir(folder):
+            continue
+        for file_name in sorted(os.listdir(folder)):
+            if not file_name.endswith(".json"):
+                continue
+            with open(os.path.join(folder, file_name)) as f:
+                index = json.load(f)
+            print(f"{benchmark}\t{file_name[:-len('.json')]}\t{len(index)} queries\t"
+                  f"{sum(map(len, index.values()))} variations")
+
+
+def diff(args):
+    from plan_index import PlanIndex
+
+    baseline = Optimizer.from_name(args.baseline)
+    plan_index = PlanIndex.load()
+    refreshed = plan_index.refresh(args.benchmark, baseline)
+    for optimizer in _optimizers(args.optimizer):
+        if optimizer == baseline:
+            continue
+        refreshed += plan_index.refresh(args.benchmark, optimizer)
+        differing = plan_index.differing_variations(args.benchmark, optimizer, baseline)
+        print(f"{optimizer.to_string()}\t{len(differing)} queries\t"
+              f"{sum(map(len, differing.values()))} variations differ from {baseline.to_string()}")
+        if args.verbose:
+            for query_id, variation_ids in differing.items():
+                print(f"  {query_id}: {', '.join(map(str, variation_ids))}")
+    if refreshed:
+        plan_index.save()
+
+
+def explain(args):
+    import run
+
+    test_case = _test_case(args)
+    for optimizer in _optimizers(args.optimizer):
+        run._run_test_case(optimizer, test_case, explain=True)
+
+
+def run_benchmark(args):
+    import run
+
+    test_case = _test_case(args)
+    if args.optimizer:
+        for optimizer in _optimizers(args.optimizer):
+            run._run_test_case(optimizer, test_case)
+        return
+
+    parallel = interleaved = None
+    if args.parallel:
+        parallel = run.ParallelConfig(max_workers=args.parallel)
+    if args.interleaved:
+        interleaved = run.InterleaveConfig(rounds=args.interleaved, seed=args.seed)
+    run._end_to_end_run(test_case, parallel, args.cost_threshold, interleaved)
+
+
+def upload(args):
+    from db_saver import save_timed_results_in_md
 
-    # Parse the arguments
-    args = parser.parse_args()
+    test_case = _test_case(args)
+    for optimizer in _optimizers(args.optimizer):
+        save_timed_results_in_md(optimizer, test_case)
 
-    run_test_case(args.optimizer, args.benchmark, args.explain)
 
+def sweep(args):
+    from sweep import SweepConfig, bridge_cost_range, successive_halving
+
+    bridge_costs = args.bridge_costs or bridge_cost_range(*args.bridge_cost_range)
+    estimation_functions = [EstimationFunction[name.upper()] for name in args.estimation] \
+        if args.estimation else list(EstimationFunction)
+    config = SweepConfig(
+        bridge_costs=bridge_costs,
+        estimation_functions=estimation_functions,
+        initial_sample=args.initial_sample,
+        keep_fraction=args.keep_fraction,
+        seed=args.seed,
+    )
+    for round_index, scores in enumerate(successive_halving(_test_case(args), config)):
+        print(f"round {round_index} on {scores['variations']} variations: {json.dumps(scores['scores'])}")
+
+
+def scale(args):
+    from scaling import ScaleDatabase, ScalingConfig, analyze_scaling, run_scaling, save_scaling
+
+    test_case = _test_case(args)
+    config = ScalingConfig(databases=[ScaleDatabase.parse(value) for value in args.databases],
+                           optimizers=_optimizers(args.optimizer), baseline=Optimizer.from_name(args.baseline))
+    folder = run_scaling(test_case, config)
+    _, crossings = analyze_scaling(folder)
+    print(crossings)
+    if args.upload:
+        save_scaling(test_case, folder)
+
+
+def report(args):
+    from history import ingest_runs, regression_report
+
+    for optimizer in OPTIMIZERS:
+        ingest_runs(args.benchmark, optimizer)
+    result = regression_report(args.benchmark, Optimizer.from_name(args.baseline), args.alpha, args.min_slowdown)
+    print(result.filter(result["regression"]))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark join order optimizers on permuted queries")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_command(name, handler, help, connects=False):
+        subparser = subparsers.add_parser(name, help=help)
+        subparser.set_defaults(handler=handler)
+        subparser.add_argument("-b", "--benchmark", type=str, required=name != "indexes", help="tpch, tpcds or job")
+        if connects:
+            subparser.add_argument("--backend", default="md", help="md or local, in-process duckdb")
+            subparser.add_argument("--result-store", default="md", help="md or local, Results/results.duckdb")
+            subparser.add_argument("--run-id", default=None, help="id of an interrupted run to resume")
+        return subparser
+
+    add_command("indexes", list_indexes, "list the differentiating variation indexes")
+
+    diff_parser = add_command("diff", diff, "compare stored plans of optimizers against a baseline")
+    diff_parser.add_argument("-o", "--optimizer", nargs="*", help="optimizers to compare, all by default")
+    diff_parser.add_argument("--baseline", default="og")
+    diff_parser.add_argument("-v", "--verbose", action="store_true", help="list the differing variations")
+
+    explain_parser = add_command("explain", explain, "store the plan of every variation", connects=True)
+    explain_parser.add_argument("-o", "--optimizer", nargs="*", help="optimizers to explain, all by default")
+
+    run_parser = add_command("run", run_benchmark, "time the differentiating variations", connects=True)
+    run_parser.add_argument("-o", "--optimizer", nargs="*",
+                            help="time only these optimizers, the whole end to end run by default")
+    run_parser.add_argument("--parallel", type=int, default=None, help="worker processes, one per optimizer")
+    run_parser.add_argument("--interleaved", type=int, default=None, help="interleaved rounds per variation")
+    run_parser.add_argument("--seed", type=int, default=None)
+    run_parser.add_argument("--cost-threshold", type=float, default=None,
+                            help="skip variations whose predicted cost gap is below this")
+    run_parser.add_argument("--catalog", action="store_true",
+                            help="read variations from the preloaded query catalog instead of one file each")
+    run_parser.add_argument("--rebuild-catalog", action="store_true", help="rebuild the catalog before reading it")
+    run_parser.add_argument("--prepare", action="store_true",
+                            help="plan every variation once and time only its executions")
+
+    upload_parser = add_command("upload", upload, "upload new samples to the result store", connects=True)
+    upload_parser.add_argument("-o", "--optimizer", nargs="*", help="optimizers to upload, all by default")
+
+    sweep_parser = add_command("sweep", sweep, "tune the bridge cost with successive halving", connects=True)
+    bridge_costs = sweep_parser.add_mutually_exclusive_group(required=True)
+    bridge_costs.add_argument("--bridge-costs", type=int, nargs="+")
+    bridge_costs.add_argument("--bridge-cost-range", type=int, nargs=3, metavar=("START", "STOP", "NUM"),
+                              help="NUM geometrically spaced bridge costs")
+    sweep_parser.add_argument("--estimation", nargs="*", help="estimation functions, all by default")
+    sweep_parser.add_argument("--initial-sample", type=int, default=50)
+    sweep_parser.add_argument("--keep-fraction", type=float, default=0.5)
+    sweep_parser.add_argument("--seed", type=int, default=None)
+
+    scale_parser = add_command("scale", scale, "fit runtime against scale factor over several databases",
+                               connects=True)
+    scale_parser.add_argument("--databases", nargs="+", required=True, metavar="SF=PATH",
+                              help="scale factor and database of each step, eg. 1=~/tpch_sf1.db 10=~/tpch_sf10.db")
+    scale_parser.add_argument("-o", "--optimizer", nargs="*", help="optimizers to time, all by default")
+    scale_parser.add_argument("--baseline", default="og", help="optimizer whose curves the others cross")
+    scale_parser.add_argument("--upload", action="store_true", help="store the curves in the result store")
+
+    report_parser = add_command("report", report, "flag regressions against the baseline and the previous run")
+    report_parser.add_argument("--baseline", default="og")
+    report_parser.add_argument("--alpha", type=float, default=0.05)
+    report_parser.add_argument("--min-slowdown", type=float, default=1.05)
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    args.handler(args)
@@ -2,8 +2,14 @@ import duckdb
 from duckdb import DuckDBPyConnection
 
 import os
+import queue
+import hashlib
 import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional, Union
 
+from definitions import *
 from logging_config import setup_logging
 
 setup_logging()
@@ -28,13 +34,146 @@ def connect(connection_string=None, additional_config={}):
         print(e)
 
 
-def attach(conn: DuckDBPyConnection, path: str, alias: str):
-    logger.info(f"Attaching {path} as {alias}")
+def attach(conn: DuckDBPyConnection, path: str, alias: str, read_only: bool = False):
+    logger.info(f"Attaching {path} as {alias}{' read only' if read_only else ''}")
     path = path.strip()
-    conn.sql("ATTACH '" + path + "' AS " + alias)
+    conn.sql("ATTACH '" + path + "' AS " + alias + (" (READ_ONLY)" if read_only else ""))
 
 
 def detach(conn: DuckDBPyConnection, path: str):
     logger.info(f"Detaching {path}")
     path = path.strip()
     conn.sql("DETACH " + path)
+
+
+@dataclass
+class MotherDuckBackend:
+    """ queries run through the motherduck extension, which carries the optimizer, with the database attached """
+    connection_string: str = MD_PREFIX
+    database: str = LOCAL_DATABASE
+    alias: str = "local"
+    # a local file attached read write is locked by the first process, so concurrent workers attach it read only.
+    # only a single process that modifies the benchmark data should set this to False
+    read_only: bool = True
+
+    def connect(self) -> DuckDBPyConnection:
+        conn = connect(self.connection_string)
+        attach(conn, self.database, self.alias, self.read_only)
+        return conn
+
+    def extension_version(self, conn: DuckDBPyConnection) -> Optional[str]:
+        row = conn.execute(
+            "SELECT extension_version FROM duckdb_extensions() WHERE extension_name = 'motherduck'"
+        ).fetchone()
+        return row[0] if row else None
+
+
+@dataclass
+class LocalBackend:
+    """
+    queries run in an in-process duckdb without any network round trip.
+    the optimizer is loaded from a locally built extension, without one duckdb's own optimizer runs
+    """
+    database: str = LOCAL_DATABASE
+    alias: str = "local"
+    extension: Optional[str] = None  # path of the optimizer's .duckdb_extension file
+    read_only: bool = True  # see MotherDuckBackend.read_only
+
+    def connect(self) -> DuckDBPyConnection:
+        config = {"allow_unsigned_extensions": "true"} if self.extension else {}
+        logger.info(f"Opening in-process duckdb {duckdb.__version__} with extension {self.extension}")
+        conn = duckdb.connect(":memory:", config=config)
+        if self.extension:
+            conn.execute(f"LOAD '{os.path.expanduser(self.extension)}'")
+        attach(conn, os.path.expanduser(self.database), self.alias, self.read_only)
+        return conn
+
+    def extension_version(self, conn: DuckDBPyConnection) -> Optional[str]:
+        """ local builds rarely bump their version, so the extension file itself is hashed """
+        if not self.extension:
+            return f"duckdb-{duckdb.__version__}"
+        digest = hashlib.blake2b(digest_size=8)
+        with open(os.path.expanduser(self.extension), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+Backend = Union[MotherDuckBackend, LocalBackend]
+
+
+@dataclass
+class MotherDuckResultStore:
+    """ aggregated results are uploaded to a motherduck database """
+    database: str = "benchmark"
+
+    def connect(self) -> DuckDBPyConnection:
+        # the result database is written with the stock optimizer
+        os.environ["OPTIMIZER"] = "HEURISTIC"
+        return connect(MD_PREFIX + self.database,
+                       additional_config={"motherduck_token": os.getenv("TOKEN_PROD")})
+
+
+@dataclass
+class LocalResultStore:
+    """ aggregated results are written to a local duckdb file """
+    path: str = os.path.join(RESULT_ROOT, "results.duckdb")
+
+    def connect(self) -> DuckDBPyConnection:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        return duckdb.connect(self.path)
+
+
+ResultStore = Union[MotherDuckResultStore, LocalResultStore]
+
+
+def backend_from_name(name: str) -> Backend:
+    """ md runs through motherduck, local in-process with the extension at $OPTIMIZER_EXTENSION """
+    if name.lower() in ("md", "motherduck"):
+        return MotherDuckBackend()
+    elif name.lower() == "local":
+        return LocalBackend(extension=os.getenv("OPTIMIZER_EXTENSION"))
+    raise ValueError(f"Unknown backend {name}")
+
+
+def result_store_from_name(name: str) -> ResultStore:
+    if name.lower() in ("md", "motherduck"):
+        return MotherDuckResultStore()
+    elif name.lower() == "local":
+        return LocalResultStore()
+    raise ValueError(f"Unknown result store {name}")
+
+
+class ConnectionPool:
+    """
+    a connection of the backend, and size cursors on it for use by as many threads.
+    cursors share the attached databases and the optimizer environment the connection was opened with
+    """
+
+    def __init__(self, backend: Backend, size: int):
+        self.alias = backend.alias
+        self.conn = backend.connect()
+        self._cursors = [self.conn.cursor() for _ in range(size)]
+        self._idle = queue.Queue()
+        for cursor in self._cursors:
+            self._idle.put(cursor)
+
+    @contextmanager
+    def connection(self):
+        cursor = self._idle.get()
+        try:
+            yield cursor
+        finally:
+            self._idle.put(cursor)
+
+    def close(self):
+        for cursor in self._cursors:
+            cursor.close()
+        detach(self.conn, self.alias)
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
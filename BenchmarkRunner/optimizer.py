@@ -28,6 +28,16 @@ class Optimizer:
 
         return self.estimation_function.name
 
+    def to_env(self, bridge_cost: int) -> Dict[str, str]:
+        """ environment variables read by the optimizer extension """
+        env = {
+            "OPTIMIZER": self.type.name,
+            "BRIDGE_COST": str(bridge_cost),
+        }
+        if self.estimation_function:
+            env["ESTIMATION"] = self.estimation_function.name
+        return env
+
     @classmethod
     def from_name(cls, optimizer: str):
         if optimizer.lower() == "og":
@@ -54,4 +64,34 @@ class Optimizer:
                 type=OptimizerType.DP,
                 estimation_function=EstimationFunction.DATA_SIZE_SIMPLIFIED
             )
-        return None
\ No newline at end of file
+        return None
+
+    @classmethod
+    def from_string(cls, optimizer: str):
+        """ inverse of to_string """
+        if optimizer == OptimizerType.HEURISTIC.name:
+            return Optimizer(type=OptimizerType.HEURISTIC)
+        return Optimizer(type=OptimizerType.DP, estimation_function=EstimationFunction[optimizer])
+
+
+OPTIMIZERS = [
+    OG := Optimizer(
+        type=OptimizerType.HEURISTIC
+    ),
+    CD := Optimizer(
+        type=OptimizerType.DP,
+        estimation_function=EstimationFunction.CARDINALITY
+    ),
+    TS := Optimizer(
+        type=OptimizerType.DP,
+        estimation_function=EstimationFunction.TABLE_SIZE
+    ),
+    DS := Optimizer(
+        type=OptimizerType.DP,
+        estimation_function=EstimationFunction.DATA_SIZE
+    ),
+    DS_SIMPLIFIED := Optimizer(
+        type=OptimizerType.DP,
+        estimation_function=EstimationFunction.DATA_SIZE_SIMPLIFIED
+    )
+]
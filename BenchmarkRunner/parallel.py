@@ -0,0 +1,103 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Set
+
+from test_case import *
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# cpus this worker process has been pinned to, set once by _init_worker
+_PINNED_CPUS: Optional[Set[int]] = None
+
+
+@dataclass
+class ParallelConfig:
+    max_workers: Optional[int] = None  # defaults to one worker per optimizer
+    pin_cpus: bool = True
+
+
+def _partition_cpus(n_workers: int) -> List[Optional[Set[int]]]:
+    """ splits the cpus available to this process into n_workers disjoint sets """
+    if not hasattr(os, "sched_getaffinity"):
+        logger.warning("CPU pinning is not supported on this platform")
+        return [None] * n_workers
+
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < n_workers:
+        logger.warning(f"Only {len(cpus)} cpus for {n_workers} workers, not pinning")
+        return [None] * n_workers
+
+    share = len(cpus) // n_workers
+    return [set(cpus[i * share:(i + 1) * share]) for i in range(n_workers)]
+
+
+def _init_worker(cpu_sets):
+    global _PINNED_CPUS
+    cpus = cpu_sets.get()
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+        _PINNED_CPUS = cpus
+        logger.info(f"Worker {os.getpid()} pinned to cpus {sorted(cpus)}")
+
+
+def _configure_worker(optimizer: Optimizer, test_case: TestCase, bridge_cost: int) -> TestCase:
+    """ sets the optimizer environment of this worker process and sizes duckdb to the pinned cpus """
+    os.environ.pop("ESTIMATION", None)
+    os.environ.update(optimizer.to_env(bridge_cost))
+    if _PINNED_CPUS:
+        test_case = replace(test_case, threads=len(_PINNED_CPUS))
+    return test_case
+
+
+def _run_optimizer(optimizer: Optimizer, test_case: TestCase, bridge_cost: int) -> str:
+    test_case = _configure_worker(optimizer, test_case, bridge_cost)
+
+    logger.info(f"Worker {os.getpid()} running [{test_case.benchmark}] with Optimizer [{optimizer.to_string()}]")
+
+    with test_case.result_sink(optimizer) as sink:
+        test_case._run(optimizer, sink)
+    return sink.path
+
+
+def run_optimizers_in_parallel(
+        optimizers: List[Optimizer],
+        test_case: TestCase,
+        bridge_cost: int,
+        config: ParallelConfig = ParallelConfig()
+) -> Dict[str, str]:
+    """
+    runs every optimizer configuration in its own worker process under a shared run id.
+    returns the result file of every optimizer that completed, keyed by optimizer.to_string()
+    """
+    max_workers = config.max_workers or len(optimizers)
+    if not test_case.run_id:
+        test_case = replace(test_case, run_id=datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
+
+    # workers are spawned rather than forked so that each gets a clean duckdb instance
+    ctx = multiprocessing.get_context("spawn")
+    cpu_sets = ctx.Queue()
+    for cpus in (_partition_cpus(max_workers) if config.pin_cpus else [None] * max_workers):
+        cpu_sets.put(cpus)
+
+    result_paths: Dict[str, str] = {}
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=ctx,
+                             initializer=_init_worker,
+                             initargs=(cpu_sets,)) as executor:
+        futures = {
+            optimizer.to_string(): executor.submit(_run_optimizer, optimizer, test_case, bridge_cost)
+            for optimizer in optimizers
+        }
+        for name, future in futures.items():
+            try:
+                result_paths[name] = future.result()
+            except Exception as e:
+                if test_case.raise_on_error:
+                    raise e
+                logger.error(f"Optimizer [{name}] failed on [{test_case.benchmark}]: {e}")
+
+    return result_paths
@@ -0,0 +1,173 @@
+import os
+import re
+import math
+import random
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+from natsort import natsorted
+
+from definitions import *
+
+# keywords that end the FROM clause of the outermost select
+_FROM_END = re.compile(r"\b(WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|QUALIFY|WINDOW|UNION|INTERSECT|EXCEPT)\b|;",
+                       re.IGNORECASE)
+_JOIN = re.compile(r",|\b(?:INNER\s+|CROSS\s+)?JOIN\b", re.IGNORECASE)
+_ON = re.compile(r"\bON\b", re.IGNORECASE)
+# joins whose order cannot be changed without changing the result
+_ORDERED_JOIN = re.compile(r"\b(LEFT|RIGHT|FULL|OUTER|NATURAL|ASOF|SEMI|ANTI|POSITIONAL|LATERAL|USING)\b",
+                           re.IGNORECASE)
+
+
+def _mask(sql: str) -> str:
+    """ blanks out everything inside parentheses, quotes and comments, keeping the offsets of the rest """
+    masked = []
+    depth = 0
+    quote = None
+    i = 0
+    while i < len(sql):
+        c = sql[i]
+        if quote:
+            masked.append(" ")
+            if c == quote:
+                quote = None
+        elif c in ("'", '"'):
+            quote = c
+            masked.append(" ")
+        elif sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = len(sql) if end == -1 else end
+            masked.append(" " * (end - i))
+            i = end
+            continue
+        elif c == "(":
+            depth += 1
+            masked.append(" ")
+        elif c == ")":
+            depth -= 1
+            masked.append(" ")
+        else:
+            masked.append(c if depth == 0 else " ")
+        i += 1
+    return "".join(masked)
+
+
+def unrank_permutation(rank: int, n: int) -> List[int]:
+    """ the rank-th permutation of range(n) in lexicographic order, the order of itertools.permutations """
+    items = list(range(n))
+    order = []
+    for i in range(n, 0, -1):
+        index, rank = divmod(rank, math.factorial(i - 1))
+        order.append(items.pop(index))
+    return order
+
+
+def rank_permutation(order: List[int]) -> int:
+    """ inverse of unrank_permutation """
+    items = sorted(order)
+    rank = 0
+    for i, item in enumerate(order):
+        index = items.index(item)
+        rank += index * math.factorial(len(order) - i - 1)
+        items.pop(index)
+    return rank
+
+
+@dataclass
+class PermutationConfig:
+    sample: Optional[int] = None  # join orders per query, every permutation when None
+    seed: int = 0
+
+
+@dataclass
+class JoinPermutations:
+    """
+    the join orders of a query, whose relations are listed in the FROM clause of the outermost select.
+    inner JOIN ... ON is rewritten to a comma list with the join conditions moved to WHERE.
+    variation id k is the k-th permutation of the original order, so id 1 is the query as written
+    """
+    query_id: str
+    prefix: str
+    relations: List[str]
+    suffix: str
+
+    @classmethod
+    def parse(cls, query_id: str, sql: str):
+        sql = sql.strip()
+        masked = _mask(sql)
+        from_match = re.search(r"\bFROM\b", masked, re.IGNORECASE)
+        if not from_match:
+            raise ValueError(f"[{query_id}] has no FROM clause")
+        start = from_match.end()
+        end_match = _FROM_END.search(masked, start)
+        end = end_match.start() if end_match else len(sql)
+
+        from_masked = masked[start:end]
+        if _ORDERED_JOIN.search(from_masked):
+            raise ValueError(f"[{query_id}] contains outer or lateral joins, its join order is fixed")
+
+        relations, conditions = [], []
+        bounds = [0] + [position for match in _JOIN.finditer(from_masked) for position in match.span()] + [end - start]
+        for segment_start, segment_end in zip(bounds[::2], bounds[1::2]):
+            segment = sql[start + segment_start:start + segment_end]
+            on_match = _ON.search(from_masked, segment_start, segment_end)
+            if on_match:
+                conditions.append(sql[start + on_match.end():start + segment_end].strip())
+                segment = sql[start + segment_start:start + on_match.start()]
+            relations.append(segment.strip())
+
+        suffix = sql[end:]
+        if conditions:
+            if end_match and end_match.group(1) and end_match.group(1).upper() == "WHERE":
+                where_end_match = _FROM_END.search(masked, end_match.end())
+                where_end = where_end_match.start() if where_end_match else len(sql)
+                conditions.append(sql[end_match.end():where_end].strip())
+                suffix = sql[where_end:]
+            suffix = "WHERE " + " AND ".join(f"({condition})" for condition in conditions) + "\n" + suffix
+
+        return cls(query_id=query_id, prefix=sql[:start], relations=relations, suffix=suffix)
+
+    @property
+    def count(self) -> int:
+        return math.factorial(len(self.relations))
+
+    def variation_ids(self, config: PermutationConfig = PermutationConfig()) -> Iterator[int]:
+        """ every variation id in order, or a sample of config.sample ids that is stable for a seed """
+        if config.sample is None or config.sample >= self.count:
+            yield from range(1, self.count + 1)
+            return
+        rng = random.Random(f"{config.seed}:{self.query_id}")
+        # the original join order is always part of the sample, runs use it as their baseline
+        ranks = [0] + sorted(rng.sample(range(1, self.count), max(config.sample - 1, 0)))
+        for rank in ranks:
+            yield rank + 1
+
+    def query_text(self, variation_id: int) -> str:
+        order = unrank_permutation(int(variation_id) - 1, len(self.relations))
+        return f"{self.prefix} {', '.join(self.relations[i] for i in order)}\n{self.suffix}"
+
+
+@dataclass
+class PermutationSource:
+    """ generates the variations of a benchmark from its base queries, eg. base_queries/tpch/q07.sql """
+    benchmark: str
+    config: PermutationConfig = field(default_factory=PermutationConfig)
+    _permutations: Dict[str, JoinPermutations] = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self):
+        self.folder = os.path.join(BASE_QUERY_ROOT, self.benchmark)
+
+    def query_ids(self) -> List[str]:
+        return natsorted(file_name[:-len(".sql")] for file_name in os.listdir(self.folder)
+                         if file_name.endswith(".sql"))
+
+    def permutations(self, query_id: str) -> JoinPermutations:
+        if query_id not in self._permutations:
+            with open(os.path.join(self.folder, query_id + ".sql")) as f:
+                self._permutations[query_id] = JoinPermutations.parse(query_id, f.read())
+        return self._permutations[query_id]
+
+    def variation_ids(self, query_id: str) -> Iterator[int]:
+        return self.permutations(query_id).variation_ids(self.config)
+
+    def query_text(self, query_id: str, variation_id: int) -> str:
+        return self.permutations(query_id).query_text(variation_id)
@@ -0,0 +1,263 @@
+import os
+import json
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Dict, List, Optional
+
+from definitions import *
+from optimizer import *
+from logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+STAMP_ROOT = os.path.join(RESULT_ROOT, "stamps")
+
+
+@dataclass
+class Stage:
+    """ a step of the pipeline, recomputed when the hash of its inputs or of a dependency changes """
+    name: str
+    action: Callable[[], Any]
+    inputs: Dict[str, Any] = field(default_factory=dict)
+    dependencies: List[str] = field(default_factory=list)
+
+
+def content_hash(*parts: Any) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def hash_tree(path: str) -> str:
+    """ hash of the relative path and content of every file below path """
+    digest = hashlib.blake2b(digest_size=16)
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            digest.update(os.path.relpath(file_path, path).encode())
+            with open(file_path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def extension_version(test_case) -> Optional[str]:
+    """ version of the optimizer extension of the test case's backend, so that stage keys change with it """
+    if os.getenv("OPTIMIZER_COMMIT"):
+        return os.getenv("OPTIMIZER_COMMIT")
+    conn = test_case._connect()
+    try:
+        return test_case._extension_version(conn)
+    finally:
+        conn.close()
+
+
+@dataclass
+class Pipeline:
+    """
+    stages of one benchmark in dependency order.
+    the key of a stage hashes its inputs and the keys of its dependencies and is stamped once it succeeded,
+    so re-running only recomputes the stages whose key differs from their stamp
+    """
+    benchmark: str
+    stages: Dict[str, Stage] = field(default_factory=dict)
+
+    def add(self, stage: Stage):
+        missing = [dependency for dependency in stage.dependencies if dependency not in self.stages]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages {missing}")
+        self.stages[stage.name] = stage
+
+    def _stamp_path(self, stage: Stage) -> str:
+        return os.path.join(STAMP_ROOT, self.benchmark, stage.name.replace("/", "_") + ".stamp")
+
+    def _read_stamp(self, stage: Stage) -> Optional[str]:
+        path = self._stamp_path(stage)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return f.read().strip()
+
+    def _write_stamp(self, stage: Stage, key: str):
+        path = self._stamp_path(stage)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(key)
+
+    def keys(self) -> Dict[str, str]:
+        keys = {}
+        for name, stage in self.stages.items():
+            keys[name] = content_hash(stage.inputs, [keys[dependency] for dependency in stage.dependencies])
+        return keys
+
+    def stale(self) -> List[str]:
+        return [name for name, key in self.keys().items() if self._read_stamp(self.stages[name]) != key]
+
+    def run(self, force: bool = False) -> List[str]:
+        """ runs the stale stages in insertion order, which respects the dependencies, returns their names """
+        keys = self.keys()
+        recomputed = []
+        for name, stage in self.stages.items():
+            if not force and self._read_stamp(stage) == keys[name]:
+                logger.info(f"[{self.benchmark}] {name} is up to date")
+                continue
+            logger.info(f"[{self.benchmark}] Running stage {name}")
+            stage.action()
+            self._write_stamp(stage, keys[name])
+            recomputed.append(name)
+        return recomputed
+
+
+@dataclass
+class PipelineConfig:
+    bridge_cost: int = 10_000
+    cost_threshold: Optional[float] = None
+    extension: Optional[str] = None  # defaults to the version reported by each test case's backend
+
+
+# stages call the test case's internals rather than TestCase.run, which swallows errors when raise_on_error is
+# False. a failed stage must raise, so that it is not stamped and runs again next time
+
+
+def _explain(optimizer: Optimizer, test_case, bridge_cost: int):
+    """ explains every variation from scratch, plans of an outdated optimizer must not be reused """
+    from plan_store import clear_plan_store, open_plan_store
+    from plan_index import PlanIndex
+
+    clear_plan_store(test_case.benchmark, optimizer)
+    os.environ.update(optimizer.to_env(bridge_cost))
+    test_case._run_explains(optimizer)
+
+    store = open_plan_store(test_case.benchmark, optimizer)
+    missing = sum(
+        not store.has(query_id, str(variation_id))
+        for query_id in test_case.query_ids()
+        for variation_id in test_case.variation_ids(query_id)
+    )
+    if missing:
+        raise RuntimeError(f"{missing} variations of [{test_case.benchmark}] were not explained "
+                           f"with Optimizer [{optimizer.to_string()}]")
+
+    plan_index = PlanIndex.load()
+    plan_index.refresh(test_case.benchmark, optimizer, rebuild=True)
+    plan_index.save()
+
+
+def _timed_run(optimizer: Optimizer, test_case, bridge_cost: int):
+    os.environ.update(optimizer.to_env(bridge_cost))
+    with test_case.result_sink(optimizer) as sink:
+        test_case._run(optimizer, sink)
+
+
+def _prefilter(test_case, config: PipelineConfig):
+    """
+    prefilter_by_predicted_cost filters the indexes in place, so they are regenerated first.
+    otherwise a new threshold would filter the output of the previous one instead of the union
+    """
+    from run import OPTIMIZERS, OG, identify_differentiating_queries, _union_of_differentiating_queries, \
+        prefilter_by_predicted_cost
+
+    for optimizer in OPTIMIZERS:
+        if optimizer != OG:
+            identify_differentiating_queries(optimizer, OG, test_case, config.bridge_cost)
+    _union_of_differentiating_queries(test_case)
+    prefilter_by_predicted_cost(test_case, config.cost_threshold)
+
+
+def build_pipeline(test_case, config: PipelineConfig) -> Pipeline:
+    """ explain -> diff -> union -> (prefilter) -> run -> upload -> (verify) for one benchmark """
+    from run import OPTIMIZERS, OG, identify_differentiating_queries, _union_of_differentiating_queries
+    from db_saver import save_timed_results_in_md
+    from verification import find_fingerprint_mismatches
+
+    pipeline = Pipeline(test_case.benchmark)
+    extension = config.extension or extension_version(test_case)
+    queries = hash_tree(test_case.source.folder if test_case.source else test_case.path)
+    settings = {key: value for key, value in asdict(test_case).items() if key != "run_id"}
+
+    for optimizer in OPTIMIZERS:
+        pipeline.add(Stage(
+            name=f"explain/{optimizer.to_string()}",
+            action=lambda optimizer=optimizer: _explain(optimizer, test_case, config.bridge_cost),
+            inputs={
+                "queries": queries,
+                "optimizer": optimizer.to_env(config.bridge_cost),
+                "extension": extension,
+            },
+        ))
+
+    for optimizer in OPTIMIZERS:
+        if optimizer == OG:
+            continue
+        pipeline.add(Stage(
+            name=f"diff/{optimizer.to_string()}",
+            action=lambda optimizer=optimizer: identify_differentiating_queries(optimizer, OG, test_case,
+                                                                                config.bridge_cost),
+            dependencies=[f"explain/{optimizer.to_string()}", f"explain/{OG.to_string()}"],
+        ))
+
+    pipeline.add(Stage(
+        name="union",
+        action=lambda: _union_of_differentiating_queries(test_case),
+        dependencies=[name for name in pipeline.stages if name.startswith("diff/")],
+    ))
+    index = "union"
+
+    if config.cost_threshold:
+        pipeline.add(Stage(
+            name="prefilter",
+            action=lambda: _prefilter(test_case, config),
+            inputs={"threshold": config.cost_threshold},
+            dependencies=["union"],
+        ))
+        index = "prefilter"
+
+    for optimizer in OPTIMIZERS:
+        pipeline.add(Stage(
+            name=f"run/{optimizer.to_string()}",
+            action=lambda optimizer=optimizer: _timed_run(optimizer, test_case, config.bridge_cost),
+            inputs={"test_case": settings},
+            dependencies=[index, f"explain/{optimizer.to_string()}"],
+        ))
+        pipeline.add(Stage(
+            name=f"upload/{optimizer.to_string()}",
+            action=lambda optimizer=optimizer: save_timed_results_in_md(optimizer, test_case),
+            dependencies=[f"run/{optimizer.to_string()}"],
+        ))
+
+    if test_case.verify_results:
+        pipeline.add(Stage(
+            name="verify",
+            action=lambda: find_fingerprint_mismatches(test_case, OPTIMIZERS, OG),
+            dependencies=[f"run/{optimizer.to_string()}" for optimizer in OPTIMIZERS],
+        ))
+
+    return pipeline
+
+
+def _run_benchmark(test_case, config: PipelineConfig, force: bool) -> List[str]:
+    return build_pipeline(test_case, config).run(force)
+
+
+def run_pipelines(test_cases: List, config: PipelineConfig = PipelineConfig(), force: bool = False,
+                  max_workers: Optional[int] = None) -> Dict[str, List[str]]:
+    """
+    runs the pipeline of every benchmark, each in its own process since they share no stage.
+    returns the recomputed stages per benchmark
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers or len(test_cases), mp_context=ctx) as executor:
+        futures = {
+            test_case.benchmark: executor.submit(_run_benchmark, test_case, config, force)
+            for test_case in test_cases
+        }
+        recomputed = {benchmark: future.result() for benchmark, future in futures.items()}
+
+    for benchmark, stages in recomputed.items():
+        logger.info(f"[{benchmark}] recomputed {len(stages)} stages: {stages}")
+    return recomputed
@@ -0,0 +1,105 @@
+import logging
+from typing import Any, Dict, List, Optional, Set
+import polars as pl
+
+from definitions import *
+from optimizer import *
+from plan_index import is_join, estimated_cardinality
+from plan_store import open_plan_store
+from logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+PLAN_KEY = ["optimizer", "query_id", "variation_id"]
+VARIATION_KEY = ["query_id", "variation_id"]
+
+JOIN_SCHEMA = {
+    "optimizer": pl.Utf8,
+    "query_id": pl.Utf8,
+    "variation_id": pl.Utf8,
+    "output": pl.Int64,
+    "probe": pl.Int64,
+    "build": pl.Int64,
+}
+
+
+def join_cardinalities(plan: Any) -> List[Dict[str, Optional[int]]]:
+    """ estimated output, probe side and build side cardinality of every join in an EXPLAIN plan """
+    joins = []
+
+    def visit(node: Any):
+        if isinstance(node, list):
+            for child in node:
+                visit(child)
+            return
+
+        children = node.get("children", [])
+        if is_join(node.get("name", "").strip()):
+            joins.append({
+                "output": estimated_cardinality(node),
+                "probe": estimated_cardinality(children[0]) if len(children) > 0 else None,
+                "build": estimated_cardinality(children[1]) if len(children) > 1 else None,
+            })
+        for child in children:
+            visit(child)
+
+    visit(plan)
+    return joins
+
+
+def load_join_cardinalities(benchmark: str, optimizers: List[Optimizer]) -> pl.DataFrame:
+    """ one row per join of every stored plan of the given optimizers """
+    rows = []
+    for optimizer in optimizers:
+        for query_id, variation_id, plan in open_plan_store(benchmark, optimizer).items():
+            for join in join_cardinalities(plan):
+                rows.append({
+                    "optimizer": optimizer.to_string(),
+                    "query_id": query_id,
+                    "variation_id": variation_id,
+                    **join
+                })
+
+    return pl.DataFrame(rows, schema=JOIN_SCHEMA)
+
+
+def predict_costs(joins: pl.DataFrame) -> pl.DataFrame:
+    """
+    cost metrics of every plan, computed in one pass over all joins:
+    c_out sums the join output cardinalities, c_build the build side cardinalities,
+    max_intermediate is the largest join output
+    """
+    return joins.group_by(PLAN_KEY).agg(
+        pl.col("output").sum().alias("c_out"),
+        pl.col("build").sum().alias("c_build"),
+        pl.col("output").max().alias("max_intermediate"),
+        pl.col("optimizer").count().alias("joins"),
+    )
+
+
+def rank_optimizers(costs: pl.DataFrame, baseline_optimizer: Optimizer, metric: str = "c_out") -> pl.DataFrame:
+    """ ranks the optimizers of every variation by predicted cost and relates each cost to the baseline's """
+    is_baseline = pl.col("optimizer") == baseline_optimizer.to_string()
+    return costs.with_columns(
+        pl.col(metric).rank("min").over(VARIATION_KEY).alias("rank"),
+        (pl.col(metric) / pl.col(metric).filter(is_baseline).first().over(VARIATION_KEY)).alias("predicted_gap"),
+    ).sort(VARIATION_KEY + ["rank"])
+
+
+def flag_variations(ranked: pl.DataFrame, threshold: float) -> Dict[str, Set[str]]:
+    """ variations where some optimizer is predicted to be at least threshold times cheaper or costlier than the baseline """
+    flagged = (
+        ranked
+        .group_by(VARIATION_KEY)
+        .agg(
+            pl.col("predicted_gap").max().alias("max_gap"),
+            pl.col("predicted_gap").min().alias("min_gap"),
+        )
+        .filter((pl.col("max_gap") >= threshold) | (pl.col("min_gap") <= 1 / threshold))
+    )
+
+    by_query: Dict[str, Set[str]] = {}
+    for query_id, variation_id in flagged.select(VARIATION_KEY).iter_rows():
+        by_query.setdefault(query_id, set()).add(variation_id)
+    return by_query
@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import fcntl
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
+
+from definitions import *
+from optimizer import *
+from plan_store import open_plan_store
+from logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+PLAN_INDEX_PATH = os.path.join(RESULT_ROOT, "plan_index.json")
+
+
+def extra_info(node: Dict[str, Any]) -> Dict[str, Any]:
+    """ newer duckdb versions emit extra_info as a dict, older ones as a separator delimited string """
+    info = node.get("extra_info") or {}
+    if isinstance(info, dict):
+        return info
+
+    lines = [line.strip() for line in info.split("\n") if line.strip() and "[INFOSEPARATOR]" not in line]
+    parsed = {"Table": lines[0]} if lines else {}
+    for line in lines:
+        if line.startswith("EC:"):
+            parsed["Estimated Cardinality"] = line[len("EC:"):]
+    return parsed
+
+
+def estimated_cardinality(node: Dict[str, Any]) -> Optional[int]:
+    value = extra_info(node).get("Estimated Cardinality")
+    digits = re.sub(r"[^0-9]", "", str(value)) if value is not None else ""
+    return int(digits) if digits else None
+
+
+def is_join(name: str) -> bool:
+    return "JOIN" in name or name == "CROSS_PRODUCT"
+
+
+def canonicalize_plan(node: Any) -> str:
+    """
+    reduces an EXPLAIN (FORMAT json) plan to its join tree.
+    joins keep their operator type, join type and child order (probe side first, build side second),
+    scans keep their table, and every other operator is skipped over.
+    estimated cardinalities, projections, filters and key order do not affect the result
+    """
+    if isinstance(node, list):
+        children = [canonicalize_plan(child) for child in node]
+        return children[0] if len(children) == 1 else "(" + ",".join(children) + ")"
+
+    name = node.get("name", node.get("operator_type", "")).strip()
+    children = [canonicalize_plan(child) for child in node.get("children", [])]
+    info = extra_info(node)
+
+    if is_join(name):
+        join_type = info.get("Join Type", "")
+        return f"{name}:{join_type}(" + ",".join(children) + ")"
+    if "SCAN" in name and not children:
+        return f"{name}({info.get('Table', '')})"
+    if len(children) == 1:
+        return children[0]
+    if not children:
+        return name
+    return f"{name}(" + ",".join(children) + ")"
+
+
+def fingerprint_plan(plan: Any) -> str:
+    return hashlib.blake2b(canonicalize_plan(plan).encode(), digest_size=8).hexdigest()
+
+
+def _variation_order(variation_id: str) -> Tuple[float, str]:
+    """ numeric variation ids in numeric order, like natsorted but without importing natsort for main.py diff """
+    return (int(variation_id), "") if variation_id.isdigit() else (float("inf"), variation_id)
+
+
+@dataclass
+class PlanIndex:
+    """
+    join tree fingerprints of every explained variation, stored in a single file as
+    { benchmark: { optimizer: { query_id: { variation_id: [fingerprint, plan version] } } } }.
+    the plan version is the store's token for the plan's content, a plan explained again is fingerprinted again
+    """
+    path: str = PLAN_INDEX_PATH
+    entries: Dict[str, Dict[str, Dict[str, Dict[str, List[str]]]]] = field(default_factory=dict)
+    _refreshed: Set[Tuple[str, str]] = field(default_factory=set, init=False, repr=False)
+
+    @classmethod
+    def load(cls, path: str = PLAN_INDEX_PATH):
+        if not os.path.exists(path):
+            return cls(path=path)
+        with open(path) as f:
+            return cls(path=path, entries=json.load(f))
+
+    def save(self):
+        """
+        writes the optimizers refreshed since loading into the file on disk,
+        so that benchmarks indexed concurrently by other processes do not drop each other's entries
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = PlanIndex.load(self.path).entries
+            for benchmark, optimizer in self._refreshed:
+                entries.setdefault(benchmark, {})[optimizer] = self.entries[benchmark][optimizer]
+            self.entries = entries
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        self._refreshed.clear()
+
+    def fingerprints(self, benchmark: str, optimizer: Optimizer) -> Dict[str, Dict[str, str]]:
+        return {
+            query_id: {variation_id: entry[0] for variation_id, entry in variations.items()}
+            for query_id, variations in self.entries.get(benchmark, {}).get(optimizer.to_string(), {}).items()
+        }
+
+    def refresh(self, benchmark: str, optimizer: Optimizer, rebuild: bool = False) -> int:
+        """
+        fingerprints the stored plans that are not indexed yet or changed since they were,
+        and drops the entries of plans that are gone. returns how many entries were added, updated or dropped
+        """
+        store = open_plan_store(benchmark, optimizer)
+
+        by_optimizer = self.entries.setdefault(benchmark, {})
+        if rebuild:
+            by_optimizer[optimizer.to_string()] = {}
+        by_query = by_optimizer.setdefault(optimizer.to_string(), {})
+
+        changed = 0
+        stored_query_ids = set(store.query_ids())
+        for query_id in list(by_query):
+            if query_id not in stored_query_ids:
+                changed += len(by_query.pop(query_id))
+
+        for query_id in stored_query_ids:
+            indexed = by_query.setdefault(query_id, {})
+            variation_ids = store.variation_ids(query_id)
+            for variation_id in set(indexed) - set(variation_ids):
+                del indexed[variation_id]
+                changed += 1
+            for variation_id in variation_ids:
+                version = store.version(query_id, variation_id)
+                # entries written before plan versions were tracked hold a bare fingerprint
+                entry = indexed.get(variation_id)
+                if isinstance(entry, list) and entry[1] == version:
+                    continue
+                indexed[variation_id] = [fingerprint_plan(store.get(query_id, variation_id)), version]
+                changed += 1
+
+        if changed or rebuild:
+            self._refreshed.add((benchmark, optimizer.to_string()))
+        if changed:
+            logger.info(f"Indexed {changed} new, changed or removed plans of [{benchmark}][{optimizer.to_string()}]")
+        return changed
+
+    def differing_variations(self, benchmark: str, optimizer: Optimizer,
+                             baseline_optimizer: Optimizer) -> Dict[str, List[str]]:
+        """ variations whose join tree differs from the baseline's, per query id """
+        fingerprints = self.fingerprints(benchmark, optimizer)
+        baseline_fingerprints = self.fingerprints(benchmark, baseline_optimizer)
+
+        differing = {}
+        for query_id, variations in fingerprints.items():
+            baseline = baseline_fingerprints.get(query_id, {})
+            differing[query_id] = sorted(
+                (
+                    variation_id
+                    for variation_id, fingerprint in variations.items()
+                    if baseline.get(variation_id) != fingerprint
+                ),
+                key=_variation_order
+            )
+        return differing
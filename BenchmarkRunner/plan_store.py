@@ -0,0 +1,162 @@
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from dataclasses import dataclass, field
+
+from definitions import *
+from optimizer import *
+
+PLAN_BUNDLE = "plans.ndjson"
+
+
+def plans_folder(benchmark: str, optimizer: Optimizer) -> str:
+    return os.path.join(RESULT_ROOT, benchmark, optimizer.to_string(), "plans")
+
+
+@dataclass
+class DirectoryPlanStore:
+    """ one pretty-printed json file per variation, eg. plans/q07/1.json """
+    folder: str
+
+    def query_ids(self) -> List[str]:
+        return os.listdir(self.folder) if os.path.exists(self.folder) else []
+
+    def variation_ids(self, query_id: str) -> List[str]:
+        return [Path(file_name).stem for file_name in os.listdir(os.path.join(self.folder, query_id))]
+
+    def has(self, query_id: str, variation_id: str) -> bool:
+        return os.path.exists(os.path.join(self.folder, query_id, variation_id + ".json"))
+
+    def get(self, query_id: str, variation_id: str) -> Any:
+        with open(os.path.join(self.folder, query_id, variation_id + ".json")) as f:
+            return json.load(f)
+
+    def version(self, query_id: str, variation_id: str) -> str:
+        """ changes whenever the plan file is rewritten """
+        stat = os.stat(os.path.join(self.folder, query_id, variation_id + ".json"))
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def put_many(self, plans: List[Tuple[str, str, str]]):
+        for query_id, variation_id, plan in plans:
+            os.makedirs(os.path.join(self.folder, query_id), exist_ok=True)
+            with open(os.path.join(self.folder, query_id, variation_id + ".json"), "w") as f:
+                json.dump(json.loads(plan), f, indent=4)
+
+    def items(self) -> Iterator[Tuple[str, str, Any]]:
+        for query_id in self.query_ids():
+            for variation_id in self.variation_ids(query_id):
+                yield query_id, variation_id, self.get(query_id, variation_id)
+
+
+@dataclass
+class BundledPlanStore:
+    """
+    every plan of an optimizer as one compact line of a single ndjson file.
+    a sidecar index maps each (query_id, variation_id) to the byte range and content hash of its line
+    """
+    path: str
+    offsets: Dict[str, Dict[str, Tuple[int, int, str]]] = field(default_factory=dict, init=False)
+
+    def __post_init__(self):
+        self.index_path = self.path + ".idx"
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            # indexes written before lines were hashed are rebuilt
+            hashed = all(len(entry) == 3 for by_variation in index["offsets"].values()
+                         for entry in by_variation.values())
+            if os.path.exists(self.path) and index["size"] == os.path.getsize(self.path) and hashed:
+                self.offsets = index["offsets"]
+                return
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        """ scans the bundle, used when the sidecar index is missing or behind the bundle """
+        self.offsets = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.endswith(b"\n"):
+                    entry = json.loads(line)
+                    self.offsets.setdefault(entry["query_id"], {})[entry["variation_id"]] = (
+                        offset, len(line), _line_hash(line)
+                    )
+                offset += len(line)
+        self._save_index()
+
+    def _save_index(self):
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        with open(self.index_path + ".tmp", "w") as f:
+            json.dump({"size": size, "offsets": self.offsets}, f, separators=(",", ":"))
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def query_ids(self) -> List[str]:
+        return list(self.offsets)
+
+    def variation_ids(self, query_id: str) -> List[str]:
+        return list(self.offsets.get(query_id, {}))
+
+    def has(self, query_id: str, variation_id: str) -> bool:
+        return variation_id in self.offsets.get(query_id, {})
+
+    def get(self, query_id: str, variation_id: str) -> Any:
+        offset, length, _ = self.offsets[query_id][variation_id]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.read(length))["plan"]
+
+    def version(self, query_id: str, variation_id: str) -> str:
+        """ the hash of the plan's line, a re-explained plan is appended as a new line """
+        return self.offsets[query_id][variation_id][2]
+
+    def put_many(self, plans: List[Tuple[str, str, str]]):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            for query_id, variation_id, plan in plans:
+                line = (json.dumps({
+                    "query_id": query_id,
+                    "variation_id": variation_id,
+                    "plan": json.loads(plan)
+                }, separators=(",", ":")) + "\n").encode()
+                f.write(line)
+                self.offsets.setdefault(query_id, {})[variation_id] = (offset, len(line), _line_hash(line))
+                offset += len(line)
+        self._save_index()
+
+    def items(self) -> Iterator[Tuple[str, str, Any]]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                if line.endswith(b"\n"):
+                    entry = json.loads(line)
+                    yield entry["query_id"], entry["variation_id"], entry["plan"]
+
+
+def _line_hash(line: bytes) -> str:
+    return hashlib.blake2b(line, digest_size=8).hexdigest()
+
+
+def clear_plan_store(benchmark: str, optimizer: Optimizer):
+    """ removes every stored plan of an optimizer, bundled or not """
+    bundle_path = os.path.join(RESULT_ROOT, benchmark, optimizer.to_string(), PLAN_BUNDLE)
+    for path in (bundle_path, bundle_path + ".idx"):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(plans_folder(benchmark, optimizer), ignore_errors=True)
+
+
+def open_plan_store(benchmark: str, optimizer: Optimizer, bundled: Optional[bool] = None):
+    """ opens the plans of an optimizer, bundled=None picks the bundle if one has been written """
+    bundle_path = os.path.join(RESULT_ROOT, benchmark, optimizer.to_string(), PLAN_BUNDLE)
+    if bundled is None:
+        bundled = os.path.exists(bundle_path)
+    if bundled:
+        return BundledPlanStore(bundle_path)
+    return DirectoryPlanStore(plans_folder(benchmark, optimizer))
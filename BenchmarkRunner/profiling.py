@@ -0,0 +1,107 @@
+import os
+import time
+import logging
+from typing import Any, Dict, List, Optional
+import polars as pl
+
+from definitions import *
+from optimizer import *
+from plan_index import estimated_cardinality
+from logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+def parse_profile(profile: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """ flattens a duckdb json profile into one row per operator, parents before their children """
+    rows = []
+
+    def visit(node: Dict[str, Any], parent_id: Optional[int], depth: int):
+        operator_id = len(rows)
+        rows.append({
+            "operator_id": operator_id,
+            "parent_id": parent_id,
+            "depth": depth,
+            "operator_type": node.get("operator_type", node.get("name", "")).strip(),
+            "operator_timing": float(node.get("operator_timing", node.get("timing")) or 0.0),
+            "actual_cardinality": int(node.get("operator_cardinality", node.get("cardinality")) or 0),
+            "estimated_cardinality": estimated_cardinality(node),
+        })
+        for child in node.get("children", []):
+            visit(child, operator_id, depth + 1)
+
+    for child in profile.get("children", []):
+        visit(child, None, 0)
+    return rows
+
+
+# detailed profiling mode reports the time of every planner phase at the top level of the profile
+PLANNER_PHASES = {
+    "parser": "parser",
+    "planner": "planner",
+    "binder": "planner_binding",
+    "optimizer": "all_optimizers",
+    "physical_planner": "physical_planner",
+}
+
+
+def planner_timings(profile: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """ seconds spent in each planner phase of a detailed profile, None for phases it does not report """
+    return {
+        phase: float(profile[key]) if profile.get(key) is not None else None
+        for phase, key in PLANNER_PHASES.items()
+    }
+
+
+def profiles_folder(benchmark: str, optimizer: Optimizer, run_id: str) -> str:
+    return os.path.join(RESULT_ROOT, benchmark, optimizer.to_string(), "profiles", run_id)
+
+
+def write_profiles(benchmark: str, optimizer: Optimizer, run_id: str, query_id: str, rows: List[Dict[str, Any]]):
+    """ writes the operator rows of one query as a parquet part file of the run """
+    if not rows:
+        return
+
+    folder = profiles_folder(benchmark, optimizer, run_id)
+    os.makedirs(folder, exist_ok=True)
+
+    df = pl.DataFrame(rows).with_columns(
+        pl.lit(benchmark).alias("benchmark"),
+        pl.lit(optimizer.to_string()).alias("optimizer"),
+        pl.lit(run_id).alias("run_id"),
+        pl.lit(query_id).alias("query_id"),
+    )
+    # a resumed run adds parts instead of overwriting the ones written before the interruption
+    df.write_parquet(os.path.join(folder, f"{query_id}_{time.time_ns()}.parquet"))
+
+
+def scan_profiles(benchmark: str = "*", optimizer: str = "*") -> pl.LazyFrame:
+    return pl.scan_parquet(os.path.join(RESULT_ROOT, benchmark, optimizer, "profiles", "*", "*.parquet"))
+
+
+def q_errors(profiles: pl.LazyFrame) -> pl.LazyFrame:
+    """ q-error of every operator that has both an estimated and an actual cardinality """
+    estimated = pl.col("estimated_cardinality").cast(pl.Float64).clip(lower_bound=1)
+    actual = pl.col("actual_cardinality").cast(pl.Float64).clip(lower_bound=1)
+    return (
+        profiles
+        .filter(pl.col("estimated_cardinality").is_not_null())
+        .with_columns(pl.max_horizontal(estimated / actual, actual / estimated).alias("q_error"))
+    )
+
+
+def operator_time_breakdown(profiles: pl.LazyFrame) -> pl.LazyFrame:
+    """ total operator time per benchmark, optimizer and operator type, with its share of the optimizer's time """
+    return (
+        profiles
+        .group_by(["benchmark", "optimizer", "operator_type"])
+        .agg(
+            pl.col("operator_timing").sum().alias("total_time"),
+            pl.col("operator_timing").count().alias("operators"),
+        )
+        .with_columns(
+            (pl.col("total_time") / pl.col("total_time").sum().over(["benchmark", "optimizer"])).alias("time_share")
+        )
+        .sort(["benchmark", "optimizer", "total_time"], descending=[False, False, True])
+    )
@@ -0,0 +1,124 @@
+import os
+import mmap
+import json
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple, Union
+from natsort import natsorted
+
+from definitions import *
+from logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+CATALOG_FILE = "queries.sql"
+CATALOG_INDEX = "queries.idx.json"
+
+
+def catalog_folder(benchmark: str) -> str:
+    return os.path.join(RESULT_ROOT, benchmark, "catalog")
+
+
+def query_hash(query_text: Union[str, bytes]) -> str:
+    if isinstance(query_text, str):
+        query_text = query_text.encode()
+    return hashlib.blake2b(query_text, digest_size=8).hexdigest()
+
+
+def _source_mtime(queries_folder: str) -> float:
+    """ newest query directory, which changes whenever a variation file is added or removed """
+    return max((entry.stat().st_mtime for entry in os.scandir(queries_folder) if entry.is_dir()),
+               default=os.path.getmtime(queries_folder))
+
+
+@dataclass
+class CatalogConfig:
+    memory_map: bool = True  # map the catalog file instead of reading it into memory
+    rebuild: bool = False  # rebuild even if no variation was added or removed, eg. after editing files in place
+
+
+@dataclass
+class QueryCatalog:
+    """
+    the text of every variation of a benchmark, read once from permuted_queries into a single file.
+    the catalog maps (query_id, variation_id) to the byte range and content hash of the variation's text
+    """
+    benchmark: str
+    entries: Dict[str, Dict[str, Tuple[int, int, str]]]
+    data: Union[bytes, mmap.mmap] = field(repr=False)
+
+    @staticmethod
+    def build(benchmark: str):
+        """ concatenates every variation file of the benchmark into the catalog file and writes its index """
+        queries_folder = os.path.join(QUERY_ROOT, benchmark, "queries")
+        folder = catalog_folder(benchmark)
+        os.makedirs(folder, exist_ok=True)
+
+        entries: Dict[str, Dict[str, Tuple[int, int, str]]] = {}
+        offset = 0
+        # processes building at the same time each write their own temporary files and the last rename wins
+        tmp_suffix = f".{os.getpid()}.tmp"
+        with open(os.path.join(folder, CATALOG_FILE) + tmp_suffix, "wb") as out:
+            for query_id in natsorted(os.listdir(queries_folder)):
+                by_variation = entries.setdefault(query_id, {})
+                for file_name in natsorted(os.listdir(os.path.join(queries_folder, query_id))):
+                    if not file_name.endswith(".sql"):
+                        continue
+                    with open(os.path.join(queries_folder, query_id, file_name), "rb") as f:
+                        text = f.read()
+                    out.write(text)
+                    by_variation[file_name[:-len(".sql")]] = (offset, len(text), query_hash(text))
+                    offset += len(text)
+        os.replace(os.path.join(folder, CATALOG_FILE) + tmp_suffix, os.path.join(folder, CATALOG_FILE))
+
+        with open(os.path.join(folder, CATALOG_INDEX) + tmp_suffix, "w") as f:
+            json.dump({"source_mtime": _source_mtime(queries_folder), "entries": entries}, f,
+                      separators=(",", ":"))
+        os.replace(os.path.join(folder, CATALOG_INDEX) + tmp_suffix, os.path.join(folder, CATALOG_INDEX))
+        logger.info(f"Cataloged {sum(map(len, entries.values()))} variations of {benchmark} ({offset} bytes)")
+
+    @classmethod
+    def open(cls, benchmark: str, config: CatalogConfig = CatalogConfig()):
+        """ opens the catalog of the benchmark, building it first if it is missing or behind permuted_queries """
+        folder = catalog_folder(benchmark)
+        index_path = os.path.join(folder, CATALOG_INDEX)
+        queries_folder = os.path.join(QUERY_ROOT, benchmark, "queries")
+
+        index = None
+        if not config.rebuild and os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            if index["source_mtime"] < _source_mtime(queries_folder):
+                index = None
+        if index is None:
+            cls.build(benchmark)
+            with open(index_path) as f:
+                index = json.load(f)
+
+        with open(os.path.join(folder, CATALOG_FILE), "rb") as f:
+            if not config.memory_map:
+                data = f.read()
+            elif os.fstat(f.fileno()).st_size == 0:
+                data = b""  # empty files cannot be mapped
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(benchmark=benchmark, entries=index["entries"], data=data)
+
+    def query_ids(self) -> List[str]:
+        return list(self.entries)
+
+    def variation_ids(self, query_id: str) -> List[int]:
+        return [int(variation_id) for variation_id in self.entries.get(query_id, {})]
+
+    def query_text(self, query_id: str, variation_id: int) -> str:
+        offset, length, _ = self.entries[query_id][str(variation_id)]
+        return self.data[offset:offset + length].decode()
+
+    def content_hash(self, query_id: str, variation_id: int) -> str:
+        return self.entries[query_id][str(variation_id)][2]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
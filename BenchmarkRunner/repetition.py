@@ -0,0 +1,53 @@
+import math
+import statistics
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+
+@dataclass
+class RepetitionPolicy:
+    warmup_runs: int = 0
+    min_runs: int = 1
+    max_runs: int = 1
+    time_budget: Optional[float] = None  # seconds of timed runs allowed per variation
+    target_ci_width: Optional[float] = None  # width of the median's confidence interval, relative to the median
+    confidence: float = 0.95
+
+    def should_stop(self, samples: List[float], elapsed: float) -> bool:
+        if len(samples) < self.min_runs:
+            return False
+        if len(samples) >= self.max_runs:
+            return True
+        if self.time_budget is not None and elapsed >= self.time_budget:
+            return True
+        if self.target_ci_width is not None:
+            width = relative_median_ci_width(samples, self.confidence)
+            return width is not None and width <= self.target_ci_width
+        return False
+
+
+def median_confidence_interval(samples: List[float], confidence: float = 0.95) -> Optional[Tuple[float, float]]:
+    """
+    distribution-free confidence interval of the median from order statistics.
+    returns None while there are too few samples to bound the interval
+    """
+    n = len(samples)
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    lower = math.floor(n / 2 - z * math.sqrt(n) / 2)
+    upper = math.ceil(1 + n / 2 + z * math.sqrt(n) / 2)
+    if lower < 1 or upper > n:
+        return None
+
+    ordered = sorted(samples)
+    return ordered[lower - 1], ordered[upper - 1]
+
+
+def relative_median_ci_width(samples: List[float], confidence: float = 0.95) -> Optional[float]:
+    interval = median_confidence_interval(samples, confidence)
+    if interval is None:
+        return None
+
+    median = statistics.median(samples)
+    if median == 0:
+        return 0.0
+    return (interval[1] - interval[0]) / median
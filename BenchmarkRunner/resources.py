@@ -0,0 +1,189 @@
+import os
+import resource
+import statistics
+import threading
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ResourceUsage:
+    cpu_user_time: float
+    cpu_system_time: float
+    peak_rss_bytes: Optional[int] = None
+    read_bytes: Optional[int] = None
+    write_bytes: Optional[int] = None
+    spill_bytes: Optional[int] = None
+
+
+def _read_proc_status() -> Dict[str, int]:
+    """ VmRSS and VmHWM of this process in bytes, empty where /proc is not available """
+    values = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    values[key] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return values
+
+
+def _read_proc_io() -> Dict[str, int]:
+    values = {}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                values[key] = int(value)
+    except OSError:
+        pass
+    return values
+
+
+def _reset_peak_rss() -> bool:
+    """ resets VmHWM so that it reports the peak since now, supported since linux 4.0 """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _directory_size(path: Optional[str]) -> int:
+    if not path or not os.path.isdir(path):
+        return 0
+    size = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(folder, name)).st_size
+            except OSError:
+                pass  # removed while walking
+    return size
+
+
+def _temporary_files_size(cursor) -> Optional[int]:
+    """ bytes of the temporary files of the connection's database, None when duckdb cannot report them """
+    try:
+        return cursor.execute("SELECT coalesce(sum(size), 0) FROM duckdb_temporary_files()").fetchone()[0]
+    except Exception:
+        return None
+
+
+class resource_sampler:
+    """
+    measures the cpu time, peak memory, storage i/o and temp spill of this process while the body runs.
+    duckdb executes queries on threads of this process, so the counters cover the query.
+    spill is read from duckdb_temporary_files() on a cursor of conn, which only sees the query's own database.
+    without conn, or where duckdb cannot report its temporary files, the temp directory is scanned instead.
+    with interval > 0 a background thread samples rss and spill every interval seconds,
+    with interval = 0 only the counters are read before and after, missing spill that is freed by then
+    """
+
+    def __init__(self, interval: float = 0.05, temp_directory: Optional[str] = None, conn=None):
+        self.interval = interval
+        self.temp_directory = temp_directory
+        self.conn = conn
+        self.usage: Optional[ResourceUsage] = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._cursor = None
+        self._peak_rss = 0
+        self._peak_spill = 0
+
+    def _spill_size(self) -> int:
+        if self._cursor is not None:
+            size = _temporary_files_size(self._cursor)
+            if size is not None:
+                return size
+        return _directory_size(self.temp_directory)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._peak_rss = max(self._peak_rss, _read_proc_status().get("VmRSS", 0))
+            self._peak_spill = max(self._peak_spill, self._spill_size())
+
+    def __enter__(self):
+        if self.conn is not None:
+            # a cursor is a connection of its own, it can be queried while conn executes
+            self._cursor = self.conn.cursor()
+            if _temporary_files_size(self._cursor) is None:
+                logger.warning("duckdb_temporary_files() is not available, scanning the temp directory for spill")
+                self._cursor.close()
+                self._cursor = None
+        self._hwm_reset = _reset_peak_rss()
+        self._io = _read_proc_io()
+        self._rusage = resource.getrusage(resource.RUSAGE_SELF)
+        self._spill = self._spill_size()
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        rusage = resource.getrusage(resource.RUSAGE_SELF)
+        io = _read_proc_io()
+        status = _read_proc_status()
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+
+        peak_rss = max(self._peak_rss, status.get("VmRSS", 0))
+        if self._hwm_reset:
+            peak_rss = max(peak_rss, status.get("VmHWM", 0))
+        spill = max(self._peak_spill, self._spill_size()) - self._spill
+        measures_spill = self._cursor is not None or self.temp_directory
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+        self.usage = ResourceUsage(
+            cpu_user_time=rusage.ru_utime - self._rusage.ru_utime,
+            cpu_system_time=rusage.ru_stime - self._rusage.ru_stime,
+            peak_rss_bytes=peak_rss or None,
+            read_bytes=io["read_bytes"] - self._io["read_bytes"] if "read_bytes" in io else None,
+            write_bytes=io["write_bytes"] - self._io["write_bytes"] if "write_bytes" in io else None,
+            spill_bytes=max(spill, 0) if measures_spill else None,
+        )
+
+
+@dataclass
+class ResourceSampling:
+    interval: float = 0.05  # seconds between samples, 0 disables the sampling thread
+    temp_directory: Optional[str] = None  # duckdb temp_directory, filled in from the connection when unset
+
+    def sampler(self, conn=None) -> resource_sampler:
+        """ samples spill from conn's temporary files, or from the temp directory without a connection """
+        return resource_sampler(self.interval, self.temp_directory, conn)
+
+
+def combine_usages(usages: List[ResourceUsage]) -> Optional[ResourceUsage]:
+    """ medians of the cpu time and i/o of several executions, maxima of their peak memory and spill """
+    if not usages:
+        return None
+
+    def median(values):
+        values = [value for value in values if value is not None]
+        return statistics.median(values) if values else None
+
+    def maximum(values):
+        values = [value for value in values if value is not None]
+        return max(values) if values else None
+
+    return ResourceUsage(
+        cpu_user_time=median(usage.cpu_user_time for usage in usages),
+        cpu_system_time=median(usage.cpu_system_time for usage in usages),
+        peak_rss_bytes=maximum(usage.peak_rss_bytes for usage in usages),
+        read_bytes=median(usage.read_bytes for usage in usages),
+        write_bytes=median(usage.write_bytes for usage in usages),
+        spill_bytes=maximum(usage.spill_bytes for usage in usages),
+    )
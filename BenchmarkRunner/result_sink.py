@@ -0,0 +1,118 @@
+import os
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Set, Tuple
+
+from logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+RESULT_SUFFIX = ".ndjson"
+RUN_METADATA_SUFFIX = ".meta.json"
+
+
+def read_results(path: str) -> Iterator[Dict[str, Any]]:
+    """ yields the results of an ndjson result file, skipping a line truncated by a crash """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping truncated result line in {path}")
+
+
+def read_run_metadata(results_folder: str, run_id: str) -> Dict[str, Any]:
+    path = os.path.join(results_folder, run_id + RUN_METADATA_SUFFIX)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_new_lines(path: str, offset: int) -> Tuple[bytes, int]:
+    """
+    the complete lines written after byte offset, with the offset to continue from.
+    a line still being written is left for the next read
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    return data[:end], offset + end
+
+
+@dataclass
+class ResultSink:
+    """
+    append-only ndjson file holding one result per line, written as soon as a result is measured.
+    re-opening the sink of an existing run id appends to it, so an interrupted run can be resumed
+    """
+    folder: str
+    run_id: str
+    path: str = field(init=False)
+
+    def __post_init__(self):
+        self.path = os.path.join(self.folder, self.run_id + RESULT_SUFFIX)
+        self._file = None
+
+    def __enter__(self):
+        os.makedirs(self.folder, exist_ok=True)
+        needs_newline = False
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self._file = open(self.path, "a")
+        if needs_newline:
+            self._file.write("\n")
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._file.close()
+        self._file = None
+
+    @property
+    def metadata_path(self) -> str:
+        return os.path.join(self.folder, self.run_id + RUN_METADATA_SUFFIX)
+
+    def write_metadata(self, metadata: Dict[str, Any]):
+        """ records what the run measured, kept from the first start of a resumed run """
+        if not os.path.exists(self.metadata_path):
+            with open(self.metadata_path, "w") as f:
+                json.dump(metadata, f, indent=4)
+
+    def completed(self) -> Dict[Tuple[str, str], str]:
+        """
+        status of every (query_id, variation_id) pair already written for this run id.
+        skipped variations were never measured and are left out so that a resumed run retries them
+        """
+        if not os.path.exists(self.path):
+            return {}
+        return {
+            (result["query_id"], str(result["variation_id"])): result["status"]
+            for result in read_results(self.path)
+            if result["status"] != "SKIPPED"
+        }
+
+    def completed_rounds(self) -> Dict[Tuple[str, str], Set[int]]:
+        """ rounds already written for every (query_id, variation_id) pair of this run id """
+        rounds: Dict[Tuple[str, str], Set[int]] = {}
+        if not os.path.exists(self.path):
+            return rounds
+        for result in read_results(self.path):
+            if result["status"] != "SKIPPED":
+                rounds.setdefault((result["query_id"], str(result["variation_id"])), set()).add(result.get("round", 0))
+        return rounds
+
+    def write(self, query_id: str, result):
+        self.write_record({"query_id": query_id, **result.to_dict()})
+
+    def write_record(self, record: Dict[str, Any]):
+        """ writes an already serialized result, eg. one collected by another process """
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
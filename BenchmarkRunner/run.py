@@ -1,12 +1,13 @@
-import duckdb
-
 import os
-import motherduck
-from typing import overload
-from pathlib import Path
 
 from test_case import *
 from db_saver import save_timed_results_in_md
+from parallel import ParallelConfig, run_optimizers_in_parallel
+from scheduler import InterleaveConfig, run_interleaved
+from plan_index import PlanIndex
+from plan_store import open_plan_store
+from plan_cost import load_join_cardinalities, predict_costs, rank_optimizers, flag_variations
+from verification import find_fingerprint_mismatches
 
 BENCHMARKS = [
     TPCH := TestCase(
@@ -23,28 +24,6 @@ BENCHMARKS = [
     )
 ]
 
-OPTIMIZERS = [
-    OG := Optimizer(
-        type=OptimizerType.HEURISTIC
-    ),
-    CD := Optimizer(
-        type=OptimizerType.DP,
-        estimation_function=EstimationFunction.CARDINALITY
-    ),
-    TS := Optimizer(
-        type=OptimizerType.DP,
-        estimation_function=EstimationFunction.TABLE_SIZE
-    ),
-    DS := Optimizer(
-        type=OptimizerType.DP,
-        estimation_function=EstimationFunction.DATA_SIZE
-    ),
-    DS_SIMPLIFIED := Optimizer(
-        type=OptimizerType.DP,
-        estimation_function=EstimationFunction.DATA_SIZE_SIMPLIFIED
-    )
-]
-
 BRIDGE_COST = 10_000
 
 
@@ -52,11 +31,9 @@ def run_test_case(optimizer: str, test_case: str, explain: bool = False):
     _run_test_case(Optimizer.from_name(optimizer), TestCase.from_name(test_case), explain)
 
 
-def _run_test_case(optimizer: Optimizer, test_case: TestCase, explain: bool = False):
-    os.environ["OPTIMIZER"] = optimizer.type.name
-    if optimizer.estimation_function:
-        os.environ["ESTIMATION"] = optimizer.estimation_function.name
-    os.environ["BRIDGE_COST"] = str(BRIDGE_COST)
+def _run_test_case(optimizer: Optimizer, test_case: TestCase, explain: bool = False,
+                   bridge_cost: int = BRIDGE_COST):
+    os.environ.update(optimizer.to_env(bridge_cost))
 
     logger.info("=" * 80 +
                 f"\n      Starting Test Case [{test_case.benchmark}] with Optimizer [{optimizer.to_string()}]\n      " +
@@ -66,39 +43,33 @@ def _run_test_case(optimizer: Optimizer, test_case: TestCase, explain: bool = Fa
 
 
 def has_complete_explain_queries(optimizer: Optimizer, test_case: TestCase):
-    plans_folder = os.path.join(RESULT_ROOT, test_case.benchmark, optimizer.to_string(), "plans")
-    if not os.path.exists(plans_folder):
-        return False
-
-    query_ids = {Path(file_name).stem for file_name in os.listdir(test_case.path)}
+    query_ids = set(test_case.query_ids())
 
-    return query_ids == set(os.listdir(str(plans_folder)))
+    return query_ids == set(open_plan_store(test_case.benchmark, optimizer).query_ids())
 
 
-def identify_differentiating_queries(optimizer: Optimizer, baseline_optimizer: Optimizer, test_case: TestCase):
+def identify_differentiating_queries(optimizer: Optimizer, baseline_optimizer: Optimizer, test_case: TestCase,
+                                     bridge_cost: int = BRIDGE_COST):
+    """ writes the variations whose plan differs from the baseline's, explaining the missing ones with bridge_cost """
     if not has_complete_explain_queries(optimizer, test_case):
-        _run_test_case(optimizer, test_case, explain=True)
+        _run_test_case(optimizer, test_case, explain=True, bridge_cost=bridge_cost)
 
     if not has_complete_explain_queries(baseline_optimizer, test_case):
-        _run_test_case(baseline_optimizer, test_case, explain=True)
+        _run_test_case(baseline_optimizer, test_case, explain=True, bridge_cost=bridge_cost)
 
-    differentiating_queries = {}
+    plan_index = PlanIndex.load()
+    if plan_index.refresh(test_case.benchmark, optimizer) + plan_index.refresh(test_case.benchmark, baseline_optimizer):
+        plan_index.save()
 
-    query_ids = [Path(file_name).stem for file_name in os.listdir(test_case.path)]
+    differing = plan_index.differing_variations(test_case.benchmark, optimizer, baseline_optimizer)
 
-    plans_folder = os.path.join(RESULT_ROOT, test_case.benchmark, optimizer.to_string(), "plans")
-    baseline_plans_folder = os.path.join(RESULT_ROOT, test_case.benchmark, baseline_optimizer.to_string(), "plans")
+    query_ids = test_case.query_ids()
+    differentiating_queries = {query_id: differing.get(query_id, []) for query_id in query_ids}
 
-    for query_id in query_ids:
-        differentiating_queries[query_id] = []
-        for variation_file in os.listdir(str(plans_folder) + "/" + query_id):
-            plan = open(os.path.join(str(plans_folder), query_id, variation_file)).read()
-            baseline_plan = open(os.path.join(str(baseline_plans_folder), query_id, variation_file)).read()
-            variation_id = Path(variation_file).stem
-            if plan != baseline_plan:
-                logger.info(f"[{query_id}][{variation_id}] is different for "
-                            f"{optimizer.to_string()} and {baseline_optimizer.to_string()}")
-                differentiating_queries[query_id].append(variation_id)
+    for query_id, variation_ids in differentiating_queries.items():
+        for variation_id in variation_ids:
+            logger.info(f"[{query_id}][{variation_id}] is different for "
+                        f"{optimizer.to_string()} and {baseline_optimizer.to_string()}")
 
     index_folder = os.path.join(INDEX_ROOT, test_case.benchmark)
     if not os.path.exists(index_folder):
@@ -117,20 +88,26 @@ def union_of_differentiating_queries(test_case: str):
 def _union_of_differentiating_queries(test_case: TestCase):
     index_folder = os.path.join(INDEX_ROOT, test_case.benchmark)
 
-    union = {}
+    plan_index = PlanIndex.load()
+    refreshed = sum(plan_index.refresh(test_case.benchmark, optimizer) for optimizer in OPTIMIZERS)
+    if refreshed:
+        plan_index.save()
+
+    union = {query_id: set() for query_id in test_case.query_ids()}
 
     for optimizer in OPTIMIZERS:
-        if optimizer == OG:
+        if optimizer == OG or not plan_index.fingerprints(test_case.benchmark, optimizer):
             continue
 
-        if os.path.exists(os.path.join(str(index_folder), optimizer.to_string() + ".json")):
-            with open(os.path.join(str(index_folder), optimizer.to_string() + ".json")) as f:
-                logger.info("Loading differentiating queries for " + optimizer.to_string())
-                data = json.load(f)
-                for query_id, variations in data.items():
-                    union[query_id] = union.get(query_id, set()) | set(variations)
+        logger.info("Loading differentiating queries for " + optimizer.to_string())
+        differing = plan_index.differing_variations(test_case.benchmark, optimizer, OG)
+        for query_id, variations in differing.items():
+            union[query_id] = union.get(query_id, set()) | set(variations)
+
+    union = {query_id: natsorted(variations) for query_id, variations in union.items()}
 
-    union = {query_id: list(variations) for query_id, variations in union.items()}
+    if not os.path.exists(index_folder):
+        os.makedirs(index_folder)
 
     with open(os.path.join(str(index_folder), OG.to_string() + ".json"), 'w') as f:
         json.dump(union, f, indent=4)
@@ -138,6 +115,34 @@ def _union_of_differentiating_queries(test_case: TestCase):
     return union
 
 
+def prefilter_by_predicted_cost(test_case: TestCase, threshold: float):
+    """
+    drops the variations whose predicted cost gap between optimizers is below threshold from every index.
+    the indexes are filtered in place, so they must be regenerated by the diff and the union before every call
+    """
+    ranked = rank_optimizers(predict_costs(load_join_cardinalities(test_case.benchmark, OPTIMIZERS)), OG)
+    flagged = flag_variations(ranked, threshold)
+
+    index_folder = os.path.join(INDEX_ROOT, test_case.benchmark)
+    for optimizer in OPTIMIZERS:
+        index_file = os.path.join(str(index_folder), optimizer.to_string() + ".json")
+        if not os.path.exists(index_file):
+            continue
+
+        with open(index_file) as f:
+            data = json.load(f)
+
+        filtered = {
+            query_id: [variation_id for variation_id in variations if str(variation_id) in flagged.get(query_id, ())]
+            for query_id, variations in data.items()
+        }
+        logger.info(f"Predicted cost keeps {sum(map(len, filtered.values()))} of "
+                    f"{sum(map(len, data.values()))} variations for {optimizer.to_string()}")
+
+        with open(index_file, 'w') as f:
+            json.dump(filtered, f, indent=4)
+
+
 def end_to_end_explain_run(test_case: str):
     _end_to_end_explain_run(TestCase.from_name(test_case))
 
@@ -158,11 +163,13 @@ def _end_to_end_explain_run(test_case: TestCase):
         _run_test_case(optimizer, test_case, explain=False)
 
 
-def end_to_end_run(test_case: str):
-    _end_to_end_run(TestCase.from_name(test_case))
+def end_to_end_run(test_case: str, parallel: Optional[ParallelConfig] = None, cost_threshold: Optional[float] = None,
+                   interleaved: Optional[InterleaveConfig] = None):
+    _end_to_end_run(TestCase.from_name(test_case), parallel, cost_threshold, interleaved)
 
 
-def _end_to_end_run(test_case: TestCase):
+def _end_to_end_run(test_case: TestCase, parallel: Optional[ParallelConfig] = None,
+                    cost_threshold: Optional[float] = None, interleaved: Optional[InterleaveConfig] = None):
     for optimizer in OPTIMIZERS:
         if optimizer == OG:
             continue
@@ -170,10 +177,26 @@ def _end_to_end_run(test_case: TestCase):
 
     _union_of_differentiating_queries(test_case)
 
-    for optimizer in OPTIMIZERS:
-        _run_test_case(optimizer, test_case, explain=False)
-        save_timed_results_in_md(optimizer, test_case)
-
-
-# union_of_differentiating_queries("tpch")
-end_to_end_run("tpch")
+    if cost_threshold:
+        prefilter_by_predicted_cost(test_case, cost_threshold)
+
+    if parallel or interleaved:
+        if interleaved:
+            result_paths = run_interleaved(OPTIMIZERS, test_case, BRIDGE_COST, interleaved)
+        else:
+            result_paths = run_optimizers_in_parallel(OPTIMIZERS, test_case, BRIDGE_COST, parallel)
+        for optimizer in OPTIMIZERS:
+            if optimizer.to_string() in result_paths:
+                save_timed_results_in_md(optimizer, test_case)
+    else:
+        for optimizer in OPTIMIZERS:
+            _run_test_case(optimizer, test_case, explain=False)
+            save_timed_results_in_md(optimizer, test_case)
+
+    if test_case.verify_results:
+        find_fingerprint_mismatches(test_case, OPTIMIZERS, OG)
+
+
+if __name__ == "__main__":
+    # union_of_differentiating_queries("tpch")
+    end_to_end_run("tpch")
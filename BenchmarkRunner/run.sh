@@ -2,7 +2,7 @@
 
 source .env
 
-#python -c'import run; run.end_to_end_explain_run("tpch")'
-python -c 'import run; run.end_to_end_run("tpch")'
+#python main.py explain -b tpch
+python main.py run -b tpch
 
-#python -c 'import run; run.run_test_case("CD", "tpch")'
+#python main.py run -b tpch -o cd
@@ -0,0 +1,211 @@
+import os
+import json
+import logging
+from dataclasses import dataclass, field, replace
+from typing import List, Tuple
+import polars as pl
+
+from test_case import *
+from result_sink import RESULT_SUFFIX, read_results
+from parallel import _configure_worker
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+VARIATION_KEY = ["query_id", "variation_id"]
+CURVES_FILE = "curves.parquet"
+CROSSOVERS_FILE = "crossovers.parquet"
+SCALING_MANIFEST = "scaling.json"
+
+
+@dataclass
+class ScaleDatabase:
+    scale_factor: float
+    database: str  # attached in place of the backend's database, a local path or an md: database
+
+    @staticmethod
+    def parse(value: str):
+        """ parses SF=PATH, eg. 10=~/tpch_sf10.db """
+        scale_factor, database = value.split("=", 1)
+        return ScaleDatabase(float(scale_factor), database)
+
+
+@dataclass
+class ScalingConfig:
+    databases: List[ScaleDatabase]
+    optimizers: List[Optimizer] = field(default_factory=lambda: list(OPTIMIZERS))
+    baseline: Optimizer = field(default_factory=lambda: OG)
+    bridge_cost: int = 10_000
+
+
+def scaling_folder(benchmark: str, run_id: str) -> str:
+    return os.path.join(RESULT_ROOT, benchmark, "scaling", run_id)
+
+
+def _scale_folder(folder: str, scale_factor: float, optimizer: Optimizer) -> str:
+    return os.path.join(folder, f"sf={scale_factor:g}", optimizer.to_string())
+
+
+def run_scaling(test_case: TestCase, config: ScalingConfig) -> str:
+    """
+    times the union of the differentiating variations in Indexes/<benchmark> with every optimizer against
+    every database, each result file resumes on its own so an interrupted study continues where it stopped.
+    results go to Results/<benchmark>/scaling/<run_id>/sf=<scale factor>/<optimizer>, returns that folder
+    """
+    run_id = test_case.run_id or datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    test_case = replace(test_case, run_id=run_id)
+    folder = scaling_folder(test_case.benchmark, run_id)
+    # the baseline's index holds the union, every optimizer runs every variation so their curves can be compared
+    variations = test_case._collect_variations_from_file(config.baseline)
+    optimizers = config.optimizers if config.baseline in config.optimizers else [config.baseline, *config.optimizers]
+
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, SCALING_MANIFEST), "w") as f:
+        json.dump({
+            "benchmark": test_case.benchmark,
+            "baseline": config.baseline.to_string(),
+            "optimizers": [optimizer.to_string() for optimizer in optimizers],
+            "databases": {f"{scale.scale_factor:g}": scale.database for scale in config.databases},
+        }, f, indent=4)
+
+    for scale in sorted(config.databases, key=lambda scale: scale.scale_factor):
+        scaled = replace(test_case, backend=replace(test_case.backend, database=scale.database))
+        for optimizer in optimizers:
+            logger.info(f"======= Scaling [{test_case.benchmark}] at scale factor {scale.scale_factor:g} "
+                        f"with Optimizer [{optimizer.to_string()}] =======")
+            configured = _configure_worker(optimizer, scaled, config.bridge_cost)
+            with ResultSink(_scale_folder(folder, scale.scale_factor, optimizer), run_id) as sink:
+                configured._run(optimizer, sink, variations)
+    return folder
+
+
+def load_scaling_results(folder: str) -> pl.DataFrame:
+    """ the median duration of every successful variation, per scale factor and optimizer """
+    with open(os.path.join(folder, SCALING_MANIFEST)) as f:
+        manifest = json.load(f)
+    run_id = os.path.basename(os.path.normpath(folder))
+
+    rows = []
+    for scale_factor in manifest["databases"]:
+        for optimizer in manifest["optimizers"]:
+            path = os.path.join(folder, f"sf={scale_factor}", optimizer, run_id + RESULT_SUFFIX)
+            if not os.path.exists(path):
+                continue
+            rows.extend(
+                {
+                    "scale_factor": float(scale_factor),
+                    "optimizer": optimizer,
+                    "query_id": result["query_id"],
+                    "variation_id": int(result["variation_id"]),
+                    "duration": float(result["duration"]),
+                }
+                for result in read_results(path)
+                if result["status"] == QueryRunStatus.SUCCESS.name and result["duration"] > 0
+            )
+    return pl.DataFrame(rows, schema={
+        "scale_factor": pl.Float64,
+        "optimizer": pl.Utf8,
+        "query_id": pl.Utf8,
+        "variation_id": pl.Int64,
+        "duration": pl.Float64,
+    })
+
+
+def fit_curves(results: pl.DataFrame) -> pl.DataFrame:
+    """
+    fits duration = exp(intercept) * scale_factor ** exponent to every variation and optimizer by least squares
+    on the logs of both, all curves at once. variations measured at fewer than two scale factors are dropped
+    """
+    x = pl.col("scale_factor").log()
+    y = pl.col("duration").log()
+    key = ["optimizer", *VARIATION_KEY]
+    return (
+        results.lazy()
+        .group_by(key)
+        .agg(
+            pl.len().alias("points"),
+            x.mean().alias("x_mean"),
+            y.mean().alias("y_mean"),
+            ((x - x.mean()) * (y - y.mean())).sum().alias("sxy"),
+            ((x - x.mean()) ** 2).sum().alias("sxx"),
+            ((y - y.mean()) ** 2).sum().alias("syy"),
+            pl.col("scale_factor").min().alias("min_scale_factor"),
+            pl.col("scale_factor").max().alias("max_scale_factor"),
+        )
+        .filter((pl.col("points") >= 2) & (pl.col("sxx") > 0))
+        .with_columns((pl.col("sxy") / pl.col("sxx")).alias("exponent"))
+        .with_columns(
+            (pl.col("y_mean") - pl.col("exponent") * pl.col("x_mean")).alias("intercept"),
+            pl.when(pl.col("syy") > 0)
+            .then(pl.col("sxy") ** 2 / (pl.col("sxx") * pl.col("syy")))
+            .otherwise(1.0)
+            .alias("r_squared"),
+        )
+        .select([*key, "points", "min_scale_factor", "max_scale_factor", "exponent", "intercept", "r_squared"])
+        .sort(key)
+        .collect()
+    )
+
+
+def crossovers(curves: pl.DataFrame, baseline: str) -> pl.DataFrame:
+    """
+    the scale factor at which each optimizer's curve crosses the baseline's, per variation.
+    curves with the same exponent never cross. a crossover beyond the measured scale factors is extrapolated,
+    faster_beyond tells which of the two wins past the crossover
+    """
+    key = ["optimizer", *VARIATION_KEY]
+    candidate_curves = curves.filter(pl.col("optimizer") != baseline)
+    baseline_curves = curves.filter(pl.col("optimizer") == baseline).select(
+        *VARIATION_KEY, "exponent", "intercept"
+    )
+    log_crossover = (pl.col("baseline_intercept") - pl.col("intercept")) / (
+            pl.col("exponent") - pl.col("baseline_exponent"))
+    return (
+        candidate_curves.join(baseline_curves, on=VARIATION_KEY, suffix="_baseline")
+        .rename({"exponent_baseline": "baseline_exponent", "intercept_baseline": "baseline_intercept"})
+        .with_columns(
+            pl.when(pl.col("exponent") != pl.col("baseline_exponent"))
+            .then(log_crossover.exp())
+            .otherwise(None)
+            .alias("crossover_scale_factor"),
+            pl.when((pl.col("exponent") < pl.col("baseline_exponent"))
+                    | ((pl.col("exponent") == pl.col("baseline_exponent"))
+                       & (pl.col("intercept") < pl.col("baseline_intercept"))))
+            .then(pl.col("optimizer"))
+            .otherwise(pl.lit(baseline))
+            .alias("faster_beyond"),
+        )
+        .with_columns(
+            ((pl.col("crossover_scale_factor") < pl.col("min_scale_factor"))
+             | (pl.col("crossover_scale_factor") > pl.col("max_scale_factor"))).alias("extrapolated")
+        )
+        .select([*key, "exponent", "baseline_exponent", "crossover_scale_factor", "faster_beyond", "extrapolated"])
+        .sort(key)
+    )
+
+
+def analyze_scaling(folder: str) -> Tuple[pl.DataFrame, pl.DataFrame]:
+    """ fits the curves of a scaling study and writes them and their crossovers next to its results """
+    with open(os.path.join(folder, SCALING_MANIFEST)) as f:
+        baseline = json.load(f)["baseline"]
+
+    curves = fit_curves(load_scaling_results(folder))
+    crossings = crossovers(curves, baseline)
+    curves.write_parquet(os.path.join(folder, CURVES_FILE))
+    crossings.write_parquet(os.path.join(folder, CROSSOVERS_FILE))
+    logger.info(f"Fitted {len(curves)} curves, {crossings['extrapolated'].not_().sum()} variations cross "
+                f"the baseline inside the measured scale factors")
+    return curves, crossings
+
+
+def save_scaling(test_case: TestCase, folder: str):
+    """ replaces <benchmark>.scaling_curves and <benchmark>.scaling_crossovers in the result store with the study's """
+    curves = pl.read_parquet(os.path.join(folder, CURVES_FILE))
+    crossings = pl.read_parquet(os.path.join(folder, CROSSOVERS_FILE))
+    conn = test_case.result_store.connect()
+    conn.register("curves", curves)
+    conn.register("crossings", crossings)
+    conn.sql(f"CREATE SCHEMA IF NOT EXISTS {test_case.benchmark}")
+    conn.sql(f"CREATE OR REPLACE TABLE {test_case.benchmark}.scaling_curves AS SELECT * FROM curves")
+    conn.sql(f"CREATE OR REPLACE TABLE {test_case.benchmark}.scaling_crossovers AS SELECT * FROM crossings")
+    conn.close()
@@ -0,0 +1,200 @@
+import os
+import time
+import random
+import logging
+import tempfile
+import multiprocessing
+from contextlib import ExitStack
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+from test_case import *
+from parallel import _configure_worker
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class InterleaveConfig:
+    rounds: int = 2  # executions of every variation per optimizer
+    seed: Optional[int] = None
+
+
+@dataclass
+class WorkerFailure:
+    """ sent by a worker that cannot serve variations, or made up by the coordinator when its pipe closed """
+    message: str
+
+
+def _receive(channel, task=None):
+    """ sends the task, if any, and returns the worker's answer, a WorkerFailure once the worker exited """
+    try:
+        if task is not None:
+            channel.send(task)
+        return channel.recv()
+    except (EOFError, OSError) as e:
+        return WorkerFailure(f"worker exited: {str(e) or type(e).__name__}")
+
+
+def _stop(channel):
+    """ asks a worker to finish, a worker that already exited has nothing to finish """
+    try:
+        channel.send(None)
+    except OSError:
+        pass
+
+
+def _serve_variations(optimizer: Optimizer, test_case: TestCase, bridge_cost: int, tasks):
+    """
+    keeps one connection open for the optimizer and executes the variations sent over tasks until None.
+    a task is (query_id, variation_id, seconds left until the benchmark deadline or None, whether to profile).
+    the run metadata of the connection is sent first, a WorkerFailure instead when the worker cannot start.
+    """
+    conn = None
+    profile_rows: Dict[str, List[Dict[str, Any]]] = {}
+    try:
+        try:
+            test_case = _configure_worker(optimizer, test_case, bridge_cost)
+            conn = test_case._connect()
+            metadata = test_case._run_metadata(optimizer, conn, test_case.run_id)
+            resources = test_case._resource_sampling(conn)
+        except Exception as e:
+            tasks.send(WorkerFailure(str(e)))
+            return
+        tasks.send(metadata)
+        repetition = test_case._cache_repetition()
+        profile_path = os.path.join(tempfile.gettempdir(), f"profile_{os.getpid()}.json")
+        while (task := tasks.recv()) is not None:
+            query_id, variation_id, remaining, profile = task
+            for profiled_query_id in [key for key in profile_rows if key != query_id]:
+                write_profiles(test_case.benchmark, optimizer, test_case.run_id, profiled_query_id,
+                               profile_rows.pop(profiled_query_id))
+            deadline = time.perf_counter() + remaining if remaining is not None else None
+            try:
+                variation = test_case.variation(False, query_id, variation_id)
+                conn = test_case._prepare_connection(conn)
+                result = variation.run(conn, repetition, test_case.timeouts.timeout_for(query_id, deadline),
+                                       test_case.consumption_mode, resources, test_case.verify_results,
+                                       test_case.prepare_statements)
+                result.cache_mode = test_case.cache_mode
+                if profile and result.status == QueryRunStatus.SUCCESS:
+                    rows, timings = variation.profile(conn, profile_path)
+                    profile_rows.setdefault(query_id, []).extend(rows)
+                    result.optimizer_time = timings["optimizer"]
+            except Exception as e:
+                # duckdb exceptions do not always survive pickling
+                result = RuntimeError(str(e))
+            tasks.send(result)
+        for profiled_query_id, rows in profile_rows.items():
+            write_profiles(test_case.benchmark, optimizer, test_case.run_id, profiled_query_id, rows)
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def run_interleaved(
+        optimizers: List[Optimizer],
+        test_case: TestCase,
+        bridge_cost: int,
+        config: InterleaveConfig = InterleaveConfig()
+) -> Dict[str, str]:
+    """
+    executes every variation on every optimizer configuration in randomized ABAB order, so that drift over
+    the course of a run affects all optimizers alike and each variation yields paired samples.
+    each optimizer keeps one connection open in its own worker process and only one executes at a time.
+    the variations are read from the index of the first optimizer, the baseline holding the union.
+    dedup_plans, profile and the timeouts apply as in TestCase._run: an optimizer executes only the first
+    variation of each of its plan classes per round, only the first round is profiled, and variations are
+    recorded as SKIPPED for the same reasons. an optimizer whose worker fails is dropped from the interleaving.
+    returns the result file of every optimizer, keyed by optimizer.to_string()
+    """
+    run_id = test_case.run_id or datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    test_case = replace(test_case, run_id=run_id)
+    rng = random.Random(config.seed)
+
+    query_ids = test_case.query_ids()
+    variations = test_case._collect_variations_from_file(optimizers[0])
+    fingerprints = {
+        optimizer.to_string(): test_case._plan_fingerprints(optimizer) if test_case.dedup_plans else {}
+        for optimizer in optimizers
+    }
+    deadline = None
+    if test_case.timeouts.benchmark_timeout is not None:
+        deadline = time.perf_counter() + test_case.timeouts.benchmark_timeout
+
+    ctx = multiprocessing.get_context("spawn")
+    with ExitStack() as stack:
+        sinks: Dict[str, ResultSink] = {}
+        completed = {}
+        statuses = {}
+        channels = {}
+        for optimizer in optimizers:
+            name = optimizer.to_string()
+            sinks[name] = stack.enter_context(ResultSink(test_case.results_folder(optimizer), run_id))
+            completed[name] = sinks[name].completed_rounds()
+            statuses[name] = sinks[name].completed()
+
+            parent_end, worker_end = ctx.Pipe()
+            worker = ctx.Process(target=_serve_variations, args=(optimizer, test_case, bridge_cost, worker_end))
+            worker.start()
+            # only the worker holds its end, so that receiving from a worker that exited fails instead of blocking
+            worker_end.close()
+            stack.callback(worker.join)
+            stack.callback(_stop, parent_end)
+            metadata = _receive(parent_end)
+            if isinstance(metadata, WorkerFailure):
+                logger.error(f"Worker of [{name}] failed to start, not running it: {metadata.message}")
+                continue
+            channels[name] = parent_end
+            sinks[name].write_metadata(metadata)
+
+        # (optimizer, query_id, plan class, round) -> the representative's result
+        representatives: Dict[Tuple[str, str, str, int], QueryResult] = {}
+        for query_id in query_ids:
+            logger.info(f"======= Interleaving query: {query_id} =======")
+            for variation_id in variations[query_id]:
+                for round_index in range(config.rounds):
+                    order = list(channels)
+                    rng.shuffle(order)
+                    for name in order:
+                        if name not in channels:
+                            continue
+                        if round_index in completed[name].get((query_id, str(variation_id)), ()):
+                            continue
+
+                        skip_reason = test_case._skip_reason(query_id, [variation_id], statuses[name], deadline)
+                        if skip_reason:
+                            sinks[name].write(query_id, QueryResult(
+                                variation_id=variation_id, duration=0.0, status=QueryRunStatus.SKIPPED,
+                                message=skip_reason, round=round_index))
+                            continue
+
+                        plan_class = fingerprints[name].get(query_id, {}).get(str(variation_id))
+                        representative = representatives.get((name, query_id, plan_class, round_index))
+                        if representative is not None:
+                            statuses[name][(query_id, str(variation_id))] = representative.status.name
+                            sinks[name].write(query_id, replace(representative, variation_id=variation_id))
+                            continue
+
+                        remaining = deadline - time.perf_counter() if deadline is not None else None
+                        result = _receive(channels[name], (query_id, variation_id, remaining,
+                                                           test_case.profile and round_index == 0))
+                        if isinstance(result, WorkerFailure):
+                            logger.error(f"Worker of [{name}] failed at [{query_id}][{variation_id}], "
+                                         f"dropping it from the interleaving: {result.message}")
+                            del channels[name]
+                            continue
+                        if isinstance(result, Exception):
+                            if test_case.raise_on_error:
+                                raise result
+                            logger.error(f"[{query_id}][{variation_id}] failed on [{name}]: {result}")
+                            continue
+                        result = replace(result, round=round_index)
+                        statuses[name][(query_id, str(variation_id))] = result.status.name
+                        if plan_class is not None:
+                            result = replace(result, plan_class=plan_class, representative_id=variation_id)
+                            representatives[(name, query_id, plan_class, round_index)] = result
+                        sinks[name].write(query_id, result)
+
+        return {name: sink.path for name, sink in sinks.items()}
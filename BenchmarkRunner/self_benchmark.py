@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List
+
+# measures the time the harness itself adds around every query: reading variations, logging, timing,
+# serializing and storing results, on a synthetic benchmark whose queries take next to no time
+
+BENCHMARK = "synthetic"
+QUERIES = 10
+DEFAULT_SIZES = [10, 100, 1_000, 10_000, 100_000]
+STAGES = ["explain", "diff", "union", "run", "save"]
+
+
+@contextmanager
+def synthetic_tree(n_variations: int):
+    """
+    a scratch directory laid out like the repository, with n_variations trivial variations spread over
+    QUERIES queries and a small local database. the working directory is moved into it while in use
+    """
+    import duckdb
+
+    root = tempfile.mkdtemp(prefix="self_benchmark_")
+    work = os.path.join(root, "BenchmarkRunner")
+    os.makedirs(work)
+    for variation in range(n_variations):
+        query_id = f"q{variation % QUERIES + 1}"
+        folder = os.path.join(root, "SampleData", "permuted_queries", BENCHMARK, "queries", query_id)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"{variation // QUERIES + 1}.sql"), "w") as f:
+            f.write("SELECT count(*) FROM local.t WHERE a > 1;\n")
+
+    database = os.path.join(root, "synthetic.db")
+    conn = duckdb.connect(database)
+    conn.execute("CREATE TABLE t AS SELECT range AS a FROM range(10)")
+    conn.close()
+
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        yield database
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _timed(action: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    action()
+    return time.perf_counter() - start
+
+
+def measure(n_variations: int) -> Dict[str, Any]:
+    """ wall time of every stage, and of the run stage the share not spent inside the measured queries """
+    import motherduck
+    from test_case import TestCase
+    from result_sink import read_results
+    from run import OG, CD, identify_differentiating_queries, _union_of_differentiating_queries
+    from db_saver import save_timed_results_in_md
+
+    with synthetic_tree(n_variations) as database:
+        test_case = TestCase(
+            benchmark=BENCHMARK,
+            raise_on_error=True,
+            run_id="self_benchmark",
+            backend=motherduck.LocalBackend(database=database),
+            result_store=motherduck.LocalResultStore(os.path.join("..", "Results", "results.duckdb")),
+        )
+        variations = {query_id: list(test_case.variation_ids(query_id)) for query_id in test_case.query_ids()}
+
+        stages = {
+            "explain": _timed(lambda: [test_case.run(optimizer, explain=True) for optimizer in (OG, CD)]),
+            "diff": _timed(lambda: identify_differentiating_queries(CD, OG, test_case)),
+            "union": _timed(lambda: _union_of_differentiating_queries(test_case)),
+        }
+
+        def run():
+            with test_case.result_sink(OG) as sink:
+                test_case._run(OG, sink, variations)
+            return sink.path
+
+        stages["run"] = _timed(run)
+        stages["save"] = _timed(lambda: save_timed_results_in_md(OG, test_case))
+
+        measured = sum(sum(result["samples"]) for result in read_results(
+            os.path.join(test_case.results_folder(OG), test_case.run_id + ".ndjson")))
+
+    return {
+        "variations": n_variations,
+        "stages": stages,
+        "per_variation_us": {stage: seconds / n_variations * 1e6 for stage, seconds in stages.items()},
+        "run_overhead_us": (stages["run"] - measured) / n_variations * 1e6,
+        "run_overhead_share": (stages["run"] - measured) / stages["run"] if stages["run"] else None,
+    }
+
+
+def measure_components(repeat: int = 10_000) -> Dict[str, float]:
+    """ cost in microseconds of the per variation pieces of the harness, outside of any query """
+    from test_case import QueryResult, QueryRunStatus, QueryVariation, stopwatch
+    from natsort import natsorted
+
+    logger = logging.getLogger("test_case")
+
+    with synthetic_tree(QUERIES) as _:
+        query_root = os.path.join("..", "SampleData", "permuted_queries", BENCHMARK, "queries")
+        result = QueryResult(variation_id=1, duration=0.001, status=QueryRunStatus.SUCCESS, message="",
+                             samples=[0.001])
+
+        def per_call(action: Callable[[], Any]) -> float:
+            return _timed(lambda: [action() for _ in range(repeat)]) / repeat * 1e6
+
+        def empty_stopwatch():
+            with stopwatch():
+                pass
+
+        return {
+            "from_query_info": per_call(lambda: QueryVariation.from_query_info(False, BENCHMARK, "q1", 1)),
+            "natsorted_listdir": per_call(lambda: natsorted(os.listdir(query_root))),
+            "stopwatch": per_call(empty_stopwatch),
+            "log_line": per_call(lambda: logger.info("Query [q1][1] [SUCCESS].")),
+            "result_json": per_call(result.to_json),
+        }
+
+
+def regressions(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """ per variation overheads that grew by more than tolerance over the baseline at the same size """
+    failures = []
+    baseline_by_size = {entry["variations"]: entry for entry in baseline.get("scaling", [])}
+    for entry in current["scaling"]:
+        previous = baseline_by_size.get(entry["variations"])
+        if previous is None:
+            continue
+        for stage, value in entry["per_variation_us"].items():
+            allowed = previous["per_variation_us"][stage] * (1 + tolerance)
+            if value > allowed:
+                failures.append(f"{stage} at {entry['variations']} variations: {value:.1f} us > {allowed:.1f} us")
+    for component, value in current["components"].items():
+        allowed = baseline.get("components", {}).get(component, float("inf")) * (1 + tolerance)
+        if value > allowed:
+            failures.append(f"{component}: {value:.2f} us > {allowed:.2f} us")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the per variation overhead of the benchmark harness")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="variations per scaling step")
+    parser.add_argument("--output", default="self_benchmark.json")
+    parser.add_argument("--baseline", default=None, help="earlier output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative growth over the baseline")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    # the harness logs every variation, which is part of what is measured but must not flood the console
+    logging.basicConfig(stream=open(os.devnull, "w"), level=logging.INFO, force=True)
+
+    report = {"components": measure_components(), "scaling": []}
+    for size in args.sizes:
+        entry = measure(size)
+        report["scaling"].append(entry)
+        print(f"{size:>8} variations  " + "  ".join(
+            f"{stage} {entry['per_variation_us'][stage]:9.1f} us" for stage in STAGES
+        ) + f"  run overhead {entry['run_overhead_us']:9.1f} us")
+    for component, value in report["components"].items():
+        print(f"{component:20s} {value:9.2f} us")
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            failures = regressions(report, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"REGRESSED {failure}")
+        sys.exit(1 if failures else 0)
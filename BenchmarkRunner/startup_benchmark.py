@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from typing import List, Tuple
+
+# modules cheap commands must not import, each of them costs tens to hundreds of milliseconds
+HEAVY_MODULES = ["duckdb", "polars", "natsort", "db_saver", "test_case", "run"]
+
+CHEAP_COMMANDS = [
+    ["--help"],
+    ["indexes"],
+    ["indexes", "--help"],
+    ["diff", "-b", "tpch"],
+    ["diff", "--help"],
+    ["run", "--help"],
+    ["sweep", "--help"],
+]
+
+
+def _imported_modules(command: List[str]) -> List[str]:
+    """ top level modules imported by main.py for the command, from python -X importtime """
+    process = subprocess.run([sys.executable, "-X", "importtime", "main.py", *command],
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    modules = []
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.append(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def _timed(command: List[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(command, capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.perf_counter() - start
+
+
+def _startup_time(command: List[str], repeat: int) -> float:
+    """ median wall clock time of running main.py with the command in a fresh interpreter """
+    return statistics.median(_timed([sys.executable, "main.py", *command]) for _ in range(repeat))
+
+
+def check_startup(threshold: float, repeat: int) -> List[Tuple[str, str]]:
+    """ times every cheap command, returns the failures as (command, reason) """
+    failures = []
+    interpreter = statistics.median(_timed([sys.executable, "-c", "pass"]) for _ in range(repeat))
+    print(f"{'interpreter':30s} {interpreter * 1000:8.1f} ms")
+    for command in CHEAP_COMMANDS:
+        name = " ".join(command)
+        duration = _startup_time(command, repeat)
+        heavy = sorted(set(_imported_modules(command)) & set(HEAVY_MODULES))
+        print(f"{name:30s} {duration * 1000:8.1f} ms {'imports ' + ', '.join(heavy) if heavy else ''}")
+        if heavy:
+            failures.append((name, f"imports {', '.join(heavy)}"))
+        if duration - interpreter > threshold:
+            failures.append((name, f"{(duration - interpreter) * 1000:.1f} ms over the interpreter start"))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fails when cheap CLI commands start slowly or import heavy modules")
+    parser.add_argument("--threshold", type=float, default=0.1, help="seconds allowed on top of the interpreter start")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    failures = check_startup(args.threshold, args.repeat)
+    for name, reason in failures:
+        print(f"FAILED {name}: {reason}")
+    sys.exit(1 if failures else 0)
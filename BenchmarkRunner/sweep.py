@@ -0,0 +1,194 @@
+import os
+import json
+import math
+import random
+import statistics
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+from test_case import *
+from result_sink import read_results
+from parallel import ParallelConfig, _configure_worker, _init_worker, _partition_cpus
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# relative runtime charged to a candidate for a variation it failed or timed out on
+FAILURE_PENALTY = 10.0
+
+
+@dataclass
+class SweepCandidate:
+    optimizer: Optimizer
+    bridge_cost: int
+
+    def to_string(self):
+        return f"{self.optimizer.to_string()}_{self.bridge_cost}"
+
+
+@dataclass
+class SweepConfig:
+    bridge_costs: List[int]
+    estimation_functions: List[EstimationFunction] = field(default_factory=lambda: list(EstimationFunction))
+    initial_sample: int = 50  # differentiating variations every candidate is evaluated on in the first round
+    keep_fraction: float = 0.5  # share of the candidates kept after each round, the sample grows by its inverse
+    finalists: int = 1  # once this few candidates are left, they are run on every differentiating variation
+    baseline: Optimizer = field(default_factory=lambda: Optimizer(type=OptimizerType.HEURISTIC))
+    baseline_bridge_cost: int = 10_000
+    seed: Optional[int] = None
+    parallel: Optional[ParallelConfig] = None  # evaluates the candidates of a round concurrently
+
+
+def bridge_cost_range(start: int, stop: int, num: int) -> List[int]:
+    """ num bridge costs spaced geometrically from start to stop """
+    if num == 1:
+        return [start]
+    ratio = (stop / start) ** (1 / (num - 1))
+    return sorted({round(start * ratio ** i) for i in range(num)})
+
+
+def sweep_candidates(config: SweepConfig) -> List[SweepCandidate]:
+    return [
+        SweepCandidate(Optimizer(type=OptimizerType.DP, estimation_function=estimation_function), bridge_cost)
+        for estimation_function in config.estimation_functions
+        for bridge_cost in config.bridge_costs
+    ]
+
+
+def _sample_variations(test_case: TestCase, baseline: Optimizer, seed: Optional[int]) -> List[Tuple[str, str]]:
+    """ every differentiating variation of the baseline's union index, in a random but reproducible order """
+    variations = [
+        (query_id, str(variation_id))
+        for query_id, variation_ids in test_case._collect_variations_from_file(baseline).items()
+        for variation_id in variation_ids
+    ]
+    random.Random(seed).shuffle(variations)
+    return variations
+
+
+def _as_index(variations: List[Tuple[str, str]]) -> Dict[str, List[str]]:
+    index: Dict[str, List[str]] = {}
+    for query_id, variation_id in variations:
+        index.setdefault(query_id, []).append(variation_id)
+    return {query_id: natsorted(variation_ids) for query_id, variation_ids in index.items()}
+
+
+def _evaluate(candidate: SweepCandidate, test_case: TestCase, variations: Dict[str, List[str]], folder: str) -> str:
+    test_case = _configure_worker(candidate.optimizer, test_case, candidate.bridge_cost)
+    with ResultSink(folder, test_case.run_id) as sink:
+        test_case._run(candidate.optimizer, sink, variations)
+    return sink.path
+
+
+def _durations(path: str) -> Dict[Tuple[str, str], Tuple[str, float]]:
+    return {
+        (result["query_id"], str(result["variation_id"])): (result["status"], result["duration"])
+        for result in read_results(path)
+    }
+
+
+def relative_runtime(candidate: Dict[Tuple[str, str], Tuple[str, float]],
+                     baseline: Dict[Tuple[str, str], Tuple[str, float]],
+                     variations: List[Tuple[str, str]]) -> Optional[float]:
+    """
+    geometric mean of the candidate's runtime relative to the baseline over the variations the baseline
+    completed, lower is better
+    """
+    log_ratios = []
+    for variation in variations:
+        baseline_status, baseline_duration = baseline.get(variation, (None, 0.0))
+        if baseline_status != QueryRunStatus.SUCCESS.name or baseline_duration <= 0:
+            continue
+        status, duration = candidate.get(variation, (None, 0.0))
+        if status == QueryRunStatus.SUCCESS.name:
+            log_ratios.append(math.log(max(duration, 1e-9) / baseline_duration))
+        elif status is not None and status != QueryRunStatus.SKIPPED.name:
+            log_ratios.append(math.log(FAILURE_PENALTY))
+    return math.exp(statistics.fmean(log_ratios)) if log_ratios else None
+
+
+def _evaluate_all(candidates: List[SweepCandidate], test_case: TestCase, variations: Dict[str, List[str]],
+                  sweep_folder: str, parallel: Optional[ParallelConfig]) -> Dict[str, str]:
+    """ runs every candidate on the variations, returns the result file of each that completed """
+    max_workers = (parallel.max_workers or len(candidates)) if parallel else 1
+    ctx = multiprocessing.get_context("spawn")
+    cpu_sets = ctx.Queue()
+    for cpus in (_partition_cpus(max_workers) if parallel and parallel.pin_cpus else [None] * max_workers):
+        cpu_sets.put(cpus)
+
+    paths: Dict[str, str] = {}
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=ctx,
+                             initializer=_init_worker,
+                             initargs=(cpu_sets,)) as executor:
+        futures = {
+            candidate.to_string(): executor.submit(_evaluate, candidate, test_case, variations,
+                                                   os.path.join(sweep_folder, candidate.to_string()))
+            for candidate in candidates
+        }
+        for name, future in futures.items():
+            try:
+                paths[name] = future.result()
+            except Exception as e:
+                if test_case.raise_on_error:
+                    raise e
+                logger.error(f"Sweep candidate [{name}] failed on [{test_case.benchmark}]: {e}")
+    return paths
+
+
+def successive_halving(test_case: TestCase, config: SweepConfig) -> List[Dict[str, Any]]:
+    """
+    evaluates every candidate on a small sample of differentiating variations, keeps the best keep_fraction
+    and grows the sample by its inverse until the finalists have run on every differentiating variation.
+    each candidate resumes its own result file, so variations evaluated in earlier rounds are not re-executed.
+    results go to Results/<benchmark>/sweep/<run_id>, returns the scores of every round
+    """
+    run_id = test_case.run_id or datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    test_case = replace(test_case, run_id=run_id)
+    sweep_folder = os.path.join(RESULT_ROOT, test_case.benchmark, "sweep", run_id)
+
+    variations = _sample_variations(test_case, config.baseline, config.seed)
+    baseline = SweepCandidate(config.baseline, config.baseline_bridge_cost)
+    survivors = sweep_candidates(config)
+    sample_size = min(config.initial_sample, len(variations))
+
+    rounds = []
+    while True:
+        sample = variations[:sample_size]
+        logger.info(f"======= Sweep round {len(rounds)}: {len(survivors)} candidates "
+                    f"on {len(sample)} variations =======")
+        paths = _evaluate_all([baseline, *survivors], test_case, _as_index(sample), sweep_folder, config.parallel)
+
+        if baseline.to_string() not in paths:
+            raise RuntimeError(f"Baseline [{baseline.to_string()}] failed, candidates cannot be scored")
+        baseline_durations = _durations(paths[baseline.to_string()])
+        scores = {
+            candidate.to_string(): relative_runtime(_durations(paths[candidate.to_string()]), baseline_durations,
+                                                    sample)
+            for candidate in survivors if candidate.to_string() in paths
+        }
+        survivors = sorted(
+            (candidate for candidate in survivors if scores.get(candidate.to_string()) is not None),
+            key=lambda candidate: scores[candidate.to_string()]
+        )
+        rounds.append({"variations": len(sample), "scores": scores})
+        for candidate in survivors:
+            logger.info(f"[{candidate.to_string()}] runs {scores[candidate.to_string()]:.3f}x the baseline")
+
+        if sample_size == len(variations) or not survivors:
+            break
+        keep = max(config.finalists, math.ceil(len(survivors) * config.keep_fraction))
+        survivors = survivors[:keep]
+        sample_size = min(len(variations), math.ceil(sample_size / config.keep_fraction))
+        if len(survivors) <= config.finalists:
+            sample_size = len(variations)
+
+    os.makedirs(sweep_folder, exist_ok=True)
+    with open(os.path.join(sweep_folder, "rounds.json"), "w") as f:
+        json.dump(rounds, f, indent=4)
+    if survivors:
+        logger.info(f"Best configuration: {survivors[0].to_string()}")
+    return rounds
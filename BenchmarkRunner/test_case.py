@@ -2,16 +2,31 @@ import duckdb
 from duckdb import DuckDBPyConnection
 import time
 import datetime
+import threading
 import os
-from typing import Any, Dict, List, Optional, Tuple
-from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from dataclasses import dataclass, field, replace, asdict
 from enum import Enum
 import re
 import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import statistics
+import itertools
+import hashlib
 from natsort import natsorted
 
 from definitions import *
 from optimizer import *
+from repetition import *
+from plan_index import PlanIndex
+from plan_store import open_plan_store
+from result_sink import ResultSink
+from profiling import parse_profile, write_profiles, planner_timings
+from query_catalog import CatalogConfig, QueryCatalog, query_hash
+from resources import ResourceSampling, ResourceUsage, combine_usages
+from permutations import PermutationConfig, PermutationSource
 from logging_config import setup_logging
 import logging
 import motherduck
@@ -24,18 +39,107 @@ logger = logging.getLogger(__name__)
 class QueryRunStatus(Enum):
     FAILED = 0
     SUCCESS = 1
+    TIMEOUT = 2
+    SKIPPED = 3
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class ConsumptionMode(Enum):
+    FETCHALL = 1  # materialize every row as python tuples
+    ARROW_STREAM = 2  # stream arrow record batches and discard them
+    COUNT_ONLY = 3  # wrap the query in a count(*) so only one row leaves the engine
+    FIRST_ROW = 4  # latency until the first row is available
+
+
+class CacheMode(Enum):
+    SHARED = 0  # one connection for all variations, warmth depends on what ran before
+    COLD = 1  # fresh connection for every variation, optionally after dropping the os page cache
+    HOT = 2  # every variation is warmed up before it is timed
+
+
+ARROW_BATCH_SIZE = 1_000_000
+EXPLAIN_BATCH_SIZE = 500
+PREPARED_STATEMENT = "timed_variation"
+BASELINE_VARIATION = "1"  # the query as written, the other variation ids are its join-order permutations
+
+
+ROWS_FINGERPRINT = "rows:"
+
+
+def fingerprint_rows(rows: List[Tuple]) -> str:
+    """
+    order-insensitive fingerprint of fetched rows, the row count and the sum of the row hashes.
+    rows are hashed by their repr, which unlike hash() is the same in every process. the hashes differ from
+    duckdb's, so these fingerprints are prefixed with ROWS_FINGERPRINT to only be compared with each other
+    """
+    checksum = sum(int.from_bytes(hashlib.blake2b(repr(row).encode(), digest_size=16).digest(), "little")
+                   for row in rows)
+    return f"{ROWS_FINGERPRINT}{len(rows)}:{checksum % (1 << 128)}"
 
 
 class stopwatch:
     def __enter__(self):
-        self.start = time.time()
+        self.start = time.perf_counter()
         return self
 
     def __exit__(self, type, value, traceback):
-        self.time = time.time() - self.start
+        self.time = time.perf_counter() - self.start
         self.readout = f"Time: {self.time:.6f} seconds"
 
 
+class watchdog:
+    """ interrupts whatever is running on conn once timeout seconds have passed """
+
+    def __init__(self, conn: DuckDBPyConnection, timeout: Optional[float]):
+        self.conn = conn
+        self.timeout = timeout
+        self.fired = False
+        self._timer = None
+
+    def _interrupt(self):
+        self.fired = True
+        self.conn.interrupt()
+
+    def __enter__(self):
+        if self.timeout is not None:
+            self._timer = threading.Timer(self.timeout, self._interrupt)
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self._timer:
+            self._timer.cancel()
+
+
+def drop_page_cache():
+    """ drops the os page cache, which requires root """
+    os.sync()
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3")
+    except OSError as e:
+        logger.warning(f"Could not drop the page cache: {e}")
+
+
+@dataclass
+class TimeoutPolicy:
+    query_timeout: Optional[float] = None  # seconds per execution
+    query_timeouts: Dict[str, float] = field(default_factory=dict)  # per query id, overrides query_timeout
+    benchmark_timeout: Optional[float] = None  # seconds for all variations of a benchmark run
+    skip_after_baseline_timeout: bool = False  # skip a query's variations once its as-written variation timed out
+
+    def timeout_for(self, query_id: str, deadline: Optional[float]) -> Optional[float]:
+        timeout = self.query_timeouts.get(query_id, self.query_timeout)
+        if deadline is not None:
+            remaining = max(deadline - time.perf_counter(), 0.0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+
 @dataclass
 class QueryResult:
     # benchmark: str
@@ -46,6 +150,24 @@ class QueryResult:
     duration: float
     status: QueryRunStatus
     message: str
+    samples: List[float] = field(default_factory=list)
+    plan_class: Optional[str] = None
+    representative_id: Optional[int] = None
+    round: int = 0  # repetition round of the interleaved scheduler
+    consumption_mode: Optional[ConsumptionMode] = None
+    execution_time: Optional[float] = None  # median time until the result was available in the engine
+    transfer_time: Optional[float] = None  # median time spent consuming the result
+    cpu_user_time: Optional[float] = None
+    cpu_system_time: Optional[float] = None
+    peak_rss_bytes: Optional[int] = None  # peak resident memory of the process during the query
+    read_bytes: Optional[int] = None
+    write_bytes: Optional[int] = None
+    spill_bytes: Optional[int] = None  # peak growth of duckdb's temporary files
+    result_fingerprint: Optional[str] = None
+    cache_mode: Optional[CacheMode] = None
+    planning_time: Optional[float] = None  # parsing, binding and optimizing the query when it was prepared
+    optimizer_time: Optional[float] = None  # time in the optimizers, from the profiled execution
+    query_hash: Optional[str] = None  # content hash of the executed query text
 
     def to_dict(self):
         return {
@@ -57,6 +179,24 @@ class QueryResult:
             "duration": self.duration,
             "status": self.status.name,
             "message": self.message,
+            "samples": self.samples,
+            "plan_class": self.plan_class,
+            "representative_id": self.representative_id,
+            "round": self.round,
+            "consumption_mode": self.consumption_mode.name if self.consumption_mode else None,
+            "execution_time": self.execution_time,
+            "transfer_time": self.transfer_time,
+            "cpu_user_time": self.cpu_user_time,
+            "cpu_system_time": self.cpu_system_time,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "read_bytes": self.read_bytes,
+            "write_bytes": self.write_bytes,
+            "spill_bytes": self.spill_bytes,
+            "result_fingerprint": self.result_fingerprint,
+            "cache_mode": self.cache_mode.name if self.cache_mode else None,
+            "planning_time": self.planning_time,
+            "optimizer_time": self.optimizer_time,
+            "query_hash": self.query_hash,
         }
 
     def to_json(self):
@@ -70,21 +210,153 @@ class QueryVariation:
     variation_id: int
     query_text: str
     raise_on_error: Optional[bool] = True
+    query_hash: Optional[str] = None
+
+    def _statement_text(self, mode: ConsumptionMode) -> str:
+        if mode == ConsumptionMode.COUNT_ONLY:
+            return f"SELECT count(*) FROM ({self.query_text.strip().rstrip(';')})"
+        return self.query_text.strip().rstrip(";")
 
-    def run(self, conn: DuckDBPyConnection):
+    def _prepare(self, conn: DuckDBPyConnection, mode: ConsumptionMode, timeout: Optional[float] = None) -> float:
+        """ prepares the statement the mode executes, which parses, binds and optimizes it, returns how long it took """
+        with stopwatch() as sw, watchdog(conn, timeout) as wd:
+            try:
+                conn.execute(f"PREPARE {PREPARED_STATEMENT} AS {self._statement_text(mode)}")
+            except Exception as e:
+                raise QueryTimeout(f"Timed out after {timeout:.3f} seconds while planning") if wd.fired else e
+        return sw.time
+
+    def _consume(self, conn: DuckDBPyConnection, mode: ConsumptionMode, prepared: bool = False,
+                 fetched: Optional[List] = None) -> float:
+        """
+        runs the query, or executes its prepared statement, consuming its result in the given mode.
+        returns the time until the result was available. in FETCHALL mode the fetched rows are kept in fetched
+        """
+        if fetched is not None:
+            # the rows of the previous execution are released before the next one fetches its own
+            fetched.clear()
+        # conn.execute streams the result, of EXECUTE just like of the query itself, so FIRST_ROW and
+        # ARROW_STREAM stop at the first row or batch. conn.sql would run EXECUTE to completion first
+        statement = f"EXECUTE {PREPARED_STATEMENT}" if prepared else self._statement_text(mode)
+        with stopwatch() as sw:
+            result = conn.execute(statement)
+            if mode == ConsumptionMode.ARROW_STREAM:
+                batches = iter(result.fetch_record_batch(ARROW_BATCH_SIZE))
+                next(batches, None)
+            elif mode == ConsumptionMode.FIRST_ROW:
+                result.fetchone()
+
+        if mode == ConsumptionMode.FETCHALL:
+            rows = result.fetchall()
+            if fetched is not None:
+                fetched[:] = [rows]
+        elif mode == ConsumptionMode.COUNT_ONLY:
+            result.fetchone()
+        elif mode == ConsumptionMode.ARROW_STREAM:
+            for _ in batches:
+                pass
+        return sw.time
+
+    def _execute_once(self, conn: DuckDBPyConnection, mode: ConsumptionMode, timeout: Optional[float] = None,
+                      resources: Optional[ResourceSampling] = None, prepared: bool = False,
+                      fetched: Optional[List] = None):
+        """
+        returns the duration of a single execution, the part of it spent executing,
+        the resources it used if they are sampled, and the error it raised
+        """
+        error = None
+        execution_time = None
+        with resources.sampler(conn) if resources else nullcontext() as sampler:
+            with stopwatch() as sw, watchdog(conn, timeout) as wd:
+                try:
+                    execution_time = self._consume(conn, mode, prepared, fetched)
+                except Exception as e:
+                    error = QueryTimeout(f"Timed out after {timeout:.3f} seconds") if wd.fired else e
+        return sw.time, execution_time, sampler.usage if sampler else None, error
+
+    def fingerprint(self, conn: DuckDBPyConnection, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        order-insensitive fingerprint of the result, the row count and the sum of the row hashes,
+        computed inside duckdb so that no rows are materialized in python.
+        this executes the query once more, run only calls it for the modes that do not fetch every row
+        """
+        with watchdog(conn, timeout) as wd:
+            try:
+                count, checksum = conn.execute(
+                    f"SELECT count(*), sum(hash(result)::HUGEINT) FROM ({self.query_text.strip().rstrip(';')}) AS result"
+                ).fetchone()
+            except Exception as e:
+                logger.warning(f"Fingerprint of [{self.query_id}][{self.variation_id}] failed: "
+                               f"{'timed out' if wd.fired else e}")
+                return None
+        return f"{count}:{checksum or 0}"
+
+    def run(self, conn: DuckDBPyConnection, repetition: RepetitionPolicy = RepetitionPolicy(),
+            timeout: Optional[float] = None, mode: ConsumptionMode = ConsumptionMode.FETCHALL,
+            resources: Optional[ResourceSampling] = None, verify: bool = False, prepared: bool = False):
+        """
+        times the query until the repetition policy is satisfied.
+        when prepared, the statement is planned once up front and every repetition only executes it
+        """
         query_status = QueryRunStatus.SUCCESS
         error_message = ""
-        with stopwatch() as sw:
+        samples: List[float] = []
+        execution_times: List[float] = []
+        transfer_times: List[float] = []
+        usages: List[ResourceUsage] = []
+
+        error = None
+        planning_time = None
+        # in FETCHALL mode the fingerprint is computed from the rows of the last timed execution, after its timing
+        fetched = [] if verify and mode == ConsumptionMode.FETCHALL else None
+        if prepared:
             try:
-                conn.execute(self.query_text).fetchall()
+                planning_time = self._prepare(conn, mode, timeout)
             except Exception as e:
-                if self.raise_on_error:
-                    raise e
-                query_status = QueryRunStatus.FAILED
-                error_message = str(e)
+                error = e
+                samples.append(timeout if isinstance(e, QueryTimeout) else 0.0)
+
+        for _ in range(repetition.warmup_runs if not error else 0):
+            duration, _, _, error = self._execute_once(conn, mode, timeout, prepared=prepared)
+            if error:
+                samples.append(duration)
+                break
+
+        # the loop ends at the first error, whose sample is always the last one, db_saver.sample_rows relies on it
+        start = time.perf_counter()
+        while not error:
+            duration, execution_time, usage, error = self._execute_once(conn, mode, timeout, resources, prepared,
+                                                                        fetched)
+            samples.append(duration)
+            if usage:
+                usages.append(usage)
+            if not error:
+                execution_times.append(execution_time)
+                transfer_times.append(duration - execution_time)
+            if repetition.should_stop(samples, time.perf_counter() - start):
+                break
+
+        if planning_time is not None:
+            conn.execute(f"DEALLOCATE {PREPARED_STATEMENT}")
+
+        if isinstance(error, QueryTimeout):
+            # timeouts are censored measurements rather than errors, the elapsed time is kept as the sample
+            query_status = QueryRunStatus.TIMEOUT
+            error_message = str(error)
+        elif error:
+            if self.raise_on_error:
+                raise error
+            query_status = QueryRunStatus.FAILED
+            error_message = str(error)
 
+        duration = statistics.median(samples) if samples else 0.0
+        usage = combine_usages(usages)
+        fingerprint = None
+        if verify and query_status == QueryRunStatus.SUCCESS:
+            fingerprint = fingerprint_rows(fetched[0]) if fetched else self.fingerprint(conn, timeout)
         logger.info(
-            f"Execution of [{self.query_id}][{self.variation_id}] took {sw.time:.6f} seconds [{query_status.name}].")
+            f"Execution of [{self.query_id}][{self.variation_id}] took {duration:.6f} seconds "
+            f"(median of {len(samples)} runs) [{query_status.name}].")
         return QueryResult(
             message=error_message,
             # benchmark=self.benchmark,
@@ -94,19 +366,50 @@ class QueryVariation:
             # start_time=datetime.datetime.fromtimestamp(
             #         sw.start, tz=datetime.timezone.utc
             # ),
-            duration=sw.time,
+            duration=duration,
             status=query_status,
+            samples=samples,
+            consumption_mode=mode,
+            execution_time=statistics.median(execution_times) if execution_times else None,
+            transfer_time=statistics.median(transfer_times) if transfer_times else None,
+            **(asdict(usage) if usage else {}),
+            result_fingerprint=fingerprint,
+            planning_time=planning_time,
+            query_hash=self.query_hash,
         )
 
+    def profile(self, conn: DuckDBPyConnection,
+                output_path: str) -> Tuple[List[Dict[str, Any]], Dict[str, Optional[float]]]:
+        """
+        executes the query once more with detailed json profiling,
+        returns its operator rows and the time spent in the planner phases
+        """
+        conn.execute("PRAGMA enable_profiling = 'json'")
+        conn.execute("PRAGMA profiling_mode = 'detailed'")
+        conn.execute(f"PRAGMA profiling_output = '{output_path}'")
+        try:
+            conn.execute(self.query_text).fetchall()
+        finally:
+            conn.execute("PRAGMA profiling_mode = 'standard'")
+            conn.execute("PRAGMA disable_profiling")
+
+        with open(output_path) as f:
+            profile = json.load(f)
+        rows = parse_profile(profile)
+        for row in rows:
+            row["variation_id"] = str(self.variation_id)
+        return rows, planner_timings(profile)
+
     def run_explain(self, conn: DuckDBPyConnection):
         query_status = QueryRunStatus.SUCCESS
+        explain_result = None
         try:
             explain_result = conn.execute(self.query_text).fetchone()[1]
         except Exception as e:
             if self.raise_on_error:
                 raise e
             query_status = QueryRunStatus.FAILED
-            error_message = str(e)
+            logger.warning(f"Explain of [{self.query_id}][{self.variation_id}] failed: {e}")
 
         logger.info(
             f"Explain of [{self.query_id}][{self.variation_id}] [{query_status.name}].")
@@ -123,7 +426,18 @@ class QueryVariation:
     ):
         """ eg. /tpch/queries/q07/1.sql """
         path = os.path.join(QUERY_ROOT, benchmark, "queries", query_id, str(variation_id) + ".sql")
-        query_text = open(path).read()
+        return cls.from_text(explain, query_id, variation_id, open(path).read())
+
+    @classmethod
+    def from_text(
+            cls,
+            explain: bool,
+            query_id: str,
+            variation_id: int,
+            query_text: str,
+            content_hash: Optional[str] = None
+    ):
+        content_hash = content_hash or query_hash(query_text)
         if explain:
             query_text = f"""
             EXPLAIN (FORMAT json) {query_text}
@@ -132,7 +446,8 @@ class QueryVariation:
             # benchmark=benchmark,
             query_id=query_id,
             variation_id=variation_id,
-            query_text=query_text
+            query_text=query_text,
+            query_hash=content_hash
         )
 
     @classmethod
@@ -157,11 +472,50 @@ class TestCase:
     benchmark: str
     path: str = field(init=False)
     raise_on_error: Optional[bool] = False
+    threads: Optional[int] = None
+    repetition: RepetitionPolicy = field(default_factory=RepetitionPolicy)
+    dedup_plans: bool = False
+    run_id: Optional[str] = None  # set to the id of an interrupted run to resume it
+    timeouts: TimeoutPolicy = field(default_factory=TimeoutPolicy)
+    consumption_mode: ConsumptionMode = ConsumptionMode.FETCHALL
+    profile: bool = False  # profile every successful variation in an extra, untimed execution
+    explain_workers: int = 1
+    bundle_plans: bool = False  # write plans into a single indexed file, an existing one is always appended to
+    resource_sampling: Optional[ResourceSampling] = None  # record cpu, memory, i/o and spill of every execution
+    # fingerprint the result of every variation to compare across optimizers. FETCHALL fingerprints the rows of the
+    # last timed execution, the other modes do not fetch every row and execute the query once more to fingerprint it
+    verify_results: bool = False
+    cache_mode: CacheMode = CacheMode.SHARED
+    drop_page_cache: bool = False  # in COLD mode, also drop the os page cache before every variation
+    permutations: Optional[PermutationConfig] = None  # generate join orders from the base queries instead of files
+    backend: motherduck.Backend = field(default_factory=motherduck.MotherDuckBackend)
+    result_store: motherduck.ResultStore = field(default_factory=motherduck.MotherDuckResultStore)
+    catalog: Optional[CatalogConfig] = None  # read variations from the preloaded query catalog
+    prepare_statements: bool = False  # plan every variation once with PREPARE and time only its executions
 
     def __post_init__(self):
         self.path: str = os.path.join(QUERY_ROOT,
                                       self.benchmark,
                                       "queries")
+        self.source: Optional[PermutationSource] = (
+            PermutationSource(self.benchmark, self.permutations) if self.permutations else None
+        )
+        self._catalog: Optional[QueryCatalog] = None
+
+    def __getstate__(self):
+        # an open catalog may be memory mapped, worker processes open their own. the catalog is built here, in the
+        # process handing the test case to its workers, so that the workers only read it and never rebuild it
+        state = self.__dict__.copy()
+        state["_catalog"] = None
+        if self.catalog:
+            self.query_catalog()
+            state["catalog"] = replace(self.catalog, rebuild=False)
+        return state
+
+    def query_catalog(self) -> Optional[QueryCatalog]:
+        if self.catalog and self._catalog is None:
+            self._catalog = QueryCatalog.open(self.benchmark, self.catalog)
+        return self._catalog
 
     @classmethod
     def from_name(cls, benchmark: str):
@@ -183,6 +537,32 @@ class TestCase:
             data = json.load(f)
             return data
 
+    def query_ids(self) -> List[str]:
+        if self.source:
+            return self.source.query_ids()
+        if self.catalog:
+            return self.query_catalog().query_ids()
+        return natsorted([file_name for file_name in os.listdir(self.path)])
+
+    def variation_ids(self, query_id: str) -> Iterator[int]:
+        """ every variation of a query, generated lazily when permutations are enabled """
+        if self.source:
+            return self.source.variation_ids(query_id)
+        if self.catalog:
+            return iter(self.query_catalog().variation_ids(query_id))
+        return iter(self._collect_variations_of_query(query_id)[query_id])
+
+    def variation(self, explain: bool, query_id: str, variation_id: int) -> QueryVariation:
+        if self.source:
+            return QueryVariation.from_text(explain, query_id, variation_id,
+                                            self.source.query_text(query_id, variation_id))
+        if self.catalog:
+            catalog = self.query_catalog()
+            return QueryVariation.from_text(explain, query_id, variation_id,
+                                            catalog.query_text(query_id, variation_id),
+                                            catalog.content_hash(query_id, variation_id))
+        return QueryVariation.from_query_info(explain, self.benchmark, query_id, variation_id)
+
     def _collect_variations_of_query(self, query_id) -> Dict[str, List[int]]:
         """ returns a list of variation ids """
 
@@ -211,76 +591,214 @@ class TestCase:
             if explain:
                 self._run_explains(optimizer)
             else:
-                all_results: Dict[str, List[QueryResult]] = {}
-                self._run(optimizer, all_results)
-                self.save_timed_results_as_json(optimizer, all_results)
+                with self.result_sink(optimizer) as sink:
+                    self._run(optimizer, sink)
         except Exception as e:
             if self.raise_on_error:
                 raise e
 
     def _run_explains(self, optimizer: Optimizer):
-        conn = motherduck.connect(MD_PREFIX)
-        motherduck.attach(conn, "~/local_v112.db", "local")
+        # without bundle_plans the store is picked like the readers pick it, so an existing bundle keeps growing
+        store = open_plan_store(self.benchmark, optimizer, bundled=self.bundle_plans or None)
+
+        # streamed, so that generated permutations are never all held in memory
+        pending = (
+            (query_id, variation_id)
+            for query_id in self.query_ids()
+            for variation_id in self.variation_ids(query_id)
+            # skip if plan already exists
+            if not store.has(query_id, str(variation_id))
+        )
+        logger.info(f"======= Explaining variations with {self.explain_workers} workers =======")
+
+        with motherduck.ConnectionPool(self.backend, self.explain_workers) as pool:
+            def explain(task):
+                query_id, variation_id = task
+                variation = self.variation(True, query_id, variation_id)
+                with pool.connection() as conn:
+                    return query_id, str(variation_id), variation.run_explain(conn)
+
+            explained = 0
+            with ThreadPoolExecutor(max_workers=self.explain_workers) as executor:
+                while chunk := list(itertools.islice(pending, EXPLAIN_BATCH_SIZE)):
+                    batch = [
+                        (query_id, variation_id, explain_result)
+                        for query_id, variation_id, explain_result in executor.map(explain, chunk)
+                        if explain_result is not None
+                    ]
+                    store.put_many(batch)
+                    explained += len(batch)
+            logger.info(f"======= Explained {explained} variations =======")
+
+    def _connect(self) -> DuckDBPyConnection:
+        conn = self.backend.connect()
+        if self.threads:
+            conn.execute(f"SET threads = {self.threads}")
+        return conn
+
+    def _cache_repetition(self) -> RepetitionPolicy:
+        """ the repetition policy adjusted to the cache mode """
+        if self.cache_mode == CacheMode.COLD:
+            if self.repetition.warmup_runs or self.repetition.max_runs > 1:
+                logger.warning("COLD cache mode times a single execution per fresh connection, "
+                               "ignoring warm-up runs and repetitions")
+            return replace(self.repetition, warmup_runs=0, min_runs=1, max_runs=1)
+        if self.cache_mode == CacheMode.HOT:
+            return replace(self.repetition, warmup_runs=max(self.repetition.warmup_runs, 1))
+        return self.repetition
+
+    def _prepare_connection(self, conn: DuckDBPyConnection) -> DuckDBPyConnection:
+        """ the connection to time the next variation on, a fresh one in COLD mode """
+        if self.cache_mode != CacheMode.COLD:
+            return conn
+        conn.close()
+        if self.drop_page_cache:
+            drop_page_cache()
+        return self._connect()
+
+    def _extension_version(self, conn: DuckDBPyConnection) -> Optional[str]:
+        """ version of the extension carrying the optimizer, a commit hash for development builds """
+        if os.getenv("OPTIMIZER_COMMIT"):
+            return os.getenv("OPTIMIZER_COMMIT")
+        try:
+            return self.backend.extension_version(conn)
+        except Exception as e:
+            logger.warning(f"Could not read the extension version: {e}")
+            return None
+
+    def _run_metadata(self, optimizer: Optimizer, conn: DuckDBPyConnection, run_id: str) -> Dict[str, Any]:
+        return {
+            "run_id": run_id,
+            "benchmark": self.benchmark,
+            "optimizer": optimizer.to_string(),
+            "started_at": datetime.datetime.now().isoformat(),
+            "extension_version": self._extension_version(conn),
+            "bridge_cost": os.getenv("BRIDGE_COST"),
+            "cache_mode": self.cache_mode.name,
+            "consumption_mode": self.consumption_mode.name,
+        }
 
-        query_ids = natsorted([file_name for file_name in os.listdir(self.path)])
-        plans_folder = os.path.join(RESULT_ROOT, self.benchmark, optimizer.to_string(), "plans")
+    def _resource_sampling(self, conn: DuckDBPyConnection) -> Optional[ResourceSampling]:
+        if not self.resource_sampling or self.resource_sampling.temp_directory:
+            return self.resource_sampling
+        temp_directory = conn.execute("SELECT current_setting('temp_directory')").fetchone()[0]
+        return replace(self.resource_sampling, temp_directory=temp_directory)
 
-        for query_id in query_ids:
-            logger.info(f"======= Explaining query: {query_id} =======")
-
-            #  create folder for query_id if it does not exist
-            if not os.path.exists(plans_folder + "/" + query_id):
-                os.makedirs(plans_folder + "/" + query_id)
-
-            # explain all variations of query_id
-            variations = self._collect_variations_of_query(query_id)
-            for variation_id in variations[query_id]:
-                if os.path.exists(os.path.join(str(plans_folder), query_id, str(variation_id) + ".json")):
-                    # skip if plan file already exists
-                    logger.info(f"Skipping [{query_id}][{variation_id}]")
-                    continue
-                variation = QueryVariation.from_query_info(
-                    True, self.benchmark, query_id, variation_id
-                )
-                explain_result = variation.run_explain(conn)
-                explain_path = os.path.join(str(plans_folder), query_id, str(variation_id) + ".json")
-                with open(explain_path, "w") as f:
-                    json.dump(json.loads(explain_result), f, indent=4)
-        motherduck.detach(conn, "local")
-        conn.close()
+    def _run(self, optimizer: Optimizer, sink: ResultSink, variations: Optional[Dict[str, List[int]]] = None):
+        """ executes the variations of the optimizer's index, or only the given variations per query id """
+        conn = self._connect()
+        sink.write_metadata(self._run_metadata(optimizer, conn, sink.run_id))
+        resources = self._resource_sampling(conn)
+        repetition = self._cache_repetition()
 
-    def _run(self, optimizer: Optimizer, all_results: Dict[str, List[QueryResult]]):
-        conn = motherduck.connect(MD_PREFIX)
-        motherduck.attach(conn, "~/local_v112.db", "local")
+        if variations is None:
+            query_ids = self.query_ids()
+            variations = self._collect_variations_from_file(optimizer)
+        else:
+            query_ids = natsorted(variations)
+        fingerprints = self._plan_fingerprints(optimizer) if self.dedup_plans else {}
 
-        query_ids = natsorted([file_name for file_name in os.listdir(self.path)])
+        completed = sink.completed()
+        if completed:
+            logger.info(f"Resuming run [{sink.run_id}] with {len(completed)} completed variations")
 
-        variations = self._collect_variations_from_file(optimizer)
+        deadline = None
+        if self.timeouts.benchmark_timeout is not None:
+            deadline = time.perf_counter() + self.timeouts.benchmark_timeout
+
+        profile_path = os.path.join(tempfile.gettempdir(), f"profile_{os.getpid()}.json")
 
         for query_id in query_ids:
             logger.info(f"======= Executing query: {query_id} =======")
-            results_for_query = []
-            for variation_id in variations[query_id]:
-                variation = QueryVariation.from_query_info(
-                    False, self.benchmark, query_id, variation_id
-                )
-                result = variation.run(conn)
-                results_for_query.append(result)
+            profile_rows = []
+            for plan_class, members in self._group_by_plan(variations[query_id], fingerprints.get(query_id, {})):
+                pending = [member for member in members if (query_id, str(member)) not in completed]
+                if not pending:
+                    logger.info(f"Skipping [{query_id}]{members}, already completed")
+                    continue
 
-            all_results[query_id] = results_for_query
+                skip_reason = self._skip_reason(query_id, members, completed, deadline)
+                if skip_reason:
+                    logger.info(f"Skipping [{query_id}]{pending}: {skip_reason}")
+                    for member in pending:
+                        sink.write(query_id, QueryResult(variation_id=member, duration=0.0,
+                                                         status=QueryRunStatus.SKIPPED, message=skip_reason))
+                    continue
+
+                representative_id = members[0]
+                if len(members) > 1:
+                    logger.info(f"[{query_id}][{representative_id}] represents {len(members)} variations "
+                                f"with plan {plan_class}")
+                variation = self.variation(False, query_id, representative_id)
+                conn = self._prepare_connection(conn)
+                result = variation.run(conn, repetition, self.timeouts.timeout_for(query_id, deadline),
+                                       self.consumption_mode, resources, self.verify_results,
+                                       self.prepare_statements)
+                result.cache_mode = self.cache_mode
+                for member in pending:
+                    completed[(query_id, str(member))] = result.status.name
+                if self.profile and result.status == QueryRunStatus.SUCCESS:
+                    rows, timings = variation.profile(conn, profile_path)
+                    profile_rows.extend(rows)
+                    result.optimizer_time = timings["optimizer"]
+                if plan_class is None:
+                    sink.write(query_id, result)
+                    continue
+                for member in pending:
+                    sink.write(query_id, replace(result, variation_id=member, plan_class=plan_class,
+                                                 representative_id=representative_id))
+
+            write_profiles(self.benchmark, optimizer, sink.run_id, query_id, profile_rows)
 
         conn.close()
 
-    def save_timed_results_as_json(self, optimizer: Optimizer, all_results: Dict[str, List[QueryResult]]):
-        results_folder = os.path.join(RESULT_ROOT,
-                                      self.benchmark,
-                                      optimizer.to_string(),
-                                      "timed_results"
-                                      )
-        if not os.path.exists(results_folder):
-            os.makedirs(results_folder)
-        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        result_path = os.path.join(str(results_folder), timestamp + ".json")
-
-        with open(result_path, "w") as f:
-            json.dump(all_results, f, default=lambda o: o.to_dict(), indent=4)
+    def _skip_reason(self, query_id: str, variation_ids: List[int], statuses: Dict[Tuple[str, str], str],
+                     deadline: Optional[float]) -> Optional[str]:
+        """
+        why the variations are not executed, or None to execute them.
+        statuses holds the status of every (query_id, variation_id) the optimizer already measured.
+        after a timeout only the as-written variation counts as the baseline, an index without it never skips
+        """
+        if deadline is not None and time.perf_counter() >= deadline:
+            return "Benchmark deadline passed"
+        if (self.timeouts.skip_after_baseline_timeout
+                and BASELINE_VARIATION not in [str(variation_id) for variation_id in variation_ids]
+                and statuses.get((query_id, BASELINE_VARIATION)) == QueryRunStatus.TIMEOUT.name):
+            return f"Baseline [{query_id}][{BASELINE_VARIATION}] timed out"
+        return None
+
+    def _plan_fingerprints(self, optimizer: Optimizer) -> Dict[str, Dict[str, str]]:
+        plan_index = PlanIndex.load()
+        if plan_index.refresh(self.benchmark, optimizer):
+            plan_index.save()
+        return plan_index.fingerprints(self.benchmark, optimizer)
+
+    @staticmethod
+    def _group_by_plan(variation_ids: List[int], fingerprints: Dict[str, str]) -> List[Tuple[Optional[str], List[int]]]:
+        """
+        groups variation ids into plan equivalence classes, in order of first appearance.
+        the first member of each class is its representative, variations without a known plan stay on their own
+        """
+        classes: Dict[str, List[int]] = {}
+        groups: List[Tuple[Optional[str], List[int]]] = []
+        for variation_id in variation_ids:
+            fingerprint = fingerprints.get(str(variation_id))
+            if fingerprint is None:
+                groups.append((None, [variation_id]))
+                continue
+            if fingerprint not in classes:
+                classes[fingerprint] = []
+                groups.append((fingerprint, classes[fingerprint]))
+            classes[fingerprint].append(variation_id)
+        return groups
+
+    def results_folder(self, optimizer: Optimizer) -> str:
+        return os.path.join(RESULT_ROOT,
+                            self.benchmark,
+                            optimizer.to_string(),
+                            "timed_results"
+                            )
+
+    def result_sink(self, optimizer: Optimizer) -> ResultSink:
+        run_id = self.run_id or datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        return ResultSink(self.results_folder(optimizer), run_id)
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# the runner's modules import each other by name and resolve paths relative to BenchmarkRunner
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """ a scratch BenchmarkRunner directory, so ../Results, ../Indexes and ../SampleData land in tmp_path """
+    work = tmp_path / "BenchmarkRunner"
+    work.mkdir()
+    monkeypatch.chdir(work)
+    return tmp_path
+
+
+@pytest.fixture
+def local_database(tmp_path):
+    """ a local duckdb database for LocalBackend, t holds the numbers 0 to 999 """
+    duckdb = pytest.importorskip("duckdb")
+    path = str(tmp_path / "benchmark.db")
+    with duckdb.connect(path) as conn:
+        conn.execute("CREATE TABLE t AS SELECT range AS a FROM range(1000)")
+    return path
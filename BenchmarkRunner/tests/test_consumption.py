@@ -0,0 +1,46 @@
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+pytest.importorskip("natsort")
+
+import test_case as runner
+from test_case import ConsumptionMode, QueryVariation
+
+# every row hashes its number, the first rows are out long before the last one is computed
+QUERY = "SELECT md5(range::VARCHAR) AS h FROM range(2000000) WHERE md5(range::VARCHAR) <> '';"
+
+
+@pytest.fixture
+def conn():
+    conn = duckdb.connect(":memory:")
+    conn.execute("SET threads = 1")
+    yield conn
+    conn.close()
+
+
+def execution_time(conn, mode, prepared):
+    variation = QueryVariation(query_id="q1", variation_id=1, query_text=QUERY)
+    if prepared:
+        variation._prepare(conn, mode)
+    return variation._consume(conn, mode, prepared)
+
+
+@pytest.mark.parametrize("prepared", [False, True])
+@pytest.mark.parametrize("mode", [ConsumptionMode.FIRST_ROW, ConsumptionMode.ARROW_STREAM])
+def test_streaming_modes_stop_the_clock_before_the_query_completes(conn, monkeypatch, mode, prepared):
+    # a batch as large as duckdb's vectors, so the first one is out right away
+    monkeypatch.setattr(runner, "ARROW_BATCH_SIZE", 2048)
+    # COUNT_ONLY has to compute every row before its single row is available
+    complete = execution_time(conn, ConsumptionMode.COUNT_ONLY, prepared)
+    assert execution_time(conn, mode, prepared) < complete / 4
+
+
+@pytest.mark.parametrize("prepared", [False, True])
+def test_every_mode_consumes_the_whole_result(conn, prepared):
+    fetched = []
+    variation = QueryVariation(query_id="q1", variation_id=1, query_text="SELECT range FROM range(10)")
+    for mode in ConsumptionMode:
+        if prepared:
+            variation._prepare(conn, mode)
+        variation._consume(conn, mode, prepared, fetched if mode == ConsumptionMode.FETCHALL else None)
+    assert sorted(fetched[0]) == [(i,) for i in range(10)]
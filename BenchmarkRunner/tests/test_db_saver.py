@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+pytest.importorskip("polars")
+pytest.importorskip("natsort")
+
+import test_case as runner
+from db_saver import SAMPLE_SCHEMA, _collect_new_samples, read_samples, sample_rows, save_timed_results_in_md
+from motherduck import LocalResultStore
+from optimizer import OG
+from test_case import QueryResult, QueryRunStatus
+
+
+def result(status, samples, **fields):
+    return {"variation_id": "3", "status": status, "duration": samples[-1] if samples else 0.0,
+            "samples": samples, **fields}
+
+
+def test_only_the_timed_out_repetition_is_marked():
+    rows = sample_rows("run", "q1", result("TIMEOUT", [0.5, 0.6, 30.0]))
+    assert [row["status"] for row in rows] == ["SUCCESS", "SUCCESS", "TIMEOUT"]
+    assert [row["sample"] for row in rows] == [0, 1, 2]
+
+
+def test_failed_warmup_is_a_single_failed_sample():
+    assert [row["status"] for row in sample_rows("run", "q1", result("FAILED", [0.1]))] == ["FAILED"]
+
+
+def test_successful_samples():
+    rows = sample_rows("run", "q1", result("SUCCESS", [0.5, 0.6], round=2))
+    assert {row["status"] for row in rows} == {"SUCCESS"}
+    assert {row["round"] for row in rows} == {2}
+    assert rows[0]["variation_id"] == 3
+
+
+def test_skipped_variations_have_no_samples():
+    assert sample_rows("run", "q1", result("SKIPPED", [])) == []
+
+
+def test_results_without_samples_use_their_duration():
+    rows = sample_rows("run", "q1", {"variation_id": 1, "status": "SUCCESS", "duration": 1.5})
+    assert [row["duration"] for row in rows] == [1.5]
+    assert rows[0]["cache_mode"] == "SHARED"
+
+
+def ndjson(records):
+    return "".join(json.dumps({"query_id": "q1", **record}) + "\n" for record in records).encode()
+
+
+RECORDS = [
+    result("TIMEOUT", [0.5, 0.6, 30.0], round=1, cache_mode="HOT", peak_rss_bytes=1024),
+    result("SUCCESS", [0.5, 0.6]),
+    result("SKIPPED", []),
+    {"variation_id": 1, "status": "SUCCESS", "duration": 1.5},
+]
+
+
+def test_read_samples_matches_sample_rows():
+    samples = read_samples(ndjson(RECORDS), "run")
+    rows = [row for record in RECORDS for row in sample_rows("run", "q1", record)]
+    assert samples.schema == SAMPLE_SCHEMA
+    assert samples.to_dicts() == rows
+
+
+def test_read_samples_skips_truncated_lines():
+    data = ndjson(RECORDS[:1]) + b'{"query_id": "q1", "variation_id": 4, "sta\n' + ndjson(RECORDS[1:])
+    assert read_samples(data, "run").equals(read_samples(ndjson(RECORDS), "run"))
+
+
+def test_collects_only_new_samples(tmp_path):
+    path = tmp_path / "run.ndjson"
+    path.write_bytes(ndjson(RECORDS[:1]) + b'{"query_id": "q1", "vari')
+    samples, manifest = _collect_new_samples(tmp_path, {})
+    assert len(samples) == 3 and manifest == {"run.ndjson": len(ndjson(RECORDS[:1]))}
+
+    path.write_bytes(ndjson(RECORDS))
+    samples, manifest = _collect_new_samples(tmp_path, manifest)
+    assert samples["variation_id"].to_list() == [3, 3, 1]
+    assert manifest == {"run.ndjson": path.stat().st_size}
+
+
+def test_upload_replaces_earlier_uploads_of_the_same_result(workdir):
+    test_case = runner.TestCase("tpch", run_id="run", result_store=LocalResultStore(str(workdir / "results.duckdb")))
+    with test_case.result_sink(OG) as sink:
+        sink.write("q1", QueryResult(1, 0.6, QueryRunStatus.SUCCESS, "", samples=[0.5, 0.6]))
+    save_timed_results_in_md(OG, test_case)
+    with test_case.result_sink(OG) as sink:
+        sink.write("q1", QueryResult(1, 0.9, QueryRunStatus.SUCCESS, "", samples=[0.8, 0.9, 1.0]))
+    save_timed_results_in_md(OG, test_case)
+
+    with duckdb.connect(test_case.result_store.path) as conn:
+        table = f"tpch.{OG.to_string().lower()}"
+        assert conn.execute(f"SELECT count(*) FROM {table}_samples").fetchone()[0] == 3
+        assert conn.execute(f"SELECT median, runs FROM {table}").fetchone() == (0.9, 3)
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("natsort")
+
+import test_case as runner
+from motherduck import LocalBackend
+from plan_store import BundledPlanStore, open_plan_store, plans_folder
+from test_case import OG
+
+
+def write_variation(root, variation_id, text):
+    folder = root / "SampleData" / "permuted_queries" / "tpch" / "queries" / "q1"
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / f"{variation_id}.sql").write_text(text)
+
+
+@pytest.mark.parametrize("bundle_plans", [False, True])
+def test_explains_are_stored_per_variation_until_bundled(workdir, local_database, bundle_plans):
+    write_variation(workdir, 1, "SELECT count(*) FROM local.t;")
+    runner.TestCase("tpch", backend=LocalBackend(database=local_database), bundle_plans=bundle_plans) \
+        ._run_explains(OG)
+    assert isinstance(open_plan_store("tpch", OG), BundledPlanStore) == bundle_plans
+    assert open_plan_store("tpch", OG).has("q1", "1")
+
+
+def test_explains_go_to_an_existing_bundle(workdir, local_database):
+    write_variation(workdir, 1, "SELECT count(*) FROM local.t;")
+    runner.TestCase("tpch", backend=LocalBackend(database=local_database), bundle_plans=True)._run_explains(OG)
+    write_variation(workdir, 2, "SELECT a FROM local.t;")
+    runner.TestCase("tpch", backend=LocalBackend(database=local_database))._run_explains(OG)
+
+    store = open_plan_store("tpch", OG)
+    assert isinstance(store, BundledPlanStore)
+    assert store.has("q1", "2")
+    assert not os.path.exists(plans_folder("tpch", OG))
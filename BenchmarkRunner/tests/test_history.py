@@ -0,0 +1,91 @@
+import math
+
+import pytest
+
+pl = pytest.importorskip("polars")
+pytest.importorskip("duckdb")
+pytest.importorskip("natsort")
+
+from history import _normal_two_sided_p, compare_samples, ingest_runs, scan_history
+from optimizer import OG
+from result_sink import ResultSink
+from test_case import QueryResult, QueryRunStatus
+
+
+def compare(candidate, baseline):
+    samples = pl.LazyFrame({
+        "query_id": ["q1"] * (len(candidate) + len(baseline)),
+        "candidate": [True] * len(candidate) + [False] * len(baseline),
+        "duration": [float(duration) for duration in [*candidate, *baseline]],
+    })
+    return compare_samples(samples, ["query_id"]).collect().row(0, named=True)
+
+
+def expected_p(u, n1, n2, ties=0.0):
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+    return math.erfc(abs(u - n1 * n2 / 2) / sigma / math.sqrt(2))
+
+
+@pytest.mark.parametrize("z", [0.0, 0.5, 1.0, 1.96, 3.0, -2.5])
+def test_normal_p_value_matches_erfc(z):
+    p_value = pl.select(_normal_two_sided_p(pl.lit(z))).item()
+    assert p_value == pytest.approx(math.erfc(abs(z) / math.sqrt(2)), abs=1e-6)
+
+
+def test_separated_samples():
+    result = compare([1, 2, 3], [4, 5, 6])
+    assert result["u"] == 0
+    assert result["p_value"] == pytest.approx(expected_p(0, 3, 3), abs=1e-6)
+    assert result["p_value"] == pytest.approx(0.0495, abs=1e-4)
+    assert result["speedup"] == pytest.approx(5 / 2)
+
+
+def test_tie_correction():
+    # ranks 1.5, 1.5, 3.5 | 3.5, 5.5, 5.5, three pairs of ties
+    result = compare([1, 1, 2], [2, 3, 3])
+    assert result["u"] == 0.5
+    assert result["p_value"] == pytest.approx(expected_p(0.5, 3, 3, ties=3 * (2 ** 3 - 2)), abs=1e-6)
+
+
+def test_identical_samples_are_not_significant():
+    result = compare([5, 5, 5], [5, 5, 5])
+    assert result["z"] == 0
+    assert result["p_value"] == pytest.approx(1.0, abs=1e-6)
+    assert result["speedup"] == 1
+
+
+def test_slower_candidate_is_significant_with_enough_samples():
+    result = compare([11 + i / 10 for i in range(20)], [10 + i / 10 for i in range(20)])
+    assert result["speedup"] < 1
+    assert result["p_value"] < 0.05
+    assert compare([10 + i / 10 for i in range(20)], [10 + i / 10 for i in range(20)])["p_value"] > 0.5
+
+
+def test_groups_are_compared_separately():
+    samples = pl.LazyFrame({
+        "query_id": ["q1"] * 6 + ["q2"] * 4,
+        "candidate": [True, True, True, False, False, False, True, True, False, False],
+        "duration": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 1.0, 2.0, 1.0, 2.0],
+    })
+    results = compare_samples(samples, ["query_id"]).sort("query_id").collect()
+    assert results["n_candidate"].to_list() == [3, 2]
+    assert results["u"].to_list() == [0, 2]
+
+
+def test_groups_without_baseline_are_dropped():
+    samples = pl.LazyFrame({"query_id": ["q1", "q1"], "candidate": [True, True], "duration": [1.0, 2.0]})
+    assert compare_samples(samples, ["query_id"]).collect().is_empty()
+
+
+def test_ingest_runs(workdir):
+    with ResultSink(str(workdir / "Results" / "tpch" / OG.to_string() / "timed_results"), "run") as sink:
+        sink.write("q1", QueryResult(1, 0.6, QueryRunStatus.SUCCESS, "", samples=[0.5, 0.6]))
+        sink.write("q1", QueryResult(2, 0.0, QueryRunStatus.SKIPPED, ""))
+    assert ingest_runs("tpch", OG) == 1
+    assert ingest_runs("tpch", OG) == 0
+
+    history = scan_history("tpch").collect()
+    assert history["duration"].to_list() == [0.5, 0.6]
+    assert set(history["optimizer"]) == {OG.to_string()}
+    assert set(history["commit"]) == {"unknown"}
@@ -0,0 +1,132 @@
+import itertools
+import math
+
+import pytest
+
+pytest.importorskip("natsort")
+
+from permutations import JoinPermutations, PermutationConfig, PermutationSource, _mask, rank_permutation, \
+    unrank_permutation
+
+
+@pytest.mark.parametrize("n", range(1, 6))
+def test_unrank_matches_itertools_order(n):
+    assert [unrank_permutation(rank, n) for rank in range(math.factorial(n))] == \
+           [list(order) for order in itertools.permutations(range(n))]
+
+
+@pytest.mark.parametrize("n", range(1, 6))
+def test_rank_inverts_unrank(n):
+    assert all(rank_permutation(unrank_permutation(rank, n)) == rank for rank in range(math.factorial(n)))
+
+
+def test_unrank_large_n_without_enumerating():
+    n = 20
+    assert unrank_permutation(0, n) == list(range(n))
+    assert unrank_permutation(math.factorial(n) - 1, n) == list(reversed(range(n)))
+
+
+def test_mask_blanks_parentheses_quotes_and_comments():
+    sql = "SELECT (a, b) FROM t -- x, y\nWHERE c = 'd, e'"
+    masked = _mask(sql)
+    assert len(masked) == len(sql)
+    assert "," not in masked
+    assert masked.index("FROM") == sql.index("FROM")
+    assert masked.index("WHERE") == sql.index("WHERE")
+
+
+def test_parse_comma_list():
+    permutations = JoinPermutations.parse("q1", "SELECT * FROM a, b AS x, c WHERE a.id = x.id ORDER BY 1;")
+    assert permutations.relations == ["a", "b AS x", "c"]
+    assert permutations.prefix == "SELECT * FROM"
+    assert permutations.suffix.startswith("WHERE a.id = x.id ORDER BY 1")
+    assert permutations.count == 6
+
+
+def test_parse_keeps_subqueries_as_one_relation():
+    permutations = JoinPermutations.parse(
+        "q1", "SELECT * FROM (SELECT x FROM s, t) AS sub, u WHERE sub.x IN (SELECT y FROM v, w)")
+    assert permutations.relations == ["(SELECT x FROM s, t) AS sub", "u"]
+    assert "SELECT y FROM v, w" in permutations.suffix
+
+
+def test_parse_moves_join_conditions_to_where():
+    permutations = JoinPermutations.parse(
+        "q1", "SELECT * FROM a JOIN b ON a.id = b.id INNER JOIN c ON b.id = c.id WHERE a.x > 1 LIMIT 5")
+    assert permutations.relations == ["a", "b", "c"]
+    assert permutations.suffix.startswith("WHERE (a.id = b.id) AND (b.id = c.id) AND (a.x > 1)")
+    assert permutations.suffix.rstrip().endswith("LIMIT 5")
+
+
+def test_parse_adds_where_for_join_conditions():
+    permutations = JoinPermutations.parse("q1", "SELECT * FROM a JOIN b ON a.id = b.id GROUP BY 1")
+    assert permutations.suffix.startswith("WHERE (a.id = b.id)")
+    assert "GROUP BY 1" in permutations.suffix
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM a LEFT JOIN b ON a.id = b.id",
+    "SELECT * FROM a FULL OUTER JOIN b ON a.id = b.id",
+    "SELECT * FROM a JOIN b USING (id)",
+    "SELECT * FROM a, LATERAL (SELECT * FROM b WHERE b.id = a.id) AS c",
+])
+def test_parse_rejects_fixed_join_orders(sql):
+    with pytest.raises(ValueError):
+        JoinPermutations.parse("q1", sql)
+
+
+def test_parse_requires_from():
+    with pytest.raises(ValueError):
+        JoinPermutations.parse("q1", "SELECT 1")
+
+
+def test_first_variation_is_the_original_order():
+    permutations = JoinPermutations.parse("q1", "SELECT * FROM a, b, c WHERE a.id = b.id")
+    assert " a, b, c\n" in permutations.query_text(1)
+    assert " c, b, a\n" in permutations.query_text(permutations.count)
+
+
+def test_every_variation_is_a_distinct_order():
+    permutations = JoinPermutations.parse("q1", "SELECT * FROM a, b, c, d")
+    texts = {permutations.query_text(variation_id) for variation_id in permutations.variation_ids()}
+    assert len(texts) == 24
+
+
+def test_sample_is_seeded_and_includes_the_original_order():
+    permutations = JoinPermutations.parse("q1", "SELECT * FROM a, b, c, d, e, f")
+    config = PermutationConfig(sample=10, seed=7)
+    sample = list(permutations.variation_ids(config))
+    assert sample == list(permutations.variation_ids(config))
+    assert len(sample) == len(set(sample)) == 10
+    assert sample[0] == 1
+    assert all(1 <= variation_id <= permutations.count for variation_id in sample)
+    assert sample != list(permutations.variation_ids(PermutationConfig(sample=10, seed=8)))
+
+
+def test_sample_differs_between_queries():
+    config = PermutationConfig(sample=5, seed=0)
+    first = list(JoinPermutations.parse("q1", "SELECT * FROM a, b, c, d, e, f").variation_ids(config))
+    second = list(JoinPermutations.parse("q2", "SELECT * FROM a, b, c, d, e, f").variation_ids(config))
+    assert first != second
+
+
+def test_sample_larger_than_the_permutations_yields_all():
+    permutations = JoinPermutations.parse("q1", "SELECT * FROM a, b, c")
+    assert list(permutations.variation_ids(PermutationConfig(sample=100))) == list(range(1, 7))
+
+
+def test_sample_of_many_relations_does_not_enumerate():
+    permutations = JoinPermutations.parse("q1", "SELECT * FROM " + ", ".join(f"t{i}" for i in range(15)))
+    sample = list(permutations.variation_ids(PermutationConfig(sample=3)))
+    assert len(sample) == 3 and sample[0] == 1
+
+
+def test_source_reads_base_queries(workdir):
+    folder = workdir / "SampleData" / "base_queries" / "tpch"
+    folder.mkdir(parents=True)
+    (folder / "q10.sql").write_text("SELECT * FROM a, b")
+    (folder / "q2.sql").write_text("SELECT * FROM a, b, c")
+    source = PermutationSource("tpch", PermutationConfig(sample=2))
+    assert source.query_ids() == ["q2", "q10"]
+    assert list(source.variation_ids("q10")) == [1, 2]
+    assert " b, a\n" in source.query_text("q10", 2)
@@ -0,0 +1,138 @@
+import json
+import os
+
+import pytest
+
+from optimizer import OG, CD
+from plan_index import PlanIndex, canonicalize_plan, fingerprint_plan
+from plan_store import open_plan_store, plans_folder
+
+
+def scan(table, cardinality=100):
+    return {"name": "SEQ_SCAN ", "children": [],
+            "extra_info": {"Table": table, "Estimated Cardinality": str(cardinality)}}
+
+
+def join(left, right, join_type="INNER"):
+    return {"name": "HASH_JOIN", "children": [left, right], "extra_info": {"Join Type": join_type}}
+
+
+def projection(child):
+    return {"name": "PROJECTION", "children": [child], "extra_info": {"Projections": "#0"}}
+
+
+def write_plan(benchmark, optimizer, query_id, variation_id, plan):
+    folder = os.path.join(plans_folder(benchmark, optimizer), query_id)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, f"{variation_id}.json"), "w") as f:
+        json.dump(plan, f)
+
+
+def test_canonical_plan_keeps_join_tree_only():
+    plan = projection(join(scan("a"), scan("b")))
+    assert canonicalize_plan(plan) == "HASH_JOIN:INNER(SEQ_SCAN(a),SEQ_SCAN(b))"
+
+
+def test_fingerprint_ignores_estimates_and_projections():
+    assert fingerprint_plan(join(scan("a", 1), scan("b", 2))) == \
+           fingerprint_plan(projection(join(scan("a", 10), scan("b", 20))))
+
+
+def test_fingerprint_depends_on_build_side():
+    assert fingerprint_plan(join(scan("a"), scan("b"))) != fingerprint_plan(join(scan("b"), scan("a")))
+
+
+def test_fingerprint_depends_on_join_type():
+    assert fingerprint_plan(join(scan("a"), scan("b"))) != fingerprint_plan(join(scan("a"), scan("b"), "LEFT"))
+
+
+def test_differing_variations(workdir):
+    write_plan("tpch", OG, "q1", "1", join(scan("a"), scan("b")))
+    write_plan("tpch", OG, "q1", "2", join(scan("a"), scan("b")))
+    write_plan("tpch", CD, "q1", "1", join(scan("a"), scan("b")))
+    write_plan("tpch", CD, "q1", "2", join(scan("b"), scan("a")))
+
+    index = PlanIndex.load()
+    assert index.refresh("tpch", OG) == 2
+    assert index.refresh("tpch", CD) == 2
+    assert index.differing_variations("tpch", CD, OG) == {"q1": ["2"]}
+
+
+def test_refresh_skips_unchanged_plans(workdir):
+    write_plan("tpch", OG, "q1", "1", join(scan("a"), scan("b")))
+    index = PlanIndex.load()
+    index.refresh("tpch", OG)
+    assert index.refresh("tpch", OG) == 0
+
+
+def test_refresh_fingerprints_rewritten_plans(workdir):
+    write_plan("tpch", OG, "q1", "1", join(scan("a"), scan("b")))
+    write_plan("tpch", CD, "q1", "1", join(scan("a"), scan("b")))
+    index = PlanIndex.load()
+    index.refresh("tpch", OG)
+    index.refresh("tpch", CD)
+    index.save()
+    assert index.differing_variations("tpch", CD, OG) == {"q1": []}
+
+    path = os.path.join(plans_folder("tpch", CD), "q1", "1.json")
+    stat = os.stat(path)
+    write_plan("tpch", CD, "q1", "1", join(scan("b"), scan("a")))
+    # the rewrite keeps the size and may land within the filesystem's mtime resolution, so move its mtime on
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    index = PlanIndex.load()
+    assert index.refresh("tpch", CD) == 1
+    assert index.differing_variations("tpch", CD, OG) == {"q1": ["1"]}
+
+
+def test_refresh_drops_removed_plans(workdir):
+    write_plan("tpch", OG, "q1", "1", join(scan("a"), scan("b")))
+    write_plan("tpch", OG, "q2", "1", join(scan("a"), scan("b")))
+    index = PlanIndex.load()
+    index.refresh("tpch", OG)
+
+    os.remove(os.path.join(plans_folder("tpch", OG), "q2", "1.json"))
+    os.rmdir(os.path.join(plans_folder("tpch", OG), "q2"))
+    assert index.refresh("tpch", OG) == 1
+    assert index.fingerprints("tpch", OG) == {"q1": {"1": fingerprint_plan(join(scan("a"), scan("b")))}}
+
+
+def test_refresh_fingerprints_reexplained_bundled_plans(workdir):
+    store = open_plan_store("tpch", CD, bundled=True)
+    store.put_many([("q1", "1", json.dumps(join(scan("a"), scan("b"))))])
+    index = PlanIndex.load()
+    index.refresh("tpch", CD)
+    before = index.fingerprints("tpch", CD)["q1"]["1"]
+
+    store.put_many([("q1", "1", json.dumps(join(scan("b"), scan("a"))))])
+    assert index.refresh("tpch", CD) == 1
+    assert index.fingerprints("tpch", CD)["q1"]["1"] != before
+
+
+def test_refresh_migrates_bare_fingerprints(workdir):
+    write_plan("tpch", OG, "q1", "1", join(scan("a"), scan("b")))
+    index = PlanIndex(entries={"tpch": {OG.to_string(): {"q1": {"1": "stale"}}}})
+    assert index.refresh("tpch", OG) == 1
+    assert index.fingerprints("tpch", OG)["q1"]["1"] == fingerprint_plan(join(scan("a"), scan("b")))
+
+
+@pytest.mark.parametrize("rebuild", [False, True])
+def test_save_keeps_other_benchmarks(workdir, rebuild):
+    write_plan("tpch", OG, "q1", "1", join(scan("a"), scan("b")))
+    write_plan("job", OG, "q1", "1", join(scan("a"), scan("b")))
+    first, second = PlanIndex.load(), PlanIndex.load()
+    first.refresh("tpch", OG, rebuild)
+    second.refresh("job", OG, rebuild)
+    first.save()
+    second.save()
+    assert set(PlanIndex.load().entries) == {"tpch", "job"}
+
+
+def test_differing_variations_in_numeric_order(workdir):
+    for variation_id in ["2", "10", "1"]:
+        write_plan("tpch", OG, "q1", variation_id, join(scan("a"), scan("b")))
+        write_plan("tpch", CD, "q1", variation_id, join(scan("b"), scan("a")))
+    index = PlanIndex.load()
+    index.refresh("tpch", OG)
+    index.refresh("tpch", CD)
+    assert index.differing_variations("tpch", CD, OG) == {"q1": ["1", "2", "10"]}
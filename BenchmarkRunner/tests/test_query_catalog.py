@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+pytest.importorskip("natsort")
+
+from query_catalog import CATALOG_FILE, CATALOG_INDEX, CatalogConfig, QueryCatalog, catalog_folder, query_hash
+
+
+def write_variation(root, query_id, variation_id, text):
+    folder = root / "SampleData" / "permuted_queries" / "tpch" / "queries" / query_id
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / f"{variation_id}.sql").write_text(text)
+
+
+@pytest.fixture
+def queries(workdir):
+    write_variation(workdir, "q2", "1", "SELECT 2;")
+    write_variation(workdir, "q10", "1", "SELECT 10;")
+    write_variation(workdir, "q10", "2", "SELECT 'ünicode';")
+    return workdir
+
+
+@pytest.mark.parametrize("memory_map", [True, False])
+def test_reads_every_variation(queries, memory_map):
+    catalog = QueryCatalog.open("tpch", CatalogConfig(memory_map=memory_map))
+    try:
+        assert catalog.query_ids() == ["q2", "q10"]
+        assert catalog.variation_ids("q10") == [1, 2]
+        assert catalog.query_text("q10", 2) == "SELECT 'ünicode';"
+        assert catalog.content_hash("q2", 1) == query_hash("SELECT 2;")
+    finally:
+        catalog.close()
+
+
+def test_rebuilds_when_a_variation_is_added(queries):
+    QueryCatalog.open("tpch").close()
+    write_variation(queries, "q2", "2", "SELECT 22;")
+    folder = queries / "SampleData" / "permuted_queries" / "tpch" / "queries" / "q2"
+    os.utime(folder, (os.path.getatime(folder), os.path.getmtime(folder) + 10))
+
+    catalog = QueryCatalog.open("tpch")
+    assert catalog.query_text("q2", 2) == "SELECT 22;"
+    catalog.close()
+
+
+def test_rebuild_leaves_no_temporary_files(queries):
+    QueryCatalog.open("tpch", CatalogConfig(rebuild=True)).close()
+    assert sorted(os.listdir(catalog_folder("tpch"))) == sorted([CATALOG_FILE, CATALOG_INDEX])
+
+
+def test_query_hash_matches_for_str_and_bytes():
+    assert query_hash("SELECT 1;") == query_hash(b"SELECT 1;")
+    assert query_hash("SELECT 1;") != query_hash("SELECT 2;")
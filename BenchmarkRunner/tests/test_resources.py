@@ -0,0 +1,65 @@
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+
+from resources import ResourceSampling, _directory_size
+
+SPILLING_QUERY = "SELECT count(*) FROM (SELECT range AS a, md5(range::VARCHAR) AS b FROM range(1000000) ORDER BY b)"
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = duckdb.connect(":memory:")
+    conn.execute(f"SET memory_limit = '20MB'; SET threads = 1; SET temp_directory = '{tmp_path / 'spill'}'")
+    yield conn
+    conn.close()
+
+
+def test_directory_size_includes_nested_files(tmp_path):
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "a.tmp").write_bytes(b"x" * 10)
+    (tmp_path / "nested" / "b.tmp").write_bytes(b"x" * 32)
+    assert _directory_size(str(tmp_path)) == 42
+    assert _directory_size(str(tmp_path / "missing")) == 0
+
+
+def test_spill_is_read_from_duckdb(conn, tmp_path):
+    # a file of another connection sharing the temp directory is not the query's spill
+    (tmp_path / "spill").mkdir()
+    with ResourceSampling(interval=0.01, temp_directory=str(tmp_path / "spill")).sampler(conn) as sampler:
+        with open(tmp_path / "spill" / "other.tmp", "wb") as f:
+            f.truncate(1 << 40)
+        conn.execute(SPILLING_QUERY).fetchall()
+    assert 0 < sampler.usage.spill_bytes < 1 << 40
+
+
+def test_no_spill_without_pressure(conn):
+    with ResourceSampling(interval=0.01).sampler(conn) as sampler:
+        conn.execute("SELECT 42").fetchall()
+    assert sampler.usage.spill_bytes == 0
+
+
+class NoTemporaryFiles:
+    """ a connection of a duckdb without duckdb_temporary_files() """
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        raise RuntimeError("no such table function")
+
+    def close(self):
+        pass
+
+
+def test_falls_back_to_the_temp_directory(tmp_path):
+    with ResourceSampling(interval=0, temp_directory=str(tmp_path)).sampler(NoTemporaryFiles()) as sampler:
+        (tmp_path / "nested").mkdir()
+        (tmp_path / "nested" / "spill.tmp").write_bytes(b"x" * 100)
+    assert sampler.usage.spill_bytes == 100
+
+
+def test_spill_is_unknown_without_connection_or_directory():
+    with ResourceSampling(interval=0).sampler() as sampler:
+        pass
+    assert sampler.usage.spill_bytes is None
@@ -0,0 +1,51 @@
+import math
+
+import pytest
+
+pl = pytest.importorskip("polars")
+duckdb = pytest.importorskip("duckdb")
+pytest.importorskip("natsort")
+
+import test_case as runner
+from motherduck import LocalResultStore
+from scaling import CROSSOVERS_FILE, CURVES_FILE, crossovers, fit_curves, save_scaling
+
+
+def results(optimizer, coefficient, exponent):
+    return pl.DataFrame({
+        "scale_factor": [1.0, 10.0, 100.0],
+        "optimizer": [optimizer] * 3,
+        "query_id": ["q1"] * 3,
+        "variation_id": [1] * 3,
+        "duration": [coefficient * scale_factor ** exponent for scale_factor in [1.0, 10.0, 100.0]],
+    })
+
+
+def test_fit_curves_recovers_power_laws():
+    curves = fit_curves(pl.concat([results("HEURISTIC", 2.0, 1.0), results("CARDINALITY", 8.0, 0.5)]))
+    curve = curves.filter(pl.col("optimizer") == "CARDINALITY").row(0, named=True)
+    assert curve["exponent"] == pytest.approx(0.5)
+    assert math.exp(curve["intercept"]) == pytest.approx(8.0)
+    assert curve["r_squared"] == pytest.approx(1.0)
+
+
+def test_crossover_of_two_curves():
+    curves = fit_curves(pl.concat([results("HEURISTIC", 2.0, 1.0), results("CARDINALITY", 8.0, 0.5)]))
+    crossing = crossovers(curves, "HEURISTIC").row(0, named=True)
+    # 2 * sf = 8 * sf ** 0.5 at sf = 16
+    assert crossing["crossover_scale_factor"] == pytest.approx(16.0)
+    assert crossing["faster_beyond"] == "CARDINALITY"
+    assert not crossing["extrapolated"]
+
+
+def test_save_scaling_writes_both_tables(tmp_path):
+    curves = fit_curves(pl.concat([results("HEURISTIC", 2.0, 1.0), results("CARDINALITY", 8.0, 0.5)]))
+    curves.write_parquet(tmp_path / CURVES_FILE)
+    crossovers(curves, "HEURISTIC").write_parquet(tmp_path / CROSSOVERS_FILE)
+    store = LocalResultStore(str(tmp_path / "results.duckdb"))
+
+    save_scaling(runner.TestCase("tpch", result_store=store), str(tmp_path))
+    with duckdb.connect(store.path) as conn:
+        assert conn.execute("SELECT count(*) FROM tpch.scaling_curves").fetchone()[0] == 2
+        assert conn.execute("SELECT crossover_scale_factor FROM tpch.scaling_crossovers").fetchone()[0] == \
+               pytest.approx(16.0)
@@ -0,0 +1,87 @@
+import json
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("natsort")
+
+import test_case as runner
+from motherduck import LocalBackend
+from result_sink import read_results
+from scheduler import InterleaveConfig, WorkerFailure, _receive, run_interleaved
+from test_case import CD, OG, QueryRunStatus, RepetitionPolicy, TimeoutPolicy
+
+SLOW_QUERY = "SELECT count(*) FROM range(1000000000) AS a(x), range(1000) AS b(y) WHERE x + y < 0;"
+
+
+def write_benchmark(root, queries):
+    folder = root / "SampleData" / "permuted_queries" / "tpch" / "queries" / "q1"
+    folder.mkdir(parents=True)
+    for variation_id, text in queries.items():
+        (folder / f"{variation_id}.sql").write_text(text)
+    (root / "Indexes" / "tpch").mkdir(parents=True)
+    (root / "Indexes" / "tpch" / f"{OG.to_string()}.json").write_text(json.dumps({"q1": list(queries)}))
+
+
+def interleave(database, timeouts=TimeoutPolicy(), seconds=60):
+    """ runs OG and CD interleaved in a thread, failing instead of hanging when the run does not finish """
+    test_case = runner.TestCase("tpch", run_id="run", backend=LocalBackend(database=database), timeouts=timeouts,
+                                repetition=RepetitionPolicy(min_runs=1, max_runs=1))
+    paths = {}
+    thread = threading.Thread(target=lambda: paths.update(
+        run_interleaved([OG, CD], test_case, 10_000, InterleaveConfig(rounds=1, seed=0))))
+    thread.start()
+    return thread, paths
+
+
+def statuses(path):
+    return {int(result["variation_id"]): result["status"] for result in read_results(path)}
+
+
+def test_receive_from_an_exited_worker():
+    parent_end, worker_end = multiprocessing.Pipe()
+    worker_end.close()
+    assert isinstance(_receive(parent_end), WorkerFailure)
+
+
+def test_interleaves_every_optimizer(workdir, local_database):
+    write_benchmark(workdir, {1: "SELECT count(*) FROM local.t;", 2: "SELECT 2;"})
+    thread, paths = interleave(local_database)
+    thread.join(60)
+    assert not thread.is_alive()
+    assert [statuses(paths[optimizer.to_string()]) for optimizer in [OG, CD]] == \
+           [{1: QueryRunStatus.SUCCESS.name, 2: QueryRunStatus.SUCCESS.name}] * 2
+
+
+def test_workers_that_cannot_connect_are_dropped(workdir):
+    write_benchmark(workdir, {1: "SELECT 1;"})
+    thread, paths = interleave("/nonexistent/x.db")
+    thread.join(60)
+    assert not thread.is_alive()
+    assert all(statuses(path) == {} for path in paths.values())
+
+
+def test_killed_workers_are_dropped(workdir, local_database):
+    write_benchmark(workdir, {1: SLOW_QUERY, 2: "SELECT 2;"})
+    thread, paths = interleave(local_database)
+    deadline = time.monotonic() + 30
+    while len(multiprocessing.active_children()) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(1)
+    for worker in multiprocessing.active_children():
+        worker.kill()
+    thread.join(60)
+    assert not thread.is_alive()
+    assert all(QueryRunStatus.SUCCESS.name not in statuses(path).values() for path in paths.values())
+
+
+def test_skips_after_the_as_written_variation_timed_out(workdir, local_database):
+    write_benchmark(workdir, {1: SLOW_QUERY, 7: "SELECT 7;"})
+    thread, paths = interleave(local_database, TimeoutPolicy(query_timeout=0.2, skip_after_baseline_timeout=True))
+    thread.join(60)
+    assert not thread.is_alive()
+    assert all(statuses(path) == {1: QueryRunStatus.TIMEOUT.name, 7: QueryRunStatus.SKIPPED.name}
+               for path in paths.values())
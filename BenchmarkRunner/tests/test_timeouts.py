@@ -0,0 +1,81 @@
+import json
+import time
+
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("natsort")
+
+import test_case as runner
+from motherduck import LocalBackend
+from result_sink import read_results
+from test_case import QueryRunStatus, RepetitionPolicy, TimeoutPolicy
+
+TIMEOUT = QueryRunStatus.TIMEOUT.name
+SUCCESS = QueryRunStatus.SUCCESS.name
+
+
+@pytest.fixture
+def test_case():
+    return runner.TestCase("tpch", timeouts=TimeoutPolicy(skip_after_baseline_timeout=True))
+
+
+def test_skips_after_the_as_written_variation_timed_out(test_case):
+    statuses = {("q1", "1"): TIMEOUT}
+    assert test_case._skip_reason("q1", [4], statuses, None) == "Baseline [q1][1] timed out"
+    assert test_case._skip_reason("q1", [1], statuses, None) is None
+    assert test_case._skip_reason("q2", [4], statuses, None) is None
+
+
+def test_dp_index_whose_first_entry_is_not_the_baseline(test_case):
+    # a differentiating index of a DP optimizer, the first variation is an arbitrary permutation
+    variations = {"q1": [7, 12, 30]}
+    statuses = {("q1", str(variations["q1"][0])): TIMEOUT}
+    assert all(test_case._skip_reason("q1", [variation_id], statuses, None) is None
+               for variation_id in variations["q1"][1:])
+
+
+def test_dedup_class_holding_the_baseline_is_not_skipped(test_case):
+    assert test_case._skip_reason("q1", [3, 1], {("q1", "1"): TIMEOUT}, None) is None
+
+
+def test_no_skip_when_disabled_or_the_baseline_succeeded(test_case):
+    assert test_case._skip_reason("q1", [4], {("q1", "1"): SUCCESS}, None) is None
+    test_case.timeouts = TimeoutPolicy()
+    assert test_case._skip_reason("q1", [4], {("q1", "1"): TIMEOUT}, None) is None
+
+
+def test_skips_after_the_deadline(test_case):
+    assert test_case._skip_reason("q1", [1], {}, time.perf_counter() - 1) == "Benchmark deadline passed"
+    assert test_case._skip_reason("q1", [1], {}, time.perf_counter() + 60) is None
+
+
+SLOW_QUERY = "SELECT count(*) FROM range(1000000000) AS a(x), range(1000) AS b(y) WHERE x + y < 0;"
+
+
+def write_benchmark(root, queries, index):
+    for variation_id, text in queries.items():
+        folder = root / "SampleData" / "permuted_queries" / "tpch" / "queries" / "q1"
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / f"{variation_id}.sql").write_text(text)
+    (root / "Indexes" / "tpch").mkdir(parents=True)
+    (root / "Indexes" / "tpch" / f"{runner.CD.to_string()}.json").write_text(json.dumps({"q1": index}))
+
+
+def run_statuses(local_database):
+    benchmark = runner.TestCase("tpch", run_id="run", backend=LocalBackend(database=local_database),
+                                timeouts=TimeoutPolicy(query_timeout=0.2, skip_after_baseline_timeout=True),
+                                repetition=RepetitionPolicy(min_runs=1, max_runs=1))
+    with benchmark.result_sink(runner.CD) as sink:
+        benchmark._run(runner.CD, sink)
+    return {int(result["variation_id"]): result["status"] for result in read_results(sink.path)}
+
+
+def test_run_skips_after_the_as_written_variation(workdir, local_database):
+    write_benchmark(workdir, {1: SLOW_QUERY, 7: "SELECT 7;"}, [1, 7])
+    assert run_statuses(local_database) == {1: TIMEOUT, 7: QueryRunStatus.SKIPPED.name}
+
+
+def test_run_of_a_dp_index_without_the_as_written_variation(workdir, local_database):
+    write_benchmark(workdir, {7: SLOW_QUERY, 12: "SELECT 12;"}, [7, 12])
+    assert run_statuses(local_database) == {7: TIMEOUT, 12: SUCCESS}
@@ -0,0 +1,47 @@
+import datetime
+import json
+import os
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("natsort")
+
+from optimizer import CD, OG
+from result_sink import RESULT_SUFFIX
+import test_case as runner
+from test_case import ROWS_FINGERPRINT, fingerprint_rows
+from verification import find_fingerprint_mismatches
+
+
+def write_fingerprints(test_case, optimizer, fingerprints):
+    folder = test_case.results_folder(optimizer)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, test_case.run_id + RESULT_SUFFIX), "w") as f:
+        for variation_id, fingerprint in fingerprints.items():
+            f.write(json.dumps({"query_id": "q1", "variation_id": variation_id,
+                                "result_fingerprint": fingerprint}) + "\n")
+
+
+def test_fingerprint_ignores_row_order():
+    rows = [(1, "a", Decimal("1.50")), (2, "b", None), (3, "c", datetime.date(1995, 3, 15))]
+    assert fingerprint_rows(rows) == fingerprint_rows(list(reversed(rows)))
+
+
+def test_fingerprint_counts_duplicate_rows():
+    assert fingerprint_rows([(1,), (1,)]) != fingerprint_rows([(1,)])
+    assert fingerprint_rows([(1,), (1,)]).startswith(ROWS_FINGERPRINT + "2:")
+
+
+def test_fingerprint_depends_on_values():
+    assert fingerprint_rows([(1, 2.0)]) != fingerprint_rows([(1, 2.5)])
+    assert fingerprint_rows([]) == ROWS_FINGERPRINT + "0:0"
+
+
+def test_mismatches_compare_fingerprints_of_the_same_kind(workdir):
+    test_case = runner.TestCase("tpch", run_id="run")
+    write_fingerprints(test_case, OG, {"1": "2:10", "2": "2:10", "3": fingerprint_rows([(1,), (2,)])})
+    write_fingerprints(test_case, CD, {"1": "2:10", "2": "2:11", "3": "2:10"})
+    mismatches = find_fingerprint_mismatches(test_case, [OG, CD], OG)
+    assert [mismatch["variation_id"] for mismatch in mismatches[CD.to_string()]] == ["2"]
@@ -0,0 +1,57 @@
+import sqlite3
+import time
+from contextlib import closing
+
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("natsort")
+
+from work_queue import SCHEMA, TaskState, WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    with closing(sqlite3.connect(path)) as conn:
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT INTO tasks (optimizer, query_id, variation_id) VALUES (?, ?, ?)",
+                         [("HEURISTIC", "q1", str(variation_id)) for variation_id in range(1, 4)])
+        conn.execute("INSERT INTO settings VALUES ('created_at', ?)", (str(time.time()),))
+        conn.commit()
+    return WorkQueue(path, lease_seconds=60, max_attempts=2)
+
+
+def test_workers_never_lease_the_same_task(queue):
+    first = queue.lease("a", limit=2)
+    second = queue.lease("b", limit=2)
+    assert len(first) == 2 and len(second) == 1
+    assert not {task.id for task in first} & {task.id for task in second}
+    assert queue.lease("c") == []
+    assert queue.leased() == 3
+
+
+def test_failed_task_returns_until_max_attempts(queue):
+    task = queue.lease("a", limit=3)[0]
+    queue.fail(task, "boom")
+    assert queue.leased() == 2
+    retried = [leased for leased in queue.lease("b", limit=3) if leased.id == task.id]
+    assert retried
+    queue.fail(retried[0], "boom")
+    assert queue.progress()["counts"]["HEURISTIC"][TaskState.FAILED.value] == 1
+
+
+def test_expired_lease_is_leased_again(queue):
+    queue.lease_seconds = -1
+    first = queue.lease("a", limit=3)
+    queue.lease_seconds = 60
+    assert {task.id for task in queue.lease("b", limit=3)} == {task.id for task in first}
+
+
+def test_progress_counts_throughput_since_creation(queue):
+    for task in queue.lease("a", limit=3):
+        queue.complete(task, {"query_id": task.query_id})
+    progress = queue.progress(window=300.0)
+    assert progress["remaining"] == 0
+    # three tasks done within the few milliseconds since the queue was created, not spread over the window
+    assert progress["tasks_per_second"] > 3 / 300.0
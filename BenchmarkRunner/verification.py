@@ -0,0 +1,73 @@
+import os
+import glob
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from test_case import *
+from result_sink import RESULT_SUFFIX, read_results
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+def _result_file(test_case: TestCase, optimizer: Optimizer) -> Optional[str]:
+    """ the result file of test_case.run_id, or the latest run of the optimizer """
+    results_folder = test_case.results_folder(optimizer)
+    if test_case.run_id:
+        path = os.path.join(results_folder, test_case.run_id + RESULT_SUFFIX)
+        return path if os.path.exists(path) else None
+
+    result_files = sorted(glob.glob(os.path.join(results_folder, "*" + RESULT_SUFFIX)))
+    return result_files[-1] if result_files else None
+
+
+def load_fingerprints(test_case: TestCase, optimizer: Optimizer) -> Dict[Tuple[str, str], str]:
+    result_file = _result_file(test_case, optimizer)
+    if not result_file:
+        return {}
+    return {
+        (result["query_id"], str(result["variation_id"])): result["result_fingerprint"]
+        for result in read_results(result_file)
+        if result.get("result_fingerprint")
+    }
+
+
+def find_fingerprint_mismatches(test_case: TestCase, optimizers: List[Optimizer],
+                                baseline_optimizer: Optimizer) -> Dict[str, List[Dict[str, str]]]:
+    """
+    compares the result fingerprint of every variation against the baseline's,
+    writes the mismatches of every optimizer to Results/<benchmark>/verification.json and returns them
+    """
+    baseline = load_fingerprints(test_case, baseline_optimizer)
+
+    mismatches = {}
+    for optimizer in optimizers:
+        if optimizer == baseline_optimizer:
+            continue
+
+        mismatches[optimizer.to_string()] = []
+        for (query_id, variation_id), fingerprint in load_fingerprints(test_case, optimizer).items():
+            expected = baseline.get((query_id, variation_id))
+            if expected is None or expected == fingerprint:
+                continue
+            if expected.startswith(ROWS_FINGERPRINT) != fingerprint.startswith(ROWS_FINGERPRINT):
+                # FETCHALL fingerprints the fetched rows, the other modes fingerprint inside duckdb
+                logger.warning(f"[{query_id}][{variation_id}] was run in different consumption modes for "
+                               f"{optimizer.to_string()} and {baseline_optimizer.to_string()}, not compared")
+                continue
+            logger.error(f"[{query_id}][{variation_id}] returns a different result for "
+                         f"{optimizer.to_string()} than {baseline_optimizer.to_string()}")
+            mismatches[optimizer.to_string()].append({
+                "query_id": query_id,
+                "variation_id": variation_id,
+                "expected": expected,
+                "actual": fingerprint,
+            })
+
+    report_path = os.path.join(RESULT_ROOT, test_case.benchmark, "verification.json")
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, "w") as f:
+        json.dump(mismatches, f, indent=4)
+
+    return mismatches
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import socket
+import multiprocessing
+import sqlite3
+import logging
+from contextlib import closing, contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from test_case import *
+from parallel import _configure_worker
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    optimizer TEXT NOT NULL,
+    query_id TEXT NOT NULL,
+    variation_id TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    finished_at REAL,
+    error TEXT,
+    result TEXT,
+    UNIQUE (optimizer, query_id, variation_id)
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, optimizer);
+CREATE TABLE IF NOT EXISTS run_metadata (
+    optimizer TEXT PRIMARY KEY,
+    metadata TEXT NOT NULL
+);
+"""
+
+
+class TaskState(Enum):
+    PENDING = "pending"
+    LEASED = "leased"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class Task:
+    id: int
+    optimizer: str
+    query_id: str
+    variation_id: str
+
+
+@dataclass
+class WorkQueue:
+    """
+    (optimizer, query, variation) tasks of a benchmark run in a sqlite file shared by any number of workers.
+    a worker leases tasks for lease_seconds, an expired lease returns its task to the queue until it has been
+    attempted max_attempts times. workers on other hosts need the file on a filesystem with working locks
+    """
+    path: str
+    lease_seconds: float = 600.0
+    max_attempts: int = 3
+
+    @contextmanager
+    def _transaction(self, write: bool = True):
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            # writers take the write lock up front, so two workers never lease the same task.
+            # readers use a deferred transaction and do not wait for writers
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    @classmethod
+    def create(cls, path: str, test_case: TestCase, optimizers: List[Optimizer], bridge_cost: int, **kwargs):
+        """ queues every variation in the index of every optimizer, tasks already queued are kept """
+        queue = cls(path, **kwargs)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        run_id = test_case.run_id or datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        with closing(sqlite3.connect(path, timeout=60)) as conn:
+            conn.executescript(SCHEMA)
+        with queue._transaction() as conn:
+            settings = {"benchmark": test_case.benchmark, "run_id": run_id, "bridge_cost": str(bridge_cost),
+                        "created_at": str(time.time())}
+            for key, value in settings.items():
+                conn.execute("INSERT OR IGNORE INTO settings VALUES (?, ?)", (key, value))
+
+            added = 0
+            for optimizer in optimizers:
+                variations = test_case._collect_variations_from_file(optimizer)
+                added += conn.executemany(
+                    "INSERT OR IGNORE INTO tasks (optimizer, query_id, variation_id) VALUES (?, ?, ?)",
+                    [
+                        (optimizer.to_string(), query_id, str(variation_id))
+                        for query_id in test_case.query_ids()
+                        for variation_id in variations.get(query_id, [])
+                    ]
+                ).rowcount
+        logger.info(f"Queued {added} tasks of [{test_case.benchmark}] in {path}")
+        return queue
+
+    def settings(self) -> Dict[str, str]:
+        with self._transaction(write=False) as conn:
+            return dict(conn.execute("SELECT key, value FROM settings").fetchall())
+
+    def lease(self, worker: str, limit: int = 1, optimizer: Optional[str] = None) -> List[Task]:
+        """ leases up to limit tasks, preferring the given optimizer so a worker can keep its connection """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET state = ?, error = 'lease expired' "
+                "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (TaskState.FAILED.value, TaskState.LEASED.value, now, self.max_attempts)
+            )
+            rows = conn.execute(
+                "SELECT id, optimizer, query_id, variation_id FROM tasks "
+                "WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                "ORDER BY optimizer = ? DESC, id LIMIT ?",
+                (TaskState.PENDING.value, TaskState.LEASED.value, now, optimizer, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                [(TaskState.LEASED.value, worker, now + self.lease_seconds, row[0]) for row in rows]
+            )
+        return [Task(*row) for row in rows]
+
+    def complete(self, task: Task, record: Dict[str, Any]):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET state = ?, finished_at = ?, result = ?, error = NULL WHERE id = ?",
+                (TaskState.DONE.value, time.time(), json.dumps(record), task.id)
+            )
+
+    def fail(self, task: Task, error: str):
+        """ returns the task to the queue, or gives up on it after max_attempts """
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "error = ?, worker = NULL, lease_expires = NULL WHERE id = ?",
+                (self.max_attempts, TaskState.FAILED.value, TaskState.PENDING.value, error, task.id)
+            )
+
+    def leased(self) -> int:
+        """ tasks currently leased by any worker, they may still fail or expire back into the queue """
+        with self._transaction(write=False) as conn:
+            return conn.execute("SELECT count(*) FROM tasks WHERE state = ?", (TaskState.LEASED.value,)).fetchone()[0]
+
+    def record_metadata(self, optimizer: str, metadata: Dict[str, Any]):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO run_metadata VALUES (?, ?)", (optimizer, json.dumps(metadata)))
+
+    def progress(self, window: float = 300.0) -> Dict[str, Any]:
+        """
+        task counts per optimizer and state, throughput over the last window seconds, or since the queue was
+        created if that is more recent, and the estimated time left
+        """
+        now = time.time()
+        with self._transaction(write=False) as conn:
+            created_at = conn.execute("SELECT value FROM settings WHERE key = 'created_at'").fetchone()
+            counts: Dict[str, Dict[str, int]] = {}
+            for optimizer, state, count in conn.execute(
+                    "SELECT optimizer, state, count(*) FROM tasks GROUP BY optimizer, state"):
+                counts.setdefault(optimizer, {})[state] = count
+            recent = conn.execute("SELECT count(*) FROM tasks WHERE state = ? AND finished_at >= ?",
+                                  (TaskState.DONE.value, now - window)).fetchone()[0]
+            workers = conn.execute("SELECT count(DISTINCT worker) FROM tasks WHERE state = ? AND lease_expires >= ?",
+                                   (TaskState.LEASED.value, now)).fetchone()[0]
+
+        remaining = sum(by_state.get(TaskState.PENDING.value, 0) + by_state.get(TaskState.LEASED.value, 0)
+                        for by_state in counts.values())
+        # queues created before the creation time was recorded use the full window
+        elapsed = min(window, now - float(created_at[0])) if created_at else window
+        throughput = recent / elapsed if elapsed > 0 else 0.0
+        return {
+            "counts": counts,
+            "remaining": remaining,
+            "active_workers": workers,
+            "tasks_per_second": throughput,
+            "eta_seconds": remaining / throughput if throughput else None,
+        }
+
+    def export_results(self, test_case: TestCase) -> Dict[str, str]:
+        """ writes the finished tasks into the usual result file of every optimizer, returns their paths """
+        run_id = self.settings()["run_id"]
+        with self._transaction(write=False) as conn:
+            rows = conn.execute("SELECT optimizer, result FROM tasks WHERE state = ? ORDER BY id",
+                                (TaskState.DONE.value,)).fetchall()
+            metadata = dict(conn.execute("SELECT optimizer, metadata FROM run_metadata").fetchall())
+
+        paths: Dict[str, str] = {}
+        by_optimizer: Dict[str, List[Dict[str, Any]]] = {}
+        for optimizer, result in rows:
+            by_optimizer.setdefault(optimizer, []).append(json.loads(result))
+        for optimizer, records in by_optimizer.items():
+            with ResultSink(test_case.results_folder(Optimizer.from_string(optimizer)), run_id) as sink:
+                if optimizer in metadata:
+                    sink.write_metadata(json.loads(metadata[optimizer]))
+                exported = sink.completed()
+                for record in records:
+                    if (record["query_id"], str(record["variation_id"])) not in exported:
+                        sink.write_record(record)
+            paths[optimizer] = sink.path
+        return paths
+
+
+def run_worker(queue: WorkQueue, test_case: TestCase, worker: Optional[str] = None, batch_size: int = 1,
+               poll_seconds: float = 5.0) -> int:
+    """
+    leases and executes tasks until the queue is drained, returns how many this worker completed.
+    while other workers still hold leases, it polls every poll_seconds, their tasks may fail or expire back
+    into the queue. the connection is kept while consecutive tasks share an optimizer and reopened when it changes
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    settings = queue.settings()
+    if settings["benchmark"] != test_case.benchmark:
+        raise ValueError(f"Queue {queue.path} holds {settings['benchmark']}, not {test_case.benchmark}")
+    bridge_cost = int(settings["bridge_cost"])
+
+    conn = None
+    current = None
+    completed = 0
+    try:
+        while True:
+            tasks = queue.lease(worker, batch_size, current)
+            if not tasks:
+                if not queue.leased():
+                    break
+                time.sleep(poll_seconds)
+                continue
+            for task in tasks:
+                if task.optimizer != current:
+                    if conn is not None:
+                        conn.close()
+                    optimizer = Optimizer.from_string(task.optimizer)
+                    configured = _configure_worker(optimizer, test_case, bridge_cost)
+                    conn = configured._connect()
+                    queue.record_metadata(task.optimizer, configured._run_metadata(optimizer, conn,
+                                                                                   settings["run_id"]))
+                    resources = configured._resource_sampling(conn)
+                    repetition = configured._cache_repetition()
+                    current = task.optimizer
+
+                try:
+                    conn = configured._prepare_connection(conn)
+                    variation = configured.variation(False, task.query_id, task.variation_id)
+                    result = variation.run(conn, repetition, configured.timeouts.timeout_for(task.query_id, None),
+                                           configured.consumption_mode, resources, configured.verify_results,
+                                           configured.prepare_statements)
+                    result.cache_mode = configured.cache_mode
+                except Exception as e:
+                    logger.error(f"[{worker}] task {task.id} [{task.query_id}][{task.variation_id}] failed: {e}")
+                    queue.fail(task, str(e))
+                    continue
+                queue.complete(task, {"query_id": task.query_id, **result.to_dict()})
+                completed += 1
+    finally:
+        if conn is not None:
+            conn.close()
+
+    logger.info(f"[{worker}] completed {completed} tasks, queue drained")
+    return completed
+
+
+def run_local_workers(queue: WorkQueue, test_case: TestCase, n_workers: int, batch_size: int = 1):
+    """ drains the queue with n_workers spawned processes on this host, other hosts may join at any time """
+    ctx = multiprocessing.get_context("spawn")
+    workers = [
+        ctx.Process(target=run_worker, args=(queue, test_case, None, batch_size))
+        for _ in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    logger.info(f"Queue progress: {queue.progress()}")